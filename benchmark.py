@@ -0,0 +1,323 @@
+from flycatcher.synthetic import generate_flight_data, PRICE_DISTRIBUTIONS
+from flycatcher.storage import load_flight_data, load_flight_table, save_flight_data
+from flycatcher.flight_table import FlightTable
+from flycatcher.mock_fare_api import MockFareApi
+from cheapest_flights import find_cheapest_flights, build_route_index, TripFormatter
+from ryanair_downloader import RyanairDownloader, get_ryanair_flight_data
+from collections import Counter
+from datetime import datetime, timedelta
+import numpy as np
+import statistics
+import tempfile
+import tracemalloc
+import platform
+import argparse
+import logging
+import json
+import time
+import sys
+import os
+
+BENCHMARKS = ('load_pickle', 'load_json', 'load_binary', 'build_table', 'build_index', 'search_full',
+              'search_top_n_index', 'search_top_n_vectorized', 'search_top_n_top_k', 'format')
+
+
+def run_benchmarks(data, benchmarks=BENCHMARKS, repeat: int = 5, n: int = 10):
+    """
+    Times every benchmark `repeat` times and measures its peak memory in a separate run, because tracing
+    allocations slows the code down.
+    :param data: data in the flight data format
+    :param benchmarks: names of the benchmarks to run, see `BENCHMARKS`
+    :param repeat: number of timed runs of every benchmark. Default: 5.
+    :param n: number of round-trips of top-n searches. Default: 10.
+    :return: dictionary benchmark -> results
+    """
+    # search from the airport with most flights, the origin of downloaded flight data
+    origin = Counter(flight['origin'] for flight in data['flights']).most_common(1)[0][0]
+    table = FlightTable.from_flight_data(data)
+    # round-trips are found upfront so that the `format` benchmark times only the formatting
+    formatter = TripFormatter({airport['id']: airport for airport in data['airports']})
+    trips = list(find_cheapest_flights(data, origin, n=1000)) if 'format' in benchmarks else []
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = {extension: os.path.join(directory, 'flights' + extension)
+                 for extension in ('.p', '.json', '.flights')}
+        for path in paths.values():
+            save_flight_data(data, path)
+
+        # the table of vectorized searches is built upfront, its route index on first use like in the server
+        cases = {
+            'load_pickle': lambda: load_flight_data(paths['.p']),
+            'load_json': lambda: load_flight_data(paths['.json']),
+            'load_binary': lambda: load_flight_table(paths['.flights']),
+            'build_table': lambda: FlightTable.from_flight_data(data),
+            'build_index': lambda: build_route_index(data['flights']),
+            'search_full': lambda: sum(1 for _ in find_cheapest_flights(data, origin)),
+            'search_top_n_index': lambda: list(find_cheapest_flights(data, origin, n=n)),
+            'search_top_n_vectorized': lambda: list(find_cheapest_flights(table, origin, n=n,
+                                                                          algorithm='vectorized')),
+            'search_top_n_top_k': lambda: list(find_cheapest_flights(table, origin, n=n, algorithm='top_k')),
+            'format': lambda: [formatter.format(to_flight, from_flight) for to_flight, from_flight in trips]
+        }
+
+        for name in benchmarks:
+            logging.info('Running %s.' % name)
+            times = []
+
+            for _ in range(repeat):
+                start = time.perf_counter()
+                cases[name]()
+                times.append(time.perf_counter() - start)
+
+            tracemalloc.start()
+            cases[name]()
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            results[name] = {
+                'times': times,
+                'min': min(times),
+                'median': statistics.median(times),
+                'peak_memory': peak_memory
+            }
+
+    return results
+
+
+def run_download_benchmark(data,
+                           repeat: int = 1,
+                           latency: float = 0,
+                           latency_jitter: float = 0,
+                           error_rate: float = 0,
+                           server_requests_per_second: float = None,
+                           compress: bool = True,
+                           workers: int = 4,
+                           requests_per_second: float = 1000,
+                           backoff: float = 0.1):
+    """
+    Downloads the flight data of its origin from a `MockFareApi` with `get_ryanair_flight_data` `repeat` times.
+    :param data: data in the flight data format, flights must start on the current day
+    :param repeat: number of timed downloads. Default: 1.
+    :param latency: number of seconds every response of the server is delayed. Default: 0.
+    :param latency_jitter: maximal number of seconds added to the latency at random. Default: 0.
+    :param error_rate: probability of a server error. Default: 0.
+    :param server_requests_per_second: number of requests per second the server answers before throttling.
+    By default the server does not throttle.
+    :param compress: whether the server compresses responses. Default: True.
+    :param workers: number of concurrent requests. Default: 4.
+    :param requests_per_second: rate limit of the downloader. Default: 1000.
+    :param backoff: base delay in seconds between retries. Default: 0.1.
+    :return: dictionary with results of the `download` benchmark
+    """
+    origin = Counter(flight['origin'] for flight in data['flights']).most_common(1)[0][0]
+    last_date = max(flight['date'] for flight in data['flights'])
+    date_from = datetime.combine(datetime.now().date(), datetime.min.time())
+    date_to = max(datetime.strptime(last_date, '%Y-%m-%d'), date_from + timedelta(days=1))
+    times, stats, flights = [], [], []
+
+    for _ in range(repeat):
+        with MockFareApi(('127.0.0.1', 0), data,
+                         latency=latency,
+                         latency_jitter=latency_jitter,
+                         error_rate=error_rate,
+                         requests_per_second=server_requests_per_second,
+                         compress=compress) as server:
+            with RyanairDownloader(api_endpoint=server.url,
+                                   requests_per_second=requests_per_second,
+                                   max_workers=workers,
+                                   adaptive_rate=True,
+                                   backoff=backoff) as downloader:
+                start = time.perf_counter()
+                downloaded = get_ryanair_flight_data(origin, date_from=date_from, date_to=date_to,
+                                                     downloader=downloader)
+                times.append(time.perf_counter() - start)
+
+            stats.append(dict(downloader.stats.as_dict(), server=dict(server.stats)))
+            flights.append(len(downloaded['flights']) if downloaded else 0)
+
+    return {
+        'times': times,
+        'min': min(times),
+        'median': statistics.median(times),
+        'requests_per_second': statistics.median(run['requests_per_second'] for run in stats),
+        'flights': flights,
+        'stats': stats
+    }
+
+
+def compare_results(baseline: dict, results: dict, threshold: float = 0.1):
+    """
+    :param baseline: benchmark results of the baseline run
+    :param results: benchmark results to compare
+    :param threshold: relative increase of median time or peak memory reported as a regression. Default: 0.1.
+    :return: list of (benchmark, metric, baseline value, value, relative change, regression) tuples
+    """
+    comparison = []
+
+    for name in baseline:
+        if name not in results:
+            continue
+
+        for metric in ('median', 'peak_memory'):
+            # download benchmarks do not measure memory
+            if metric not in baseline[name] or metric not in results[name]:
+                continue
+
+            before, after = baseline[name][metric], results[name][metric]
+            change = (after - before) / before if before else 0.0
+            comparison.append((name, metric, before, after, change, change > threshold))
+
+    return comparison
+
+
+def _metadata(args):
+    return {
+        'date': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'parameters': {parameter: value for parameter, value in vars(args).items() if parameter != 'command'}
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic flight data and benchmark the search.')
+    parser.add_argument('--debug', action='store_true', help='show debug messages')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    data_parser = argparse.ArgumentParser(add_help=False)
+    data_parser.add_argument('-airports', type=int, default=50, help='number of airports. Default: 50')
+    data_parser.add_argument('-days', type=int, default=90, help='number of days with flights. Default: 90')
+    data_parser.add_argument('-flights_per_route', type=float, default=1.0,
+                             help='mean number of flights on a route per day. Default: 1')
+    data_parser.add_argument('-origins', type=int, default=1, help='number of origin airports connected with '
+                                                                   'all other airports. Default: 1')
+    data_parser.add_argument('-price_distribution', choices=PRICE_DISTRIBUTIONS, default='lognormal',
+                             help='distribution of flight prices. Default: lognormal')
+    data_parser.add_argument('-mean_price', type=float, default=50, help='mean price of a flight. Default: 50')
+    data_parser.add_argument('-price_spread', type=float, default=0.5,
+                             help='shape of the price distribution. Default: 0.5')
+    data_parser.add_argument('-seed', type=int, default=0, help='seed of the random generator. Default: 0')
+
+    generate_parser = commands.add_parser('generate', parents=[data_parser],
+                                          help='generate synthetic flight data')
+    generate_parser.add_argument('out', type=str, help='path where the flight data should be stored, the format '
+                                                       'is chosen by the file extension')
+
+    run_parser = commands.add_parser('run', parents=[data_parser], help='run benchmarks on synthetic flight data')
+    run_parser.add_argument('-data', type=str, help='benchmark this flight data instead of synthetic flight data')
+    run_parser.add_argument('-benchmarks', type=str, help='comma-separated list of benchmarks to run. '
+                                                          'Available: %s' % ', '.join(BENCHMARKS))
+    run_parser.add_argument('-repeat', type=int, default=5, help='number of timed runs. Default: 5')
+    run_parser.add_argument('-n', type=int, default=10, help='number of round-trips of top-n searches. Default: 10')
+    run_parser.add_argument('-out', type=str, help='path where results should be stored as JSON')
+
+    download_parser = commands.add_parser('download', parents=[data_parser],
+                                          help='benchmark downloads from a local mock of the fare API serving '
+                                               'synthetic flight data')
+    download_parser.add_argument('-data', type=str, help='serve this flight data instead of synthetic flight data, '
+                                                         'flights must start on the current day')
+    download_parser.add_argument('-repeat', type=int, default=1, help='number of timed downloads. Default: 1')
+    download_parser.add_argument('-latency', type=float, default=0,
+                                 help='number of milliseconds every response is delayed. Default: 0')
+    download_parser.add_argument('-latency_jitter', type=float, default=0,
+                                 help='maximal number of milliseconds added to the latency at random. Default: 0')
+    download_parser.add_argument('-error_rate', type=float, default=0,
+                                 help='probability of a server error. Default: 0')
+    download_parser.add_argument('-server_requests_per_second', type=float,
+                                 help='number of requests per second the server answers before responding with '
+                                      '429. By default the server does not throttle')
+    download_parser.add_argument('--no_gzip', action='store_true', help='do not compress responses')
+    download_parser.add_argument('-workers', type=int, default=4, help='number of concurrent requests. Default: 4')
+    download_parser.add_argument('-requests_per_second', type=float, default=1000,
+                                 help='rate limit of the downloader. Default: 1000')
+    download_parser.add_argument('-backoff', type=float, default=0.1,
+                                 help='base delay in seconds between retries. Default: 0.1')
+    download_parser.add_argument('-out', type=str, help='path where results should be stored as JSON')
+
+    compare_parser = commands.add_parser('compare', help='compare results of two benchmark runs')
+    compare_parser.add_argument('baseline', type=str, help='path to results of the baseline run')
+    compare_parser.add_argument('results', type=str, help='path to results to compare')
+    compare_parser.add_argument('-threshold', type=float, default=0.1,
+                                help='relative increase of median time or peak memory reported as '
+                                     'a regression. Default: 0.1')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO,
+                        format='%(asctime)s %(levelname)-8s %(name)-10.10s %(message)s')
+
+    if args.command in ('generate', 'run', 'download') and getattr(args, 'data', None) is None:
+        data = generate_flight_data(airports=args.airports,
+                                    days=args.days,
+                                    flights_per_route=args.flights_per_route,
+                                    origins=args.origins,
+                                    price_distribution=args.price_distribution,
+                                    mean_price=args.mean_price,
+                                    price_spread=args.price_spread,
+                                    seed=args.seed)
+        logging.info('Generated %d flights between %d airports.' % (len(data['flights']), len(data['airports'])))
+
+    if args.command == 'generate':
+        save_flight_data(data, args.out)
+    elif args.command == 'run':
+        if args.data is not None:
+            data = load_flight_data(args.data)
+
+        benchmarks = BENCHMARKS if args.benchmarks is None else args.benchmarks.split(',')
+        unknown = [name for name in benchmarks if name not in BENCHMARKS]
+
+        if unknown:
+            parser.error('unknown benchmarks: %s' % ', '.join(unknown))
+
+        results = run_benchmarks(data, benchmarks=benchmarks, repeat=args.repeat, n=args.n)
+
+        for name, result in results.items():
+            print('%-25s median %10.4f s   min %10.4f s   peak memory %10.1f MB'
+                  % (name, result['median'], result['min'], result['peak_memory'] / 1024 / 1024))
+
+        if args.out is not None:
+            with open(args.out, 'w', encoding='utf-8') as fh:
+                json.dump({'metadata': _metadata(args), 'results': results}, fh, indent=2)
+    elif args.command == 'download':
+        if args.data is not None:
+            data = load_flight_data(args.data)
+
+        results = {'download': run_download_benchmark(data,
+                                                      repeat=args.repeat,
+                                                      latency=args.latency / 1000,
+                                                      latency_jitter=args.latency_jitter / 1000,
+                                                      error_rate=args.error_rate,
+                                                      server_requests_per_second=args.server_requests_per_second,
+                                                      compress=not args.no_gzip,
+                                                      workers=args.workers,
+                                                      requests_per_second=args.requests_per_second,
+                                                      backoff=args.backoff)}
+        result = results['download']
+        last_run = result['stats'][-1]
+
+        print('%-25s median %10.4f s   min %10.4f s   %10.2f requests/s'
+              % ('download', result['median'], result['min'], result['requests_per_second']))
+        print('%-25s %d requests, %d retries, %d throttled, %d failed, %d flights; '
+              'server: %d requests, %d errors, %d throttled'
+              % ('last run', last_run['requests'], last_run['retries'], last_run['throttles'], last_run['failures'],
+                 result['flights'][-1], last_run['server']['requests'], last_run['server']['errors'],
+                 last_run['server']['throttles']))
+
+        if args.out is not None:
+            with open(args.out, 'w', encoding='utf-8') as fh:
+                json.dump({'metadata': _metadata(args), 'results': results}, fh, indent=2)
+    else:
+        with open(args.baseline, encoding='utf-8') as fh:
+            baseline = json.load(fh)['results']
+        with open(args.results, encoding='utf-8') as fh:
+            results = json.load(fh)['results']
+
+        comparison = compare_results(baseline, results, threshold=args.threshold)
+
+        for name, metric, before, after, change, regression in comparison:
+            print('%-25s %-12s %14.4f %14.4f %+8.1f%%%s'
+                  % (name, metric, before, after, change * 100, '   REGRESSION' if regression else ''))
+
+        # a non-zero exit status lets scripts detect regressions
+        sys.exit(1 if any(regression for *_, regression in comparison) else 0)
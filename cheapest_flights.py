@@ -1,11 +1,31 @@
-from datetime import datetime, timedelta
+from flycatcher.binary_format import is_binary_flight_data
+from flycatcher.storage import load_flight_data, load_flight_table
+from flycatcher.flight_table import FlightTable
+from flycatcher.search import vectorized_round_trips, sliding_window_round_trips, top_k_round_trips
+from flycatcher.parallel import parallel_round_trips
+from flycatcher.summary import FlightSummary, load_summary
+from flycatcher.price_matrix import price_matrix, MATRIX_FORMATS
+from flycatcher.open_jaw import group_airports, open_jaw_round_trips
+from flycatcher.profiling import Profile, phase
+from flycatcher.streaming import FlightStream, streaming_round_trips, CHUNK_SIZE
+from flycatcher.incremental import IncrementalRoundTrips, BLOCK_DAYS
+from bisect import bisect_left, bisect_right
+from datetime import datetime
 from setup import ROOT_DIR
-import pickle
+import numpy as np
 import logging
 import heapq
+import json
 import argparse
+import sys
 import os
 
+ALGORITHMS = ('index', 'vectorized', 'sliding_window', 'top_k', 'parallel')
+
+# arguments of `find_cheapest_flights` describing a single query
+QUERY_FIELDS = ('origin', 'n', 'min_days', 'max_days', 'min_date', 'max_date', 'max_price', 'selected_destinations',
+                'excluded_destinations', 'max_flights_per_airport', 'open_jaw')
+
 
 def find_cheapest_flights(flight_data,
                           origin,   # airport id
@@ -17,7 +37,13 @@ def find_cheapest_flights(flight_data,
                           max_price: int = None,
                           selected_destinations: list = None,
                           excluded_destinations: list = None,
-                          max_flights_per_airport: int = None):
+                          max_flights_per_airport: int = None,
+                          open_jaw: bool = False,
+                          algorithm: str = 'index',
+                          workers: int = None,
+                          summary: FlightSummary = None,
+                          airport_groups: dict = None,
+                          profile: Profile = None):
     """
     Finds cheapest round-trip flights according to provided requirements.
     :param flight_data: data in required format, see documentation for details
@@ -35,8 +61,303 @@ def find_cheapest_flights(flight_data,
     Note that both `selected_destinations` and `excluded_destinations` may not be set at the same time
     :param max_flights_per_airport: maximal number of returned round-trip flights per airport.
     By default return all round-trip flights
+    :param open_jaw: also return from other airports of the group of the destination and to other airports of
+    the group of the origin, see `airport_groups`. Open-jaw searches ignore `algorithm`. Default: False.
+    :param algorithm: search algorithm, one of `ALGORITHMS`. `index` searches the flight data directly,
+    `vectorized` joins flights of a columnar `FlightTable` with array broadcasting. `sliding_window` yields only
+    the cheapest round-trip per destination and departure day in time linear in the number of days. `top_k` lazily
+    merges per-flight candidate streams and does only as much work as needed to yield `n` round-trips. `parallel`
+    runs `top_k` on partitions of destinations and departure days in worker processes sharing the flight table.
+    Default: index.
+    :param workers: number of worker processes of the `parallel` algorithm. By default the number of CPUs.
+    :param summary: summary compiled from `flight_data`. Queries with `max_flights_per_airport` 1 are answered
+    from the summary instead of searching the flights. A summary of other flights is ignored, see
+    `FlightSummary.matches`.
+    :param airport_groups: dictionary group -> ids of nearby airports, e.g. airports of the same city.
+    By default airports are grouped by their optional `group` field.
+    :param profile: profile recording the time spent in every phase of the search and search counters.
+    By default the search is not profiled.
+    `flight_data` may also be a `FlightTable`.
+    :return: generator of (flight to X, flight from X) in ascending order by round-trip price
+    """
+    query = {
+        'origin': origin,
+        'n': n,
+        'min_days': min_days,
+        'max_days': max_days,
+        'min_date': min_date,
+        'max_date': max_date,
+        'max_price': max_price,
+        'selected_destinations': selected_destinations,
+        'excluded_destinations': excluded_destinations,
+        'max_flights_per_airport': max_flights_per_airport,
+        'open_jaw': open_jaw
+    }
+
+    yield from find_cheapest_flights_batch(flight_data, [query], algorithm=algorithm, workers=workers,
+                                           summary=summary, airport_groups=airport_groups, profile=profile)[0]
+
+
+def find_cheapest_flights_batch(flight_data,
+                                queries: list,
+                                algorithm: str = 'index',
+                                workers: int = None,
+                                summary: FlightSummary = None,
+                                airport_groups: dict = None,
+                                profile: Profile = None):
+    """
+    Finds cheapest round-trip flights for many queries at once. The flight data is converted, scanned for its date
+    range and indexed once for all queries instead of once per query.
+    :param flight_data: data in required format, see documentation for details
+    :param queries: list of queries, every query is a dictionary of `find_cheapest_flights` arguments
+    (`origin`, `n`, `min_days`, `max_days`, `min_date`, `max_date`, `max_price`, `selected_destinations`,
+    `excluded_destinations`, `max_flights_per_airport`, `open_jaw`). Only `origin` is required.
+    :param algorithm: search algorithm, one of `ALGORITHMS`. Default: index.
+    :param workers: number of worker processes of the `parallel` algorithm. By default the number of CPUs.
+    :param summary: summary compiled from `flight_data`, see `find_cheapest_flights`
+    :param airport_groups: dictionary group -> ids of nearby airports, see `find_cheapest_flights`
+    :param profile: profile of all queries, see `find_cheapest_flights`
+    :return: list of generators of (flight to X, flight from X) in ascending order by round-trip price,
+    one per query
+    """
+    if algorithm not in ALGORITHMS:
+        raise ValueError('`algorithm` must be one of: %s' % ', '.join(ALGORITHMS))
+    if workers is not None and workers <= 0:
+        raise ValueError('`workers` must be larger than 0')
+
+    for query in queries:
+        unknown = set(query) - set(QUERY_FIELDS)
+        if unknown:
+            raise ValueError('unknown query fields: %s' % ', '.join(sorted(unknown)))
+        if 'origin' not in query:
+            raise ValueError('`origin` must be set')
+        _validate_query(**query)
+
+    table = flight_data if isinstance(flight_data, FlightTable) else None
+    flight_table = table
+
+    # open-jaw searches do not use the search algorithm
+    if all(query.get('open_jaw') for query in queries):
+        algorithm = 'vectorized'
+
+    with phase(profile, 'convert'):
+        if algorithm == 'index' and table is not None:
+            flight_data = table.to_flight_data()
+            table = None
+        elif algorithm != 'index' and table is None:
+            table = flight_table = FlightTable.from_flight_data(flight_data)
+
+        # summaries and open-jaw searches work on the flight table
+        if flight_table is None and (summary is not None or any(query.get('open_jaw') for query in queries)):
+            flight_table = FlightTable.from_flight_data(flight_data)
+
+    # flights with other prices or dates would be answered wrongly from the summary
+    if summary is not None and not summary.matches(flight_table):
+        logging.warning('The summary was not compiled from the flight data and is ignored.')
+        summary = None
+
+    # build airport id -> airport mapping
+    airports = {airport['id']: airport for airport in (flight_data['airports'] if table is None else table.airports)}
+
+    if airport_groups is None:
+        airport_groups = group_airports(airports.values())
+
+    for query in queries:
+        if query['origin'] not in airports:
+            raise ValueError('%s is not in the airport list' % query['origin'])
+
+    # the route index also yields the earliest and latest flight dates, so the flights are scanned only once
+    if table is None:
+        with phase(profile, 'index'):
+            index = build_route_index(flight_data['flights'])
+        with phase(profile, 'date_range'):
+            date_range = _date_range(index)
+    else:
+        index = table
+        with phase(profile, 'date_range'):
+            date_range = table.date_range()
+
+    if profile is not None and table is None:
+        profile.count(flights_indexed=len(flight_data['flights']), routes=len(index))
+    elif profile is not None:
+        profile.count(flights_indexed=len(table))
+
+    searches = [_search(index, airports, date_range, algorithm, workers, summary, flight_table, airport_groups,
+                        profile, **query)
+                for query in queries]
+
+    # searches are lazy, their time is spent while round-trips are consumed
+    return searches if profile is None else [profile.iterate('search', search) for search in searches]
+
+
+def find_cheapest_flights_streaming(flight_data,
+                                    origin,   # airport id
+                                    n: int = None,
+                                    min_days: int = None,
+                                    max_days: int = None,
+                                    min_date: datetime = None,
+                                    max_date: datetime = None,
+                                    max_price: int = None,
+                                    selected_destinations: list = None,
+                                    excluded_destinations: list = None,
+                                    max_flights_per_airport: int = None,
+                                    chunk_size: int = CHUNK_SIZE):
+    """
+    Finds cheapest round-trip flights in flight data larger than memory. The flights are read from disk once
+    in date order and only the flights of a sliding window of `max_days` days are kept in memory,
+    see `streaming_round_trips`. Results equal those of `find_cheapest_flights`.
+    Arguments are the same as in `find_cheapest_flights`.
+    :param flight_data: path to flight data stored in the binary flight data format or a `FlightStream`
+    :param chunk_size: number of flight records read from disk at once. Default: 65536.
     :return: generator of (flight to X, flight from X) in ascending order by round-trip price
     """
+    _validate_query(origin=origin, n=n, min_days=min_days, max_days=max_days, min_date=min_date, max_date=max_date,
+                    max_price=max_price, selected_destinations=selected_destinations,
+                    excluded_destinations=excluded_destinations, max_flights_per_airport=max_flights_per_airport)
+
+    stream = flight_data if isinstance(flight_data, FlightStream) else FlightStream(flight_data, chunk_size)
+    airports = {airport['id']: airport for airport in stream.airports}
+
+    if origin not in airports:
+        raise ValueError('%s is not in the airport list' % origin)
+
+    resolved = _resolve_query(airports, stream.date_range(), origin, min_days, max_days, min_date, max_date,
+                              selected_destinations, excluded_destinations)
+
+    # excluding the origin excludes all flights
+    if resolved is None or n == 0:
+        return
+
+    airports, min_date, max_date, min_days, max_days = resolved
+
+    yield from streaming_round_trips(stream,
+                                     origin=origin,
+                                     destinations=list(airports.keys()),
+                                     min_day=min_date.toordinal(),
+                                     max_day=max_date.toordinal(),
+                                     min_days=min_days,
+                                     max_days=max_days,
+                                     max_price=max_price,
+                                     max_flights_per_airport=max_flights_per_airport,
+                                     n=n)
+
+
+def find_cheapest_flights_incremental(flight_data,
+                                      origin,   # airport id
+                                      n: int = None,
+                                      min_days: int = None,
+                                      max_days: int = None,
+                                      min_date: datetime = None,
+                                      max_date: datetime = None,
+                                      max_price: int = None,
+                                      selected_destinations: list = None,
+                                      excluded_destinations: list = None,
+                                      max_flights_per_airport: int = None,
+                                      block_days: int = BLOCK_DAYS):
+    """
+    Finds cheapest round-trip flights and keeps them up to date while flights of single routes are updated,
+    see `IncrementalRoundTrips.update`. Only round-trips departing close to the updated flights are searched
+    again. Results equal those of `find_cheapest_flights` on the updated flight data, as long as the dates
+    and trip lengths are set: unlike in `find_cheapest_flights` they are not restricted to the flight data, so
+    updated flights outside the initial date range are searched, but unset ones are taken from the initial flight
+    data and do not follow updates. Without flights, `min_date` and `max_date` are required.
+    Arguments are the same as in `find_cheapest_flights`.
+    :param block_days: number of departure days searched together. Default: 30.
+    :return: incremental round-trips, an iterable of (flight to X, flight from X) in ascending order
+    by round-trip price
+    """
+    _validate_query(origin=origin, n=n, min_days=min_days, max_days=max_days, min_date=min_date, max_date=max_date,
+                    max_price=max_price, selected_destinations=selected_destinations,
+                    excluded_destinations=excluded_destinations, max_flights_per_airport=max_flights_per_airport)
+
+    if isinstance(flight_data, FlightTable):
+        flight_data = flight_data.to_flight_data()
+
+    airports = {airport['id']: airport for airport in flight_data['airports']}
+
+    if origin not in airports:
+        raise ValueError('%s is not in the airport list' % origin)
+
+    # ISO dates compare as strings, the flights need not be indexed for their date range
+    dates = [flight['date'] for flight in flight_data['flights']]
+
+    # dates and trip lengths are not restricted to the initial flight data, so that updated flights beyond it
+    # are searched, only unset ones default to it
+    if min_date is None or max_date is None:
+        if not dates:
+            raise ValueError('`min_date` and `max_date` are required without flights')
+        min_date = datetime.strptime(min(dates), '%Y-%m-%d') if min_date is None else min_date
+        max_date = datetime.strptime(max(dates), '%Y-%m-%d') if max_date is None else max_date
+
+    min_days = 1 if min_days is None else min_days
+    max_days = max((max_date - min_date).days, min_days) if max_days is None else max_days
+
+    # excluding the origin excludes all flights
+    destinations = _filter_destinations(airports, origin, selected_destinations, excluded_destinations) or {}
+
+    return IncrementalRoundTrips(flight_data['flights'],
+                                 airports=airports,
+                                 origin=origin,
+                                 destinations=list(destinations),
+                                 min_day=min_date.toordinal(),
+                                 max_day=max_date.toordinal(),
+                                 min_days=min_days,
+                                 max_days=max_days,
+                                 max_price=max_price,
+                                 max_flights_per_airport=max_flights_per_airport,
+                                 n=n,
+                                 block_days=block_days)
+
+
+def find_price_matrix(flight_data,
+                      origin,   # airport id
+                      min_days: int = None,
+                      max_days: int = None,
+                      min_date: datetime = None,
+                      max_date: datetime = None,
+                      max_price: int = None,
+                      selected_destinations: list = None,
+                      excluded_destinations: list = None):
+    """
+    Finds the cheapest round-trip price for every pair of departure and return day and every destination
+    in a single pass, instead of searching every date range separately.
+    Arguments are the same as in `find_cheapest_flights`.
+    :return: price matrix, see `PriceMatrix`
+    """
+    _validate_query(origin=origin, min_days=min_days, max_days=max_days, min_date=min_date, max_date=max_date,
+                    max_price=max_price, selected_destinations=selected_destinations,
+                    excluded_destinations=excluded_destinations)
+
+    table = flight_data if isinstance(flight_data, FlightTable) else FlightTable.from_flight_data(flight_data)
+    airports = {airport['id']: airport for airport in table.airports}
+
+    if origin not in airports:
+        raise ValueError('%s is not in the airport list' % origin)
+
+    resolved = _resolve_query(airports, table.date_range(), origin, min_days, max_days, min_date, max_date,
+                              selected_destinations, excluded_destinations)
+
+    if resolved is None:
+        # excluding the origin excludes all flights, the dates are resolved without destination filters
+        _, min_date, max_date, min_days, max_days = _resolve_query(airports, table.date_range(), origin, min_days,
+                                                                   max_days, min_date, max_date, None, None)
+        destinations = {}
+    else:
+        destinations, min_date, max_date, min_days, max_days = resolved
+
+    return price_matrix(table,
+                        origin=origin,
+                        destinations=[airport_id for airport_id in destinations.keys() if airport_id != origin],
+                        min_day=min_date.toordinal(),
+                        max_day=max_date.toordinal(),
+                        min_days=min_days,
+                        max_days=max_days,
+                        max_price=max_price)
+
+
+def _validate_query(origin, n=None, min_days=None, max_days=None, min_date=None, max_date=None, max_price=None,
+                    selected_destinations=None, excluded_destinations=None, max_flights_per_airport=None,
+                    open_jaw=False):
     if n is not None and n < 0:
         raise ValueError('`n` must be larger than 0')
     if min_days is not None and min_days <= 0:
@@ -54,37 +375,141 @@ def find_cheapest_flights(flight_data,
     if max_flights_per_airport is not None and max_flights_per_airport <= 0:
         raise ValueError('`max_flights_per_airport` must be larger than 0')
 
-    flights = flight_data['flights']
-    # build airport id -> airport mapping
-    airports = {airport['id']: airport for airport in flight_data['airports']}
-
-    if origin not in airports:
-        raise ValueError('%s is not in the airport list' % origin)
 
-    # filter out all destinations that were not selected
-    if selected_destinations is not None:
-        for airport_id in list(airports.keys()):
-            if origin != airport_id and airport_id not in selected_destinations:
-                airports.pop(airport_id)
-
-    # filter out all excluded destinations
-    if excluded_destinations is not None:
-        for excluded in excluded_destinations:
-            airports.pop(excluded, None)
-
-    logging.debug('destination airports: %s' % airports.keys())
+def _search(index, airports, date_range, algorithm, workers, summary, flight_table, airport_groups, profile, origin,
+            n=None, min_days=None, max_days=None, min_date=None, max_date=None, max_price=None,
+            selected_destinations=None, excluded_destinations=None, max_flights_per_airport=None, open_jaw=False):
+    """
+    Answers a single query on the shared route index or flight table, or on the summary if it covers the query.
+    :return: generator of (flight to X, flight from X) in ascending order by round-trip price
+    """
+    resolved = _resolve_query(airports, date_range, origin, min_days, max_days, min_date, max_date,
+                              selected_destinations, excluded_destinations)
+
+    # excluding the origin excludes all flights
+    if resolved is None:
+        return
+
+    airports, min_date, max_date, min_days, max_days = resolved
+
+    if open_jaw:
+        round_trips = open_jaw_round_trips(flight_table,
+                                           origin=origin,
+                                           destinations=list(airports.keys()),
+                                           min_day=min_date.toordinal(),
+                                           max_day=max_date.toordinal(),
+                                           min_days=min_days,
+                                           max_days=max_days,
+                                           groups=airport_groups,
+                                           max_price=max_price,
+                                           max_flights_per_airport=max_flights_per_airport,
+                                           n=n)
+    # summaries hold the cheapest round-trip per destination, which is all queries with one trip per airport yield
+    elif summary is not None and max_flights_per_airport == 1:
+        round_trips = summary.round_trips(flight_table,
+                                          origin=origin,
+                                          destinations=list(airports.keys()),
+                                          min_day=min_date.toordinal(),
+                                          max_day=max_date.toordinal(),
+                                          min_days=min_days,
+                                          max_days=max_days,
+                                          max_price=max_price)
+    elif algorithm == 'parallel':
+        round_trips = parallel_round_trips(index,
+                                           origin=origin,
+                                           destinations=list(airports.keys()),
+                                           min_day=min_date.toordinal(),
+                                           max_day=max_date.toordinal(),
+                                           min_days=min_days,
+                                           max_days=max_days,
+                                           max_price=max_price,
+                                           max_flights_per_airport=max_flights_per_airport,
+                                           n=n,
+                                           workers=workers)
+    elif algorithm == 'top_k':
+        round_trips = top_k_round_trips(index,
+                                        origin=origin,
+                                        destinations=list(airports.keys()),
+                                        min_day=min_date.toordinal(),
+                                        max_day=max_date.toordinal(),
+                                        min_days=min_days,
+                                        max_days=max_days,
+                                        max_price=max_price,
+                                        max_flights_per_airport=max_flights_per_airport,
+                                        profile=profile)
+    elif algorithm == 'sliding_window':
+        round_trips = sliding_window_round_trips(index,
+                                                 origin=origin,
+                                                 destinations=list(airports.keys()),
+                                                 min_day=min_date.toordinal(),
+                                                 max_day=max_date.toordinal(),
+                                                 min_days=min_days,
+                                                 max_days=max_days,
+                                                 max_price=max_price)
+    elif algorithm == 'vectorized':
+        round_trips = vectorized_round_trips(index,
+                                             origin=origin,
+                                             destinations=list(airports.keys()),
+                                             min_day=min_date.toordinal(),
+                                             max_day=max_date.toordinal(),
+                                             min_days=min_days,
+                                             max_days=max_days,
+                                             max_price=max_price,
+                                             profile=profile)
+    else:
+        round_trips = _index_round_trips(index,
+                                         origin=origin,
+                                         airports=airports,
+                                         min_day=min_date.toordinal(),
+                                         max_day=max_date.toordinal(),
+                                         min_days=min_days,
+                                         max_days=max_days,
+                                         max_price=max_price,
+                                         profile=profile)
+
+    if n is not None:
+        logging.debug('n: %d' % n)
 
-    date_range = None
+    if max_flights_per_airport is not None:
+        visited_airports = {airport_id: 0 for airport_id in airports.keys()}
+    else:
+        visited_airports = None
 
-    # scan flights to find earliest and latest flight dates
-    for flight in flights:
-        date = datetime.strptime(flight['date'], '%Y-%m-%d')
+    if n == 0:
+        return
+
+    yielded = 0
+
+    try:
+        # yield found round-trip flights until `n` of them passed the airport limit
+        # stop right away so that lazy search algorithms do no further work
+        for to_flight, from_flight in round_trips:
+            if visited_airports is None or visited_airports[to_flight['destination']] < max_flights_per_airport:
+                yield to_flight, from_flight
+                yielded += 1
+                if visited_airports is not None:
+                    visited_airports[to_flight['destination']] += 1
+                if yielded == n:
+                    return
+    finally:
+        if profile is not None:
+            # finish the search algorithm first so that it records its counters
+            round_trips.close()
+            profile.count(queries=1, round_trips_yielded=yielded)
+
+
+def _resolve_query(airports, date_range, origin, min_days, max_days, min_date, max_date, selected_destinations,
+                   excluded_destinations):
+    """
+    Applies destination filters and restricts dates and trip lengths to the flight data.
+    :return: tuple of destination airports, min_date, max_date, min_days and max_days
+    or None if there are no round-trips
+    """
+    airports = _filter_destinations(airports, origin, selected_destinations, excluded_destinations)
 
-        if date_range is None:
-            date_range = date, date
-        else:
-            date_range_min, date_range_max = date_range
-            date_range = min(date, date_range_min), max(date, date_range_max)
+    # excluding the origin excludes all flights
+    if airports is None:
+        return None
 
     date_range_min, date_range_max = date_range
 
@@ -120,67 +545,121 @@ def find_cheapest_flights(flight_data,
     logging.debug('min_days: %d' % min_days)
     logging.debug('max_days: %d' % max_days)
 
-    # initialize index for future lookup on following fields: date, origin_airport, destination_airport
-    index = {
-        (min_date + timedelta(day)).strftime('%Y-%m-%d'): {
-            origin: {
-                destination: [] for destination in airports.keys()
-            } for origin in airports.keys()
-        } for day in range(date_range_days + 1)
-    }
+    return airports, min_date, max_date, min_days, max_days
+
+
+def _filter_destinations(airports, origin, selected_destinations, excluded_destinations):
+    """
+    :return: dictionary of the airports left by the destination filters, including the origin,
+    or None if the origin is excluded
+    """
+    airports = dict(airports)
+
+    # filter out all destinations that were not selected
+    if selected_destinations is not None:
+        for airport_id in list(airports.keys()):
+            if origin != airport_id and airport_id not in selected_destinations:
+                airports.pop(airport_id)
+
+    # filter out all excluded destinations
+    if excluded_destinations is not None:
+        for excluded in excluded_destinations:
+            airports.pop(excluded, None)
+
+    # excluding the origin excludes all flights
+    if origin not in airports:
+        return None
+
+    logging.debug('destination airports: %s' % airports.keys())
+
+    return airports
+
+
+def build_route_index(flights):
+    """
+    Builds a sparse index on the following fields: origin_airport, destination_airport.
+    :param flights: flights in the flight data format
+    :return: dictionary (origin, destination) -> (days, flights) where days are day ordinals of the flights
+    on the route in ascending order
+    """
+    index = {}
 
-    # add all relevant flights to the index
     for flight in flights:
-        flight_date = datetime.strptime(flight['date'], '%Y-%m-%d')
-        if flight['origin'] in airports \
-                and flight['destination'] in airports \
-                and min_date <= flight_date <= max_date:
-            index[flight['date']][flight['origin']][flight['destination']].append(flight)
+        day = datetime.strptime(flight['date'], '%Y-%m-%d').toordinal()
+        index.setdefault((flight['origin'], flight['destination']), []).append((day, flight))
 
-    flight_queue = []
-    idx = 0
+    # stable sort keeps the original flight order within a day
+    for route, route_flights in index.items():
+        route_flights.sort(key=lambda day_flight: day_flight[0])
+        index[route] = [day for day, _ in route_flights], [flight for _, flight in route_flights]
 
-    # search index looking for round-trip flights that fulfil provided requirements
-    # add found round-trip flights to heap sorted by full price of the trip
-    for departure_day in range(date_range_days - min_days + 1):
-        for return_day in range(departure_day + min_days, min(departure_day + max_days, date_range_days) + 1):
-            # first iterate over all possible trip dates (departure, return)
-            departure_date = (min_date + timedelta(days=departure_day)).strftime('%Y-%m-%d')
-            return_date = (min_date + timedelta(days=return_day)).strftime('%Y-%m-%d')
-
-            # then look for all flight pairs for each trip date
-            # iterate over all flights to the destination
-            for to_airport_id, to_flights in index[departure_date][origin].items():
-                # iterate over all flights from the destination
-                for from_flight in index[return_date][to_airport_id][origin]:
-                    for to_flight in to_flights:
-                        # calculate trip price and push it to heap if trip meets requirements
-                        full_price = to_flight['price'] + from_flight['price']
-                        if max_price is None or full_price <= max_price:
-                            heapq.heappush(flight_queue,
-                                           (full_price, departure_day, return_day, idx, to_flight, from_flight))
-                            idx += 1
-
-    # restrict the number of yielded trips to [1, heap length] interval
-    if n is None:
-        n = len(flight_queue)
-    else:
-        n = min(n, len(flight_queue))
+    return index
 
-    logging.debug('n: %d' % n)
 
-    if max_flights_per_airport is not None:
-        visited_airports = {airport_id: 0 for airport_id in airports.keys()}
-    else:
-        visited_airports = None
+def _date_range(index):
+    """
+    :param index: route index
+    :return: tuple of earliest and latest flight date or None if there are no flights
+    """
+    if not index:
+        return None
+
+    return (datetime.fromordinal(min(days[0] for days, _ in index.values())),
+            datetime.fromordinal(max(days[-1] for days, _ in index.values())))
 
-    # yield all found round-trip flights
-    for _ in range(n):
-        _, _, _, _, to_flight, from_flight = heapq.heappop(flight_queue)
-        if visited_airports is None or visited_airports[to_flight['destination']] < max_flights_per_airport:
+
+def _index_round_trips(index, origin, airports, min_day, max_day, min_days, max_days, max_price,
+                       profile: Profile = None):
+    """
+    Finds round-trip flights by looking up flights on routes to and from every destination.
+    :return: generator of (flight to X, flight from X) in ascending order by round-trip price
+    """
+    flight_queue = []
+    # counters are summed up per departure and recorded once the search is finished
+    outbound_flights = date_pairs = 0
+
+    # search index looking for round-trip flights that fulfil provided requirements
+    # add found round-trip flights to heap sorted by full price of the trip
+    with phase(profile, 'enumerate'):
+        for rank, to_airport_id in enumerate(airports.keys()):
+            if (origin, to_airport_id) not in index or (to_airport_id, origin) not in index:
+                continue
+
+            departure_days, to_flights = index[(origin, to_airport_id)]
+            return_days, from_flights = index[(to_airport_id, origin)]
+            departures = range(bisect_left(departure_days, min_day), bisect_right(departure_days, max_day))
+            outbound_flights += len(departures)
+
+            # iterate over all flights to the destination within the date range
+            for to_position in departures:
+                departure_day, to_flight = departure_days[to_position], to_flights[to_position]
+
+                # iterate over all flights from the destination within the trip length window
+                start = bisect_left(return_days, departure_day + min_days)
+                end = bisect_right(return_days, min(departure_day + max_days, max_day))
+                date_pairs += max(0, end - start)
+
+                for from_position in range(start, end):
+                    return_day, from_flight = return_days[from_position], from_flights[from_position]
+
+                    # calculate trip price and push it to heap if trip meets requirements
+                    # ties are broken by trip dates, destination and flight order
+                    full_price = to_flight['price'] + from_flight['price']
+                    if max_price is None or full_price <= max_price:
+                        heapq.heappush(flight_queue, (full_price, departure_day, return_day, rank,
+                                                      from_position, to_position, to_flight, from_flight))
+
+    candidates = len(flight_queue)
+
+    try:
+        while flight_queue:
+            _, _, _, _, _, _, to_flight, from_flight = heapq.heappop(flight_queue)
             yield to_flight, from_flight
-            if visited_airports is not None:
-                visited_airports[to_flight['destination']] += 1
+    finally:
+        if profile is not None:
+            profile.count(outbound_flights=outbound_flights, date_pairs=date_pairs, candidates=candidates,
+                          pruned=date_pairs - candidates, heap_pushes=candidates,
+                          heap_pops=candidates - len(flight_queue))
 
 
 class TripFormatter:
@@ -211,7 +690,7 @@ class TripFormatter:
         else:
             name = destination['id']
 
-        return 'round-trip to %s %02d days (%s - %s) for %0.2f %s' \
+        trip = 'round-trip to %s %02d days (%s - %s) for %0.2f %s' \
                % (name,
                   duration_days,
                   to_flight['date'],
@@ -219,12 +698,41 @@ class TripFormatter:
                   to_flight['price'] + from_flight['price'],
                   to_flight['currency'])
 
+        # open-jaw round-trips return from or to another airport
+        if from_flight['origin'] != to_flight['destination'] or from_flight['destination'] != to_flight['origin']:
+            trip += ' returning %s - %s' % (from_flight['origin'], from_flight['destination'])
+
+        return trip
+
+
+def load_queries(path: str):
+    """
+    Loads query specs from a JSON file holding a list of objects with `find_cheapest_flights` arguments,
+    dates are formatted as yyyy-mm-dd, e.g. `[{"origin": "BER", "min_days": 2, "max_days": 3, "n": 10}]`.
+    :param path: path to the query specs
+    :return: list of queries
+    """
+    with open(path, encoding='utf-8') as fh:
+        queries = json.load(fh)
+
+    for query in queries:
+        for field in ('min_date', 'max_date'):
+            if query.get(field) is not None:
+                query[field] = datetime.strptime(query[field], '%Y-%m-%d')
+
+    return queries
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Find cheapest flights from selected airport.')
-    parser.add_argument('origin', type=str, help='id of the starting airport')
+    parser.add_argument('origin', type=str, nargs='?', help='id of the starting airport. May be omitted if '
+                                                             '`-queries` and `-data` are set')
     parser.add_argument('-data', type=str, help='path to flight data. '
                                                 'By default `ryanair_<origin>.p` in the package root directory')
+    parser.add_argument('-queries', type=str, help='path to a JSON file with a list of queries to run instead of '
+                                                   'the query given by the arguments. Every query is an object with '
+                                                   '`find_cheapest_flights` arguments, dates are formatted as '
+                                                   'yyyy-mm-dd')
     parser.add_argument('-n', type=int, help='maximal number of yielded round-trip flights. '
                                              'By default yields all flights')
     parser.add_argument('-min_days', type=int, help='minimal number of days a round-trip should last.'
@@ -248,44 +756,168 @@ if __name__ == '__main__':
     parser.add_argument('-max_flights_per_airport', type=int,
                         help='maximal number of yielded round-trip flights per destination airport. '
                              'By default return all round-trip flights')
+    parser.add_argument('--open_jaw', action='store_true',
+                        help='also return from airports near the destination and to airports near the origin')
+    parser.add_argument('-airport_groups', type=str,
+                        help='path to a JSON object mapping group names to lists of nearby airport ids, '
+                             'e.g. `{"LON": ["STN", "LTN", "LGW"]}`. By default airports are grouped by their '
+                             '`group` field')
+    parser.add_argument('-algorithm', choices=ALGORITHMS,
+                        help='search algorithm. Default: vectorized for binary flight data, index otherwise')
+    parser.add_argument('-workers', type=int, help='number of worker processes of the parallel algorithm. '
+                                                   'By default the number of CPUs')
+    parser.add_argument('-matrix', choices=MATRIX_FORMATS,
+                        help='instead of round-trips output the cheapest price for every departure and return date '
+                             'of every destination as heatmap, CSV or NumPy arrays (npz)')
+    parser.add_argument('-out', type=str, help='path where the price matrix should be stored. Required for npz, '
+                                               'by default the matrix is printed')
+    parser.add_argument('--streaming', action='store_true',
+                        help='read binary flight data in date order from disk instead of loading it, memory is bounded '
+                             'by the flights of `max_days` days. Ignores -algorithm')
+    parser.add_argument('-chunk_size', type=int, default=CHUNK_SIZE,
+                        help='with --streaming, number of flights read from disk at once. Default: %d' % CHUNK_SIZE)
+    parser.add_argument('--no_summary', action='store_true', help='search the flights even if the summary of '
+                                                                  'the flight data could answer the query')
+    parser.add_argument('--profile', action='store_true', help='print the time spent in every phase of the search '
+                                                               'and search counters')
+    parser.add_argument('--profile_memory', action='store_true', help='with --profile, also record the peak memory '
+                                                                      'of every phase, which slows the search down')
+    parser.add_argument('-profile_out', type=str, help='path where the profile should be stored as JSON, '
+                                                       'implies --profile')
     parser.add_argument('--debug', action='store_true', help='show debug messages')
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO,
                         format='%(asctime)s %(levelname)-8s %(name)-10.10s %(message)s')
 
+    if args.origin is None and (args.queries is None or args.data is None):
+        parser.error('origin is required unless both -queries and -data are set')
+    if args.matrix is not None and args.queries is not None:
+        parser.error('-matrix cannot be used with -queries')
+    if args.matrix == 'npz' and args.out is None:
+        parser.error('-matrix npz requires -out')
+    if args.streaming and (args.matrix is not None or args.open_jaw):
+        parser.error('--streaming cannot be used with -matrix or --open_jaw')
+
     path = args.data if args.data is not None else os.path.join(ROOT_DIR, 'ryanair_%s.p' % args.origin)
+    profile = Profile(memory=args.profile_memory) if args.profile or args.profile_out is not None else None
+
+    if os.path.isfile(path) and args.streaming and not is_binary_flight_data(path):
+        parser.error('--streaming requires flight data in the binary format, convert %s with '
+                     'convert_flight_data.py' % path)
 
     if os.path.isfile(path):
-        data = pickle.load(open(path, 'rb'))
+        with phase(profile, 'load'):
+            # streamed flight data is read while searching, only its airports are loaded
+            if args.streaming:
+                try:
+                    data = FlightStream(path, chunk_size=args.chunk_size)
+                except ValueError as e:
+                    # e.g. flights which are not sorted by day
+                    parser.error(str(e))
+                airports = {airport['id']: airport for airport in data.airports}
+                algorithm = None
+            # binary flight data is memory-mapped rather than loaded
+            elif is_binary_flight_data(path):
+                data = load_flight_table(path)
+                airports = {airport['id']: airport for airport in data.airports}
+                algorithm = args.algorithm or 'vectorized'
+            else:
+                data = load_flight_data(path)
+                airports = {airport['id']: airport for airport in data['airports']}
+                algorithm = args.algorithm or 'index'
+
+            summary = None if args.no_summary or args.streaming else load_summary(path)
 
-        airports = {airport['id']: airport for airport in data['airports']}
         formatter = TripFormatter(airports)
+        airport_groups = None
 
-        if args.origin not in airports:
-            logging.error('%s not found in the airport list. Available airport ids: %s'
-                          % (args.origin, ','.join(airports.keys())))
-        else:
-            try:
-                min_date = None if args.min_date is None else datetime.strptime(args.min_date, '%Y-%m-%d')
-                max_date = None if args.max_date is None else datetime.strptime(args.max_date, '%Y-%m-%d')
-
-                cheapest_flights = find_cheapest_flights(data,
-                                                         origin=args.origin,
-                                                         n=args.n,
-                                                         min_days=args.min_days,
-                                                         max_days=args.max_days,
-                                                         min_date=min_date,
-                                                         max_date=max_date,
-                                                         max_price=args.max_price,
-                                                         selected_destinations=args.selected_destinations,
-                                                         excluded_destinations=args.excluded_destinations,
-                                                         max_flights_per_airport=args.max_flights_per_airport)
-
-                for to_flight, from_flight in cheapest_flights:
-                    print(formatter.format(to_flight, from_flight))
-            except ValueError as e:
-                logging.exception(e)
+        if args.airport_groups is not None:
+            with open(args.airport_groups, encoding='utf-8') as fh:
+                airport_groups = json.load(fh)
+
+        try:
+            if args.queries is not None:
+                queries = load_queries(args.queries)
+            else:
+                queries = [{
+                    'origin': args.origin,
+                    'n': args.n,
+                    'min_days': args.min_days,
+                    'max_days': args.max_days,
+                    'min_date': None if args.min_date is None else datetime.strptime(args.min_date, '%Y-%m-%d'),
+                    'max_date': None if args.max_date is None else datetime.strptime(args.max_date, '%Y-%m-%d'),
+                    'max_price': args.max_price,
+                    'selected_destinations': args.selected_destinations,
+                    'excluded_destinations': args.excluded_destinations,
+                    'max_flights_per_airport': args.max_flights_per_airport,
+                    'open_jaw': args.open_jaw
+                }]
+
+            unknown_origins = [query['origin'] for query in queries if query.get('origin') not in airports]
+
+            if unknown_origins:
+                logging.error('%s not found in the airport list. Available airport ids: %s'
+                              % (','.join(map(str, unknown_origins)), ','.join(airports.keys())))
+            elif args.matrix is not None:
+                with phase(profile, 'matrix'):
+                    matrix = find_price_matrix(data, **{field: value for field, value in queries[0].items()
+                                                        if field not in ('n', 'max_flights_per_airport', 'open_jaw')})
+
+                if args.matrix == 'npz':
+                    matrix.save(args.out)
+                elif args.matrix == 'csv' and args.out is not None:
+                    with open(args.out, 'w', newline='', encoding='utf-8') as fh:
+                        matrix.to_csv(fh)
+                elif args.matrix == 'csv':
+                    matrix.to_csv(sys.stdout)
+                else:
+                    heatmaps = []
+                    # destinations with the cheapest round-trips first
+                    for destination, prices in sorted(zip(matrix.destinations, matrix.prices),
+                                                      key=lambda destination_prices: destination_prices[1].min()):
+                        if prices.min() < np.inf:
+                            heatmaps.append('round-trips to %s\n%s' % (destination, matrix.heatmap(destination)))
+
+                    output = '\n\n'.join(heatmaps) or 'no round-trips'
+
+                    if args.out is None:
+                        print(output)
+                    else:
+                        with open(args.out, 'w', encoding='utf-8') as fh:
+                            fh.write(output + '\n')
+            else:
+                if args.streaming:
+                    if any(query.pop('open_jaw', False) for query in queries):
+                        raise ValueError('open-jaw queries cannot be streamed')
+
+                    # streaming searches read the flight data once per query
+                    results = [find_cheapest_flights_streaming(data, **query) for query in queries]
+
+                    if profile is not None:
+                        results = [profile.iterate('search', result) for result in results]
+                else:
+                    results = find_cheapest_flights_batch(data, queries, algorithm=algorithm, workers=args.workers,
+                                                          summary=summary, airport_groups=airport_groups,
+                                                          profile=profile)
+
+                for i, (query, cheapest_flights) in enumerate(zip(queries, results)):
+                    if args.queries is not None:
+                        print('query %d: round-trips from %s' % (i + 1, query['origin']))
+
+                    for to_flight, from_flight in cheapest_flights:
+                        with phase(profile, 'format'):
+                            trip = formatter.format(to_flight, from_flight)
+                        print(trip)
+        except ValueError as e:
+            logging.exception(e)
+
+        if profile is not None:
+            print(profile, file=sys.stderr)
+
+            if args.profile_out is not None:
+                with open(args.profile_out, 'w', encoding='utf-8') as fh:
+                    fh.write(profile.to_json())
     elif args.data is None:
         logging.error('Failed to automatically find flight data.'
                       ' Please use -data argument to specify the path to flight data.')
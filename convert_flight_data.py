@@ -0,0 +1,29 @@
+from flycatcher.storage import load_flight_data, load_flight_table, save_flight_data, BINARY_EXTENSION
+import argparse
+import logging
+import os
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert flight data between pickle, JSON and binary format. '
+                                                 'The format is chosen by the file extension: '
+                                                 '`.flights` for binary, `.json` for JSON and pickle otherwise.')
+    parser.add_argument('input', type=str, help='path to flight data')
+    parser.add_argument('output', type=str, help='path where converted flight data should be stored')
+    parser.add_argument('--debug', action='store_true', help='show debug messages')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO,
+                        format='%(asctime)s %(levelname)-8s %(name)-10.10s %(message)s')
+
+    if os.path.isfile(args.input):
+        # binary output is encoded from a flight table, other formats from the flight data model
+        if args.output.endswith(BINARY_EXTENSION):
+            data = load_flight_table(args.input)
+        else:
+            data = load_flight_data(args.input)
+
+        save_flight_data(data, args.output)
+        logging.info('Converted %s to %s.' % (args.input, args.output))
+    else:
+        logging.error('Flight data not found: %s' % args.input)
@@ -0,0 +1,339 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from cheapest_flights import find_cheapest_flights, ALGORITHMS
+from flycatcher.storage import load_flight_table, file_fingerprint
+from flycatcher.summary import load_summary, summary_path
+from urllib.parse import urlsplit, parse_qs
+from collections import OrderedDict
+from datetime import datetime
+import threading
+import argparse
+import logging
+import pickle
+import json
+import os
+
+
+def _string(value):
+    if not isinstance(value, str):
+        raise ValueError('expected a string')
+    return value
+
+
+def _number(parse):
+    def parse_number(value):
+        # JSON booleans are ints in python
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise ValueError('expected a number')
+        return parse(value)
+    return parse_number
+
+
+def _date(value):
+    return datetime.strptime(_string(value), '%Y-%m-%d')
+
+
+def _airports(value):
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list) or not all(isinstance(airport, str) for airport in value):
+        raise ValueError('expected a comma-separated string or a list of airport ids')
+    return sorted(value)
+
+
+def _boolean(value):
+    return value if isinstance(value, bool) else _string(value).lower() in ('1', 'true', 'yes')
+
+
+# query parameter -> parser of its value, parsers raise ValueError for invalid values
+QUERY_PARAMETERS = {
+    'origin': _string,
+    'n': _number(int),
+    'min_days': _number(int),
+    'max_days': _number(int),
+    'min_date': _date,
+    'max_date': _date,
+    'max_price': _number(float),
+    'selected_destinations': _airports,
+    'excluded_destinations': _airports,
+    'max_flights_per_airport': _number(int),
+    'open_jaw': _boolean,
+    'algorithm': _string
+}
+
+# `parallel` would start a process pool for every request of the threaded server
+SERVER_ALGORITHMS = tuple(algorithm for algorithm in ALGORITHMS if algorithm != 'parallel')
+
+
+class UnknownDatasetError(KeyError):
+    pass
+
+
+class DatasetUnavailableError(Exception):
+    pass
+
+
+class Dataset:
+    """
+    Flight table loaded from a file and kept in memory together with its route index and summary.
+    The table is reloaded when the file is replaced, the summary when it is compiled again.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: path to flight data
+        """
+        self.path = path
+        self.table = None
+        self.fingerprint = None
+        self.summary = None
+        self.summary_fingerprint = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        :return: tuple of flight table, its summary or None and fingerprint of the file it was loaded from.
+        If the file is missing or cannot be loaded, the previously loaded table is kept.
+        """
+        with self._lock:
+            try:
+                fingerprint = file_fingerprint(self.path)
+
+                while fingerprint != self.fingerprint:
+                    logging.info('Loading %s.' % self.path)
+                    table = load_flight_table(self.path)
+                    # the file may have been replaced while loading
+                    self.table, self.fingerprint, fingerprint = table, fingerprint, file_fingerprint(self.path)
+                    self.summary_fingerprint = None
+            # e.g. a file removed meanwhile or a file which is not flight data
+            except (OSError, ValueError, EOFError, pickle.UnpicklingError) as e:
+                if self.table is None:
+                    raise DatasetUnavailableError('%s cannot be loaded: %s' % (self.path, e))
+                logging.warning('%s cannot be loaded, serving the previously loaded flights: %s' % (self.path, e))
+
+            try:
+                summary_fingerprint = file_fingerprint(summary_path(self.path)) \
+                    if os.path.isfile(summary_path(self.path)) else None
+
+                if summary_fingerprint != self.summary_fingerprint:
+                    # summaries of other versions of the flight data are not loaded
+                    self.summary = None if summary_fingerprint is None else load_summary(self.path)
+                    self.summary_fingerprint = summary_fingerprint
+            except OSError as e:
+                # e.g. a summary removed meanwhile, which is checked again on the next query
+                logging.warning('Summary of %s cannot be loaded: %s' % (self.path, e))
+                self.summary, self.summary_fingerprint = None, None
+
+            if self.summary is not None and self.summary.source != self.fingerprint:
+                self.summary = None
+
+            return self.table, self.summary, self.fingerprint
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache of query results.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        """
+        :param max_size: maximal number of cached results. Default: 1024.
+        """
+        self.max_size = max_size
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :param key: cache key
+        :return: cached result or None
+        """
+        with self._lock:
+            if key not in self._results:
+                return None
+            self._results.move_to_end(key)
+            return self._results[key]
+
+    def put(self, key, result):
+        """
+        Caches a result and evicts the least recently used result if the cache is full.
+        :param key: cache key
+        :param result: result
+        """
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+
+    def invalidate(self, dataset: str, fingerprint):
+        """
+        Removes results computed on other versions of the dataset.
+        :param dataset: name of the dataset
+        :param fingerprint: fingerprint of the current version of the dataset
+        """
+        with self._lock:
+            for key in [key for key in self._results if key[0] == dataset and key[1] != fingerprint]:
+                del self._results[key]
+
+
+class FlightServer(ThreadingHTTPServer):
+    """
+    HTTP server answering `find_cheapest_flights` queries on resident datasets.
+
+    `GET /search?dataset=<name>&origin=<id>&n=10&...` or `POST /search` with a JSON object of the same parameters
+    returns `{"trips": [{"price": ..., "outbound": flight, "inbound": flight}, ...], "cached": bool}`.
+    `GET /datasets` lists the served datasets.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, datasets: dict, cache_size: int = 1024):
+        """
+        :param address: tuple of host and port
+        :param datasets: dataset name -> path to flight data
+        :param cache_size: maximal number of cached query results. Default: 1024.
+        """
+        super().__init__(address, FlightRequestHandler)
+        self.datasets = {name: Dataset(path) for name, path in datasets.items()}
+        self.results = ResultCache(cache_size)
+
+    def search(self, parameters: dict):
+        """
+        :param parameters: query parameters
+        :return: tuple of trips and whether they were taken from the cache
+        """
+        if not isinstance(parameters, dict):
+            raise ValueError('parameters must be an object')
+
+        parameters = dict(parameters)
+        name = parameters.pop('dataset', None) or next(iter(self.datasets))
+
+        if not isinstance(name, str):
+            raise ValueError('invalid value of `dataset`: expected a string')
+
+        if name not in self.datasets:
+            raise UnknownDatasetError(name)
+
+        query = {}
+        for parameter, value in parameters.items():
+            if parameter not in QUERY_PARAMETERS:
+                raise ValueError('unknown parameter `%s`' % parameter)
+            # null leaves a parameter unset
+            if value is None:
+                continue
+
+            try:
+                query[parameter] = QUERY_PARAMETERS[parameter](value)
+            except (TypeError, ValueError) as e:
+                raise ValueError('invalid value of `%s`: %s' % (parameter, e))
+
+        if 'origin' not in query:
+            raise ValueError('`origin` must be set')
+
+        query.setdefault('algorithm', 'top_k')
+        if query['algorithm'] not in SERVER_ALGORITHMS:
+            raise ValueError('`algorithm` must be one of: %s' % ', '.join(SERVER_ALGORITHMS))
+
+        table, summary, fingerprint = self.datasets[name].get()
+        self.results.invalidate(name, fingerprint)
+
+        key = name, fingerprint, tuple(sorted((parameter, tuple(value) if isinstance(value, list) else value)
+                                              for parameter, value in query.items()))
+        trips = self.results.get(key)
+
+        if trips is not None:
+            return trips, True
+
+        trips = [{
+            'price': to_flight['price'] + from_flight['price'],
+            'outbound': to_flight,
+            'inbound': from_flight
+        } for to_flight, from_flight in find_cheapest_flights(table, summary=summary, **query)]
+
+        self.results.put(key, trips)
+
+        return trips, False
+
+
+class FlightRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+
+        if url.path == '/datasets':
+            self._send(200, {name: dataset.path for name, dataset in self.server.datasets.items()})
+        elif url.path == '/search':
+            self._search({parameter: values[-1] for parameter, values in parse_qs(url.query).items()})
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if urlsplit(self.path).path != '/search':
+            self._send(404, {'error': 'not found'})
+            return
+
+        try:
+            parameters = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except ValueError:
+            self._send(400, {'error': 'invalid JSON'})
+            return
+
+        self._search(parameters)
+
+    def _search(self, parameters):
+        try:
+            trips, cached = self.server.search(parameters)
+        except UnknownDatasetError as e:
+            self._send(404, {'error': 'unknown dataset %s' % e})
+        except DatasetUnavailableError as e:
+            self._send(503, {'error': str(e)})
+        except (TypeError, ValueError) as e:
+            self._send(400, {'error': str(e)})
+        else:
+            self._send(200, {'trips': trips, 'cached': cached})
+
+    def _send(self, status, body):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        logging.debug('%s %s' % (self.address_string(), format % args))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve cheapest flights queries on resident flight data.')
+    parser.add_argument('data', nargs='+', help='paths to flight data. Datasets are named after the file name '
+                                                'without extension')
+    parser.add_argument('-host', type=str, default='127.0.0.1', help='host to listen on. Default: 127.0.0.1')
+    parser.add_argument('-port', type=int, default=8080, help='port to listen on. Default: 8080')
+    parser.add_argument('-cache_size', type=int, default=1024, help='maximal number of cached query results. '
+                                                                    'Default: 1024')
+    parser.add_argument('--debug', action='store_true', help='show debug messages')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO,
+                        format='%(asctime)s %(levelname)-8s %(name)-10.10s %(message)s')
+
+    datasets = {os.path.splitext(os.path.basename(path))[0]: path for path in args.data}
+
+    if len(datasets) < len(args.data):
+        parser.error('datasets must have distinct file names')
+    server = FlightServer((args.host, args.port), datasets, cache_size=args.cache_size)
+
+    # load datasets upfront so that the first queries are answered right away
+    for dataset in server.datasets.values():
+        dataset.get()
+
+    logging.info('Serving %s on %s:%d.' % (', '.join(datasets), args.host, args.port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1 +1,15 @@
-from flycatcher.downloader import Downloader
+from flycatcher.downloader import Downloader, DownloadStats
+from flycatcher.flight_table import FlightTable
+from flycatcher.rate_limiter import TokenBucket
+from flycatcher.cache import ResponseCache
+from flycatcher.storage import load_flight_data, load_flight_table, save_flight_data
+from flycatcher.binary_format import read_flight_table, write_flight_table
+from flycatcher.journal import Journal
+from flycatcher.summary import FlightSummary, load_summary, save_summary, summarize_flight_data
+from flycatcher.price_matrix import PriceMatrix, price_matrix
+from flycatcher.synthetic import generate_flight_data
+from flycatcher.mock_fare_api import MockFareApi
+from flycatcher.profiling import Profile
+from flycatcher.streaming import FlightStream
+from flycatcher.history import PriceHistory
+from flycatcher.incremental import IncrementalRoundTrips
@@ -0,0 +1,137 @@
+from flycatcher.flight_table import FlightTable
+import numpy as np
+import struct
+import json
+
+# binary flight data layout:
+#   header        magic, version, flags, flight count, offset and size of the string table, offset of the flight records
+#   string table  UTF-8 JSON with airports, airport id table, currency table and slices
+#   records       fixed-width little-endian flight records, aligned to 8 bytes
+MAGIC = b'FLYCATCH'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQQQ')
+# records are sorted by day, flights of the same day keep their order. Files written before the flag was
+# introduced have no flags set.
+SORTED_BY_DAY = 1
+RECORD_DTYPE = np.dtype([
+    ('price', '<f8'),
+    ('origin', '<i4'),
+    ('destination', '<i4'),
+    ('day', '<i4'),
+    ('currency', '<i4')
+])
+
+
+def is_binary_flight_data(path: str):
+    """
+    :param path: path to flight data
+    :return: True if the file is stored in the binary flight data format
+    """
+    with open(path, 'rb') as fh:
+        return fh.read(len(MAGIC)) == MAGIC
+
+
+def write_flight_table(table: FlightTable, fh):
+    """
+    Writes the flight table in the binary flight data format. Optional flight fields (time, duration) are not stored.
+    Flights are sorted by day, so that the records can be read in date order, see `read_flight_records`.
+    :param table: flight table
+    :param fh: file opened for binary writing
+    """
+    strings = json.dumps({
+        'airports': table.airports,
+        'airport_ids': table.airport_ids,
+        'currencies': table.currencies,
+        'slices': table.slices
+    }, separators=(',', ':')).encode('utf-8')
+
+    # the stable sort keeps the order of flights on a route within a day, which breaks ties between round-trips
+    order = np.argsort(table.day, kind='stable')
+
+    records = np.empty(len(table), dtype=RECORD_DTYPE)
+    records['price'] = table.price[order]
+    records['origin'] = table.origin[order]
+    records['destination'] = table.destination[order]
+    records['day'] = table.day[order]
+    records['currency'] = table.currency[order]
+
+    strings_offset = HEADER.size
+    records_offset = _align(strings_offset + len(strings), 8)
+
+    fh.write(HEADER.pack(MAGIC, VERSION, SORTED_BY_DAY, len(table), strings_offset, len(strings), records_offset))
+    fh.write(strings)
+    fh.write(b'\0' * (records_offset - strings_offset - len(strings)))
+    fh.write(records.tobytes())
+
+
+def read_flight_table(path: str, mmap: bool = True):
+    """
+    Reads flight data stored in the binary flight data format.
+    :param path: path to flight data
+    :param mmap: memory-map the flight records instead of reading them. Columns of the table are then read-only
+    views of the file, which is loaded lazily and shared with other processes through the page cache. Default: True.
+    :return: flight table
+    """
+    strings, flight_count, records_offset, _ = read_flight_header(path)
+
+    if flight_count == 0:
+        records = np.empty(0, dtype=RECORD_DTYPE)
+    elif mmap:
+        records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=records_offset, shape=(flight_count,))
+    else:
+        records = np.fromfile(path, dtype=RECORD_DTYPE, count=flight_count, offset=records_offset)
+
+    return FlightTable(airports=strings['airports'],
+                       airport_ids=strings['airport_ids'],
+                       currencies=strings['currencies'],
+                       origin=records['origin'],
+                       destination=records['destination'],
+                       day=records['day'],
+                       price=records['price'],
+                       currency=records['currency'],
+                       slices=strings['slices'])
+
+
+def read_flight_header(path: str):
+    """
+    Reads the header and the string table of flight data stored in the binary flight data format.
+    :param path: path to flight data
+    :return: tuple of the string table, flight count, offset of the flight records and flags
+    """
+    with open(path, 'rb') as fh:
+        header = fh.read(HEADER.size)
+
+        if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not stored in the binary flight data format' % path)
+
+        _, version, flags, flight_count, strings_offset, strings_size, records_offset = HEADER.unpack(header)
+
+        if version != VERSION:
+            raise ValueError('Unsupported binary flight data version %d, expected %d' % (version, VERSION))
+
+        fh.seek(strings_offset)
+        strings = json.loads(fh.read(strings_size).decode('utf-8'))
+
+    return strings, flight_count, records_offset, flags
+
+
+def read_flight_records(path: str, start: int = 0, stop: int = None, chunk_size: int = 65536):
+    """
+    Reads flight records in chunks without loading or memory-mapping the whole file.
+    :param path: path to flight data stored in the binary flight data format
+    :param start: first row to read. Default: 0.
+    :param stop: row after the last row to read. By default the last row of the file.
+    :param chunk_size: number of records per chunk. Default: 65536.
+    :return: generator of (row of the first record, array of `RECORD_DTYPE` records)
+    """
+    _, flight_count, records_offset, _ = read_flight_header(path)
+    stop = flight_count if stop is None else min(stop, flight_count)
+
+    with open(path, 'rb') as fh:
+        for row in range(start, stop, chunk_size):
+            fh.seek(records_offset + row * RECORD_DTYPE.itemsize)
+            yield row, np.fromfile(fh, dtype=RECORD_DTYPE, count=min(chunk_size, stop - row))
+
+
+def _align(offset: int, alignment: int):
+    return (offset + alignment - 1) // alignment * alignment
@@ -0,0 +1,151 @@
+from collections import namedtuple
+from urllib.parse import urlencode
+import threading
+import sqlite3
+import hashlib
+import time
+
+CachedResponse = namedtuple('CachedResponse', ['body', 'etag', 'last_modified', 'expires'])
+
+
+class ResponseCache:
+    """
+    Persistent HTTP response cache stored in a SQLite database.
+
+    Responses are keyed by url and query parameters and expire after a per-request TTL. Expired responses are kept
+    for revalidation with `ETag` / `Last-Modified`. Least recently used responses are evicted once the cache
+    exceeds its size limit.
+    """
+
+    def __init__(self,
+                 path: str,
+                 max_size: int = 100 * 1024 * 1024,
+                 default_ttl: float = 3600):
+        """
+        :param path: path to the database file
+        :param max_size: maximal total size of cached responses in bytes. Default: 100 MB.
+        :param default_ttl: number of seconds a response stays fresh if the request sets no TTL. Default: 1 hour.
+        """
+        if max_size <= 0:
+            raise ValueError('`max_size` must be larger than 0')
+
+        self.path = path
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS responses ('
+                                 'key TEXT PRIMARY KEY, '
+                                 'url TEXT NOT NULL, '
+                                 'body TEXT NOT NULL, '
+                                 'etag TEXT, '
+                                 'last_modified TEXT, '
+                                 'expires REAL NOT NULL, '
+                                 'accessed REAL NOT NULL, '
+                                 'size INTEGER NOT NULL)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Closes the database.
+        """
+        with self._lock:
+            self._connection.close()
+
+    @staticmethod
+    def key(url, params=None):
+        """
+        :param url: url of the request
+        :param params: query parameters
+        :return: cache key of the request
+        """
+        query = urlencode(sorted((params or {}).items()))
+        return hashlib.sha256(('%s?%s' % (url, query)).encode('utf-8')).hexdigest()
+
+    def get(self, url, params=None):
+        """
+        :param url: url of the request
+        :param params: query parameters
+        :return: cached response, possibly expired, or None if the request is not cached
+        """
+        key = self.key(url, params)
+
+        with self._lock:
+            row = self._connection.execute('SELECT body, etag, last_modified, expires FROM responses WHERE key = ?',
+                                           (key,)).fetchone()
+            if row is None:
+                return None
+
+            self._connection.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+            self._connection.commit()
+
+        return CachedResponse(*row)
+
+    def put(self, url, params, body: str, etag: str = None, last_modified: str = None, ttl: float = None):
+        """
+        Stores a response and evicts least recently used responses if the cache is full.
+        :param url: url of the request
+        :param params: query parameters
+        :param body: response body
+        :param etag: value of the `ETag` header
+        :param last_modified: value of the `Last-Modified` header
+        :param ttl: number of seconds the response stays fresh. By default `default_ttl`.
+        """
+        now = time.time()
+        expires = now + (self.default_ttl if ttl is None else ttl)
+        size = len(body.encode('utf-8'))
+
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO responses '
+                                     '(key, url, body, etag, last_modified, expires, accessed, size) '
+                                     'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                     (self.key(url, params), url, body, etag, last_modified, expires, now, size))
+            self._evict()
+            self._connection.commit()
+
+    def refresh(self, url, params=None, ttl: float = None):
+        """
+        Marks a cached response as fresh again, e.g. after the server answered `304 Not Modified`.
+        :param url: url of the request
+        :param params: query parameters
+        :param ttl: number of seconds the response stays fresh. By default `default_ttl`.
+        """
+        now = time.time()
+        expires = now + (self.default_ttl if ttl is None else ttl)
+
+        with self._lock:
+            self._connection.execute('UPDATE responses SET expires = ?, accessed = ? WHERE key = ?',
+                                     (expires, now, self.key(url, params)))
+            self._connection.commit()
+
+    def size(self):
+        """
+        :return: total size of cached responses in bytes
+        """
+        with self._lock:
+            return self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def _evict(self):
+        """
+        Deletes least recently used responses until the cache fits `max_size`. Must be called while holding the lock.
+        """
+        total_size = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+        if total_size <= self.max_size:
+            return
+
+        evicted = []
+        for key, size in self._connection.execute('SELECT key, size FROM responses ORDER BY accessed'):
+            if total_size <= self.max_size:
+                break
+            evicted.append((key,))
+            total_size -= size
+
+        self._connection.executemany('DELETE FROM responses WHERE key = ?', evicted)
@@ -1,55 +1,384 @@
-from random import randint
+from concurrent.futures import ThreadPoolExecutor
+from flycatcher.rate_limiter import TokenBucket
+from flycatcher.cache import ResponseCache
+from requests.adapters import HTTPAdapter
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from random import randint, uniform
+from datetime import datetime, timezone
+import threading
 import requests
 import logging
 import time
 import json
 
 
+# responses which are worth retrying
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# responses which signal that requests are sent too fast
+THROTTLE_STATUS_CODES = (429, 503)
+
+
+class DownloadStats:
+    """
+    Thread-safe download counters.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.retries = 0
+        self.throttles = 0
+        self.cache_hits = 0
+        self.not_modified = 0
+        self._started = None
+        self._finished = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts the clock if it is not running yet, e.g. when the first request is sent.
+        """
+        with self._lock:
+            if self._started is None:
+                self._started = self._finished = time.monotonic()
+
+    def add(self, **counters):
+        """
+        Increments counters.
+        :param counters: counter name -> increment
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._started is None:
+                self._started = now
+            self._finished = now
+
+            for name, increment in counters.items():
+                setattr(self, name, getattr(self, name) + increment)
+
+    @property
+    def elapsed(self):
+        """
+        :return: number of seconds between the start, i.e. the first sent request, and the last counted event
+        """
+        if self._started is None:
+            return 0
+        return self._finished - self._started
+
+    @property
+    def requests_per_second(self):
+        """
+        :return: effective number of sent requests per second
+        """
+        if self.elapsed == 0:
+            return 0
+        return self.requests / self.elapsed
+
+    def as_dict(self):
+        """
+        :return: counters as dictionary
+        """
+        return {
+            'requests': self.requests,
+            'successes': self.successes,
+            'failures': self.failures,
+            'retries': self.retries,
+            'throttles': self.throttles,
+            'cache_hits': self.cache_hits,
+            'not_modified': self.not_modified,
+            'elapsed': self.elapsed,
+            'requests_per_second': self.requests_per_second
+        }
+
+    def __str__(self):
+        return '%d requests (%d succeeded, %d failed, %d retries, %d throttled, %d not modified), ' \
+               '%d cache hits in %.1f s, %.2f requests/s' \
+               % (self.requests, self.successes, self.failures, self.retries, self.throttles, self.not_modified,
+                  self.cache_hits, self.elapsed, self.requests_per_second)
+
+
 class Downloader:
     """
     Minimalistic API client.
+
+    Requests share a pool of keep-alive connections and may be sent concurrently with `map`.
+    Responses may be stored in a `ResponseCache`. Failed requests are retried with exponential backoff.
+    With `adaptive_rate` the request rate is decreased multiplicatively when the server throttles
+    and increased additively while requests succeed.
     """
 
     def __init__(self,
                  timeout=5,
-                 wait_between_requests=None):
+                 wait_between_requests=None,
+                 requests_per_second: float = None,
+                 burst: int = 1,
+                 max_workers: int = 1,
+                 max_connections_per_host: int = None,
+                 max_retries: int = 3,
+                 backoff: float = 1,
+                 max_backoff: float = 60,
+                 adaptive_rate: bool = False,
+                 min_requests_per_second: float = 0.1,
+                 rate_increase: float = 0.05,
+                 rate_decrease: float = 0.5,
+                 cache: ResponseCache = None):
         """
         :param timeout: number of seconds to wait for request's response. Default: 5 seconds.
         :param wait_between_requests: tuple of waiting time between two consecutive requests.
         If set the downloader will wait up to a random number of milliseconds between min and max.
         By default the downloader does not wait between two consecutive requests.
+        :param requests_per_second: global rate limit shared by all workers. By default requests are not limited.
+        :param burst: number of requests that may be sent at once before the rate limit applies. Default: 1.
+        :param max_workers: number of requests sent concurrently by `map`. Default: 1.
+        :param max_connections_per_host: maximal number of concurrent requests to a single host.
+        By default equal to `max_workers`.
+        :param max_retries: number of retries of a request that failed with a connection error, 429 or 5xx.
+        Default: 3.
+        :param backoff: base delay in seconds between retries. The n-th retry waits a random time up to
+        `backoff * 2^n` seconds, unless the server sends `Retry-After`. Default: 1 second.
+        :param max_backoff: maximal delay in seconds between retries. Default: 60 seconds.
+        :param adaptive_rate: adjust the request rate between `min_requests_per_second` and `requests_per_second`
+        to the server's throttling. Default: False.
+        :param min_requests_per_second: lower bound of the adaptive request rate. Default: 0.1.
+        :param rate_increase: requests per second added to the rate after every successful request. Default: 0.05.
+        :param rate_decrease: factor the rate is multiplied with when the server throttles. Default: 0.5.
+        :param cache: response cache. Fresh cached responses are returned without a request, expired ones are
+        revalidated with `If-None-Match` / `If-Modified-Since`. By default responses are not cached.
         """
+        if max_workers <= 0:
+            raise ValueError('`max_workers` must be larger than 0')
+        if max_connections_per_host is not None and max_connections_per_host <= 0:
+            raise ValueError('`max_connections_per_host` must be larger than 0')
+        if max_retries < 0:
+            raise ValueError('`max_retries` must be larger or equal 0')
+        if adaptive_rate and requests_per_second is None:
+            raise ValueError('`adaptive_rate` requires `requests_per_second`')
+        if not 0 < rate_decrease < 1:
+            raise ValueError('`rate_decrease` must be between 0 and 1')
+
         self.timeout = timeout
         self.wait_between_requests = wait_between_requests
+        self.max_workers = max_workers
+        self.max_connections_per_host = max_connections_per_host or max_workers
+        self.rate_limiter = TokenBucket(requests_per_second, burst) if requests_per_second is not None else None
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.adaptive_rate = adaptive_rate
+        self.max_requests_per_second = requests_per_second
+        self.min_requests_per_second = min(min_requests_per_second, requests_per_second or min_requests_per_second)
+        self.rate_increase = rate_increase
+        self.rate_decrease = rate_decrease
+        self.cache = cache
+        self.stats = DownloadStats()
+
+        # keep-alive connections are reused across requests and workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_connections_per_host,
+                              pool_maxsize=self.max_connections_per_host)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
         self._last_req = None
+        # time the rate was last decreased, throttles of requests sent before it are already accounted for
+        self._last_decrease = None
+        self._lock = threading.Lock()
+        self._host_semaphores = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Closes pooled connections.
+        """
+        self.session.close()
+
+    def map(self, function, iterable):
+        """
+        Calls `function` on every item concurrently using up to `max_workers` threads.
+        Requests made by `function` through this downloader respect the rate and per-host limits.
+        :param function: function of one argument
+        :param iterable: arguments
+        :return: list of results in the order of arguments
+        """
+        if self.max_workers == 1:
+            return [function(item) for item in iterable]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(function, iterable))
+
+    def _host_semaphore(self, url):
+        """
+        :param url: url of the request
+        :return: semaphore limiting concurrent requests to the host of the url
+        """
+        host = urlsplit(url).netloc
+
+        with self._lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(self.max_connections_per_host)
+            return self._host_semaphores[host]
+
+    def _wait(self):
+        """
+        Waits until the next request may be sent.
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
+        if self.wait_between_requests is not None:
+            # reserve the next slot under the lock but sleep outside of it
+            with self._lock:
+                now = time.time()
+                if self._last_req is None:
+                    send_time = now
+                else:
+                    send_time = max(now, self._last_req + randint(*self.wait_between_requests) / 1000)
+                self._last_req = send_time
+
+            if send_time > now:
+                time.sleep(send_time - now)
+
+    def _adjust_rate(self, throttled: bool, sent: float = None):
+        """
+        Adjusts the request rate: additive increase after a success, multiplicative decrease after throttling.
+        The rate is decreased at most once per window: throttles of requests sent before the last decrease
+        were caused by the previous rate and are ignored, so a burst of concurrent throttles halves the rate once.
+        :param throttled: whether the server throttled the request
+        :param sent: `time.monotonic()` when the request was sent. By default every throttle decreases the rate.
+        """
+        if not self.adaptive_rate:
+            return
+
+        with self._lock:
+            if throttled:
+                if sent is not None and self._last_decrease is not None and sent < self._last_decrease:
+                    return
+                self._last_decrease = time.monotonic()
+                rate = max(self.min_requests_per_second, self.rate_limiter.rate * self.rate_decrease)
+            else:
+                rate = min(self.max_requests_per_second, self.rate_limiter.rate + self.rate_increase)
+
+            if rate != self.rate_limiter.rate:
+                if throttled:
+                    logging.info('Throttled, decreasing request rate to %.2f requests/s.' % rate)
+                self.rate_limiter.set_rate(rate)
+
+    def _retry_delay(self, retry, response=None):
+        """
+        :param retry: number of the retry starting at 0
+        :param response: failed response if any
+        :return: number of seconds to wait before the retry
+        """
+        retry_after = _parse_retry_after(response.headers.get('Retry-After')) if response is not None else None
+
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+
+        # exponential backoff with full jitter
+        return uniform(0, min(self.max_backoff, self.backoff * 2 ** retry))
 
-    def _get(self, url, params, headers=None):
+    def _get(self, url, params, headers=None, ttl: float = None):
         """
         :param url: url of the request
         :param params: query parameters
         :param headers: headers
+        :param ttl: number of seconds the response may be served from the cache. By default the cache's default TTL.
         :return: parsed json response if request succeeded None otherwise
         """
-        if self._last_req is not None:
-            sleep_duration = randint(*self.wait_between_requests) / 1000
-            sleep_duration = self._last_req - time.time() + sleep_duration
+        cached = self.cache.get(url, params) if self.cache is not None else None
 
-            if sleep_duration > 0:
-                time.sleep(sleep_duration)
+        if cached is not None:
+            if cached.expires > time.time():
+                self.stats.add(cache_hits=1)
+                return json.loads(cached.body)
 
-        try:
-            response = requests.get(url,
-                                    params=params,
-                                    headers=headers,
-                                    timeout=self.timeout)
-        except requests.exceptions.RequestException as e:
-            logging.exception(e)
-            return
+            # ask the server whether the expired response is still valid
+            headers = dict(headers or {})
+            if cached.etag is not None:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified is not None:
+                headers['If-Modified-Since'] = cached.last_modified
 
-        logging.debug('content: %s' % response.text)
+        for retry in range(self.max_retries + 1):
+            if retry > 0:
+                self.stats.add(retries=1)
 
-        if self.wait_between_requests is not None:
-            self._last_req = time.time()
+            with self._host_semaphore(url):
+                self._wait()
+                self.stats.start()
+                sent = time.monotonic()
+
+                try:
+                    response = self.session.get(url,
+                                                params=params,
+                                                headers=headers,
+                                                timeout=self.timeout)
+                except requests.exceptions.RequestException as e:
+                    logging.warning('Request to %s failed: %s' % (url, e))
+                    response = None
+
+            self.stats.add(requests=1)
+
+            if response is not None:
+                logging.debug('content: %s' % response.text)
+
+                if response.status_code == 304 and cached is not None:
+                    self.stats.add(successes=1, not_modified=1)
+                    self._adjust_rate(throttled=False)
+                    self.cache.refresh(url, params, ttl=ttl)
+                    return json.loads(cached.body)
+
+                if response.status_code == 200:
+                    self.stats.add(successes=1)
+                    self._adjust_rate(throttled=False)
+                    if self.cache is not None:
+                        self.cache.put(url, params, response.text,
+                                       etag=response.headers.get('ETag'),
+                                       last_modified=response.headers.get('Last-Modified'),
+                                       ttl=ttl)
+                    return json.loads(response.text)
+
+                logging.warning('Request to %s failed with status %d.' % (url, response.status_code))
+
+                if response.status_code in THROTTLE_STATUS_CODES:
+                    self.stats.add(throttles=1)
+                    self._adjust_rate(throttled=True, sent=sent)
+
+                if response.status_code not in RETRY_STATUS_CODES:
+                    break
+
+            if retry < self.max_retries:
+                time.sleep(self._retry_delay(retry, response))
+
+        self.stats.add(failures=1)
+
+
+def _parse_retry_after(value):
+    """
+    :param value: value of the `Retry-After` header, either seconds or HTTP date
+    :return: number of seconds to wait or None if the value is missing or invalid
+    """
+    if value is None:
+        return None
+
+    try:
+        return max(0., float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if retry_date.tzinfo is None:
+        retry_date = retry_date.replace(tzinfo=timezone.utc)
 
-        if response.status_code == 200:
-            return json.loads(response.text)
+    return max(0., (retry_date - datetime.now(timezone.utc)).total_seconds())
@@ -0,0 +1,191 @@
+from datetime import date, datetime
+import numpy as np
+
+# ordinal of 1970-01-01, used to convert numpy days since epoch to python day ordinals
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+class FlightTable:
+    """
+    Columnar flight store.
+
+    Airport ids and currencies are dictionary-encoded to ints, dates are stored as day ordinals
+    (see `datetime.toordinal`) and prices as floats. Row `i` of every column describes the same flight.
+    """
+
+    def __init__(self,
+                 airports: list,
+                 airport_ids: list,
+                 currencies: list,
+                 origin: np.ndarray,
+                 destination: np.ndarray,
+                 day: np.ndarray,
+                 price: np.ndarray,
+                 currency: np.ndarray,
+                 flights: list = None,
+                 slices: list = None):
+        """
+        :param airports: airports in the flight data format
+        :param airport_ids: airport id table, `origin` and `destination` columns index into it
+        :param currencies: currency table, `currency` column indexes into it
+        :param origin: encoded origin airport of each flight
+        :param destination: encoded destination airport of each flight
+        :param day: date of each flight as day ordinal
+        :param price: price of each flight
+        :param currency: encoded currency of each flight
+        :param flights: original flights in the flight data format. If set, `flight` returns these objects.
+        :param slices: downloaded slices in the flight data format
+        """
+        self.airports = airports
+        self.airport_ids = airport_ids
+        self.airport_index = {airport_id: code for code, airport_id in enumerate(airport_ids)}
+        self.currencies = currencies
+        self.origin = origin
+        self.destination = destination
+        self.day = day
+        self.price = price
+        self.currency = currency
+        self.flights = flights
+        self.slices = slices
+        self._route_index = None
+
+    def __len__(self):
+        return len(self.day)
+
+    @classmethod
+    def from_flight_data(cls, flight_data):
+        """
+        Builds the table from data in the flight data format.
+        :param flight_data: data in required format, see documentation for details
+        :return: flight table
+        """
+        flights = flight_data['flights']
+        airport_ids = [airport['id'] for airport in flight_data['airports']]
+        airport_index = {airport_id: code for code, airport_id in enumerate(airport_ids)}
+        currency_index = {}
+
+        def encode_airport(airport_id):
+            # flights may reference airports missing from the airport list
+            if airport_id not in airport_index:
+                airport_index[airport_id] = len(airport_ids)
+                airport_ids.append(airport_id)
+            return airport_index[airport_id]
+
+        def encode_currency(currency):
+            return currency_index.setdefault(currency, len(currency_index))
+
+        origin = np.fromiter((encode_airport(flight['origin']) for flight in flights),
+                             dtype=np.int32, count=len(flights))
+        destination = np.fromiter((encode_airport(flight['destination']) for flight in flights),
+                                  dtype=np.int32, count=len(flights))
+        # numpy parses ISO dates without going through `strptime`
+        day = np.array([flight['date'] for flight in flights], dtype='datetime64[D]').astype(np.int32) + EPOCH_ORDINAL
+        price = np.fromiter((flight['price'] for flight in flights), dtype=np.float64, count=len(flights))
+        currency = np.fromiter((encode_currency(flight['currency']) for flight in flights),
+                               dtype=np.int32, count=len(flights))
+
+        return cls(airports=flight_data['airports'],
+                   airport_ids=airport_ids,
+                   currencies=list(currency_index.keys()),
+                   origin=origin,
+                   destination=destination,
+                   day=day,
+                   price=price,
+                   currency=currency,
+                   flights=flights,
+                   slices=flight_data.get('slices'))
+
+    def to_flight_data(self):
+        """
+        :return: data in the flight data format
+        """
+        data = {
+            'airports': self.airports,
+            'flights': [self.flight(row) for row in range(len(self))]
+        }
+
+        if self.slices is not None:
+            data['slices'] = self.slices
+
+        return data
+
+    def flight(self, row: int):
+        """
+        :param row: row of the flight in the table
+        :return: flight in the flight data format
+        """
+        if self.flights is not None:
+            return self.flights[row]
+
+        return {
+            'origin': self.airport_ids[self.origin[row]],
+            'destination': self.airport_ids[self.destination[row]],
+            'date': date.fromordinal(int(self.day[row])).strftime('%Y-%m-%d'),
+            'price': float(self.price[row]),
+            'currency': self.currencies[self.currency[row]]
+        }
+
+    def date_range(self):
+        """
+        :return: tuple of earliest and latest flight date or None if the table is empty
+        """
+        if len(self) == 0:
+            return None
+
+        return (datetime.fromordinal(int(self.day.min())),
+                datetime.fromordinal(int(self.day.max())))
+
+    def encode_airports(self, airport_ids):
+        """
+        :param airport_ids: airport ids
+        :return: array of airport codes, unknown airports are skipped
+        """
+        return np.array([self.airport_index[airport_id] for airport_id in airport_ids
+                         if airport_id in self.airport_index], dtype=np.int32)
+
+    def route_index(self):
+        """
+        Builds the route index on first use and keeps it with the table.
+        :return: tuple of rows sorted by route and day, their routes and their days. Routes are encoded as
+        origin * number of airports + destination.
+        """
+        if self._route_index is None:
+            route = self.origin.astype(np.int64) * len(self.airport_ids) + self.destination
+            order = np.lexsort((np.arange(len(self)), self.day, route))
+            self._route_index = order, route[order], self.day[order]
+
+        return self._route_index
+
+    def route_index_part(self, routes: list):
+        """
+        :param routes: list of (encoded origin, encoded destination) tuples
+        :return: part of the route index with the flights on the routes, e.g. to search them in another process
+        """
+        order, route, day = self.route_index()
+        keys = np.unique([origin * len(self.airport_ids) + destination for origin, destination in routes])
+        parts = [slice(start, end) for start, end in zip(np.searchsorted(route, keys, 'left').tolist(),
+                                                         np.searchsorted(route, keys, 'right').tolist())]
+
+        if not parts:
+            return order[:0], route[:0], day[:0]
+
+        return tuple(np.concatenate([column[part] for part in parts]) for column in (order, route, day))
+
+    def route_rows(self, origin: int, destination: int, min_day: int = None, max_day: int = None):
+        """
+        Looks up flights on a route in the route index, see `route_index`.
+        :param origin: encoded origin airport
+        :param destination: encoded destination airport
+        :param min_day: earliest date of the flight as day ordinal. By default all flights on the route.
+        :param max_day: latest date of the flight as day ordinal. By default all flights on the route.
+        :return: array of rows of the flights sorted by day, flights of the same day are sorted by row
+        """
+        order, route, day = self.route_index()
+        key = origin * len(self.airport_ids) + destination
+        start, end = np.searchsorted(route, key, 'left'), np.searchsorted(route, key, 'right')
+        if min_day is not None:
+            start += np.searchsorted(day[start:end], min_day, 'left')
+        if max_day is not None:
+            end = start + np.searchsorted(day[start:end], max_day + 1, 'left')
+
+        return order[start:end]
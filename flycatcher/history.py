@@ -0,0 +1,311 @@
+from flycatcher.flight_table import EPOCH_ORDINAL
+from datetime import date, datetime
+import numpy as np
+import struct
+import json
+import os
+
+# price history layout, a sequence of snapshots appended one after another:
+#   header        magic, version, time of the snapshot, base day, size of the string table, number of changes
+#   string table  UTF-8 JSON with routes added to the route dictionary and the airports if they changed
+#   changes       fixed-width little-endian change records sorted by route and day
+SNAPSHOT_MAGIC = b'SNAP'
+VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('<4sIdiII')
+# `route` indexes the route dictionary of (origin, destination, currency) entries, `day` is the day ordinal
+# relative to the previous change of the route in the snapshot or to the base day, `price` is the change
+# of the price in cents since the previous snapshot. Removed fares drop to a price of 0.
+CHANGE_DTYPE = np.dtype([
+    ('route', '<u4'),
+    ('day', '<u2'),
+    ('price', '<i4'),
+    ('removed', 'u1')
+])
+
+
+class PriceHistory:
+    """
+    Append-only store of flight prices over time.
+
+    Every snapshot of flight data, e.g. every download, records only the prices of (route, day) pairs which changed
+    since the previous snapshot, including fares which appeared or disappeared. Routes are dictionary-encoded,
+    days are delta-encoded within a route and prices are stored as changes in cents. Only the cheapest flight of
+    a route and day is kept.
+    """
+
+    def __init__(self, path: str):
+        """
+        Loads the history stored at `path`, if there is any.
+        :param path: path to the price history
+        """
+        self.path = path
+        self.routes = []
+        self.route_index = {}
+        self.times = []
+        # airports of every snapshot
+        self.airports = []
+
+        # changes of all snapshots sorted by route, day and snapshot
+        self.snapshot = np.empty(0, dtype=np.int32)
+        self.route = np.empty(0, dtype=np.int64)
+        self.day = np.empty(0, dtype=np.int64)
+        self.price = np.empty(0, dtype=np.int64)
+        self.delta = np.empty(0, dtype=np.int64)
+        self.removed = np.empty(0, dtype=bool)
+        self._keys = np.empty(0, dtype=np.int64)
+        # size of the complete snapshots in the file
+        self._size = 0
+
+        if os.path.isfile(path):
+            self._load()
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self, data: dict, time: datetime = None):
+        """
+        Appends a snapshot of flight data to the history. The file is only appended to, an interrupted write leaves
+        an incomplete snapshot which is ignored.
+        :param data: data in the flight data format
+        :param time: time of the snapshot. By default the current time.
+        :return: number of recorded changes
+        """
+        if time is None:
+            time = datetime.now()
+
+        flights = data['flights']
+        new_routes = []
+
+        def encode_route(flight):
+            route = flight['origin'], flight['destination'], flight['currency']
+            if route not in self.route_index:
+                self.route_index[route] = len(self.routes)
+                self.routes.append(route)
+                new_routes.append(list(route))
+            return self.route_index[route]
+
+        route = np.fromiter((encode_route(flight) for flight in flights), dtype=np.int64, count=len(flights))
+        day = np.array([flight['date'] for flight in flights], dtype='datetime64[D]').astype(np.int64) + EPOCH_ORDINAL
+        price = np.round(np.fromiter((flight['price'] for flight in flights), dtype=np.float64,
+                                     count=len(flights)) * 100).astype(np.int64)
+
+        # cheapest flight of every route and day
+        order = np.lexsort((price, day, route))
+        route, day, price = route[order], day[order], price[order]
+        first = np.ones(len(route), dtype=bool)
+        first[1:] = (route[1:] != route[:-1]) | (day[1:] != day[:-1])
+        route, day, price = route[first], day[first], price[first]
+
+        # compare with the latest prices, both are sorted by route and day
+        latest_route, latest_day, latest_price = self._latest()
+        new_keys, latest_keys = _keys(route, day), _keys(latest_route, latest_day)
+        position = np.minimum(np.searchsorted(latest_keys, new_keys), max(len(latest_keys) - 1, 0))
+        known = latest_keys[position] == new_keys if len(latest_keys) else np.zeros(len(new_keys), dtype=bool)
+        previous = np.where(known, latest_price[position] if len(latest_keys) else 0, 0)
+        changed = ~known | (previous != price)
+
+        gone = ~np.isin(latest_keys, new_keys)
+
+        change_route = np.concatenate((route[changed], latest_route[gone]))
+        change_day = np.concatenate((day[changed], latest_day[gone]))
+        change_delta = np.concatenate((price[changed] - previous[changed], -latest_price[gone]))
+        change_removed = np.concatenate((np.zeros(changed.sum(), dtype=bool), np.ones(gone.sum(), dtype=bool)))
+
+        order = np.lexsort((change_day, change_route))
+        change_route, change_day = change_route[order], change_day[order]
+        change_delta, change_removed = change_delta[order], change_removed[order]
+
+        records = np.empty(len(order), dtype=CHANGE_DTYPE)
+        base_day = int(change_day.min()) if len(order) else 0
+        day_delta = np.diff(change_day, prepend=base_day)
+        # the first change of every route is relative to the base day
+        starts = np.ones(len(order), dtype=bool)
+        starts[1:] = change_route[1:] != change_route[:-1]
+        day_delta[starts] = change_day[starts] - base_day
+
+        max_day_delta = np.iinfo(CHANGE_DTYPE['day']).max
+        if len(order) and day_delta.max() > max_day_delta:
+            raise ValueError('flights of a snapshot must not span more than %d days' % max_day_delta)
+
+        records['route'] = change_route
+        records['day'] = day_delta
+        records['price'] = change_delta
+        records['removed'] = change_removed
+
+        airports = data['airports'] if not self.airports or data['airports'] != self.airports[-1] else None
+        strings = json.dumps({'routes': new_routes, 'airports': airports}, separators=(',', ':')).encode('utf-8')
+
+        with open(self.path, 'ab') as fh:
+            # drop an incomplete snapshot of an interrupted append
+            fh.truncate(self._size)
+            fh.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, VERSION, time.timestamp(), base_day, len(strings),
+                                          len(records)))
+            fh.write(strings)
+            fh.write(records.tobytes())
+            fh.flush()
+            os.fsync(fh.fileno())
+            self._size = fh.tell()
+
+        self._add(len(self.times), time, data['airports'], change_route, change_day, change_delta, change_removed)
+
+        return len(records)
+
+    def change_counts(self):
+        """
+        :return: list of the number of recorded changes of every snapshot
+        """
+        return np.bincount(self.snapshot, minlength=len(self.times)).tolist()
+
+    def history(self, origin: str, destination: str, day: date = None):
+        """
+        :param origin: id of the departure airport
+        :param destination: id of the arrival airport
+        :param day: date of the flights. By default all dates.
+        :return: list of (date, time of the snapshot, price or None if the fare was removed, currency) in order
+        of date and time
+        """
+        changes = []
+
+        for (route_origin, route_destination, currency), code in self.route_index.items():
+            if route_origin != origin or route_destination != destination:
+                continue
+
+            if day is None:
+                start, end = np.searchsorted(self.route, code, 'left'), np.searchsorted(self.route, code, 'right')
+            else:
+                key = _keys(np.array([code]), np.array([day.toordinal()]))[0]
+                start, end = (np.searchsorted(self._keys, key, 'left'), np.searchsorted(self._keys, key, 'right'))
+
+            for i in range(start, end):
+                changes.append((date.fromordinal(int(self.day[i])), self.times[self.snapshot[i]],
+                                None if self.removed[i] else int(self.price[i]) / 100, currency))
+
+        return sorted(changes, key=lambda change: change[:2])
+
+    def drops(self, snapshot: int = -1, n: int = None):
+        """
+        :param snapshot: number of the snapshot, negative numbers count from the last. Default: the last snapshot.
+        :param n: maximal number of returned drops. By default all drops.
+        :return: list of (origin, destination, date, previous price, price, currency) of fares which got cheaper
+        in the snapshot, from the biggest drop
+        """
+        snapshot = range(len(self.times))[snapshot]
+        # fares which existed before, their previous price is the current price minus the change
+        dropped = np.nonzero((self.snapshot == snapshot) & ~self.removed & (self.delta < 0)
+                             & (self.price - self.delta > 0))[0]
+        dropped = dropped[np.argsort(self.delta[dropped], kind='stable')][:n]
+
+        return [(*self.routes[self.route[i]][:2], date.fromordinal(int(self.day[i])),
+                 int(self.price[i] - self.delta[i]) / 100, int(self.price[i]) / 100, self.routes[self.route[i]][2])
+                for i in dropped.tolist()]
+
+    def as_of(self, snapshot: int = -1):
+        """
+        Reconstructs flight data as of a snapshot, e.g. to search it with `find_cheapest_flights`.
+        :param snapshot: number of the snapshot, negative numbers count from the last. Default: the last snapshot.
+        :return: data in the flight data format
+        """
+        snapshot = range(len(self.times))[snapshot]
+        route, day, price = self._latest(snapshot)
+
+        return {
+            'airports': self.airports[snapshot],
+            'flights': [{
+                'origin': self.routes[route_code][0],
+                'destination': self.routes[route_code][1],
+                'date': date.fromordinal(flight_day).strftime('%Y-%m-%d'),
+                'price': flight_price / 100,
+                'currency': self.routes[route_code][2]
+            } for route_code, flight_day, flight_price in zip(route.tolist(), day.tolist(), price.tolist())]
+        }
+
+    def _latest(self, snapshot: int = None):
+        """
+        :param snapshot: number of the snapshot. By default the last snapshot.
+        :return: tuple of route, day and price in cents of the fares as of the snapshot, sorted by route and day
+        """
+        valid = np.ones(len(self.snapshot), dtype=bool) if snapshot is None else self.snapshot <= snapshot
+        rows = np.nonzero(valid)[0]
+
+        # changes are sorted by route, day and snapshot, the last change of every route and day is the latest
+        last = np.ones(len(rows), dtype=bool)
+        last[:-1] = self._keys[rows][1:] != self._keys[rows][:-1]
+        rows = rows[last & ~self.removed[rows]]
+
+        return self.route[rows], self.day[rows], self.price[rows]
+
+    def _load(self):
+        with open(self.path, 'rb') as fh:
+            content = fh.read()
+
+        offset = 0
+
+        while offset + SNAPSHOT_HEADER.size <= len(content):
+            magic, version, timestamp, base_day, strings_size, change_count = \
+                SNAPSHOT_HEADER.unpack_from(content, offset)
+
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError('%s is not a price history' % self.path)
+            if version != VERSION:
+                raise ValueError('Unsupported price history version %d, expected %d' % (version, VERSION))
+
+            strings_offset = offset + SNAPSHOT_HEADER.size
+            records_offset = strings_offset + strings_size
+            end = records_offset + change_count * CHANGE_DTYPE.itemsize
+
+            # an interrupted append leaves an incomplete snapshot at the end
+            if end > len(content):
+                break
+
+            strings = json.loads(content[strings_offset:records_offset].decode('utf-8'))
+            records = np.frombuffer(content, dtype=CHANGE_DTYPE, count=change_count, offset=records_offset)
+
+            for route in strings['routes']:
+                self.route_index[tuple(route)] = len(self.routes)
+                self.routes.append(tuple(route))
+
+            route = records['route'].astype(np.int64)
+            starts = np.ones(len(records), dtype=bool)
+            starts[1:] = route[1:] != route[:-1]
+            # days are non-decreasing within a route, so the running maximum finds the sum before every route
+            day_sum = np.cumsum(records['day'].astype(np.int64))
+            day = base_day + day_sum - np.maximum.accumulate(np.where(starts, day_sum - records['day'], 0))
+
+            self._add(len(self.times), datetime.fromtimestamp(timestamp),
+                      strings['airports'] if strings['airports'] is not None else self.airports[-1],
+                      route, day, records['price'].astype(np.int64), records['removed'].astype(bool))
+            offset = end
+
+        self._size = offset
+
+    def _add(self, snapshot, time, airports, route, day, delta, removed):
+        """
+        Adds changes of a snapshot, prices are restored from the changes of all snapshots.
+        """
+        self.times.append(time)
+        self.airports.append(airports)
+
+        snapshots = np.concatenate((self.snapshot, np.full(len(route), snapshot, dtype=np.int32)))
+        route = np.concatenate((self.route, route))
+        day = np.concatenate((self.day, day))
+        delta = np.concatenate((self.delta, delta))
+        removed = np.concatenate((self.removed, removed))
+
+        order = np.lexsort((snapshots, day, route))
+        self.snapshot, self.route, self.day = snapshots[order], route[order], day[order]
+        self.delta, self.removed = delta[order], removed[order]
+        self._keys = _keys(self.route, self.day)
+
+        # the price is the sum of the changes of the route and day so far
+        starts = np.ones(len(order), dtype=bool)
+        starts[1:] = self._keys[1:] != self._keys[:-1]
+        price_sum = np.cumsum(self.delta)
+        group = np.cumsum(starts) - 1
+        self.price = price_sum - (price_sum - self.delta)[starts][group]
+
+
+def _keys(route, day):
+    """
+    :return: array of keys of route and day pairs, ordered as the pairs
+    """
+    return (route.astype(np.int64) << 32) | day.astype(np.int64)
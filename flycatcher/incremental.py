@@ -0,0 +1,261 @@
+from flycatcher.flight_table import FlightTable
+from flycatcher.search import top_k_candidates
+from itertools import islice
+from datetime import datetime
+import heapq
+
+# number of departure days searched together, roughly the days of a downloaded slice
+BLOCK_DAYS = 30
+
+
+class IncrementalRoundTrips:
+    """
+    Cheapest round-trips of one query kept up to date while flights of single routes are replaced.
+
+    Departures of every destination are split into blocks of `block_days` days. Every block keeps its cheapest
+    round-trips, which are found with `top_k_candidates`, and the ranking lazily merges the cheapest candidates
+    of every destination. Updating the flights of a route in a date range searches again only the blocks whose
+    departures or returns lie in the range, so small updates do not rescan the flight data.
+
+    Round-trips are ordered as by `top_k_round_trips`, flights are ordered by the time they were added, i.e.
+    by their position in the flight data followed by updated flights.
+    """
+
+    def __init__(self,
+                 flights: list,
+                 airports: dict,
+                 origin: str,          # airport id
+                 destinations: list,
+                 min_day: int,
+                 max_day: int,
+                 min_days: int,
+                 max_days: int,
+                 max_price: float = None,
+                 max_flights_per_airport: int = None,
+                 n: int = None,
+                 block_days: int = BLOCK_DAYS):
+        """
+        :param flights: flights in the flight data format
+        :param airports: airport id -> airport in the flight data format
+        :param origin: id of the starting airport
+        :param destinations: ids of the considered destination airports
+        :param min_day: earliest date of departure as day ordinal
+        :param max_day: latest date of return as day ordinal
+        :param min_days: minimal number of days a round-trip should last
+        :param max_days: maximal number of days a round-trip may last
+        :param max_price: maximal full price of the round-trip
+        :param max_flights_per_airport: maximal number of round-trip flights per destination airport
+        :param n: number of ranked round-trips. By default all round-trips.
+        :param block_days: number of departure days searched together. Default: 30.
+        """
+        if block_days <= 0:
+            raise ValueError('`block_days` must be larger than 0')
+
+        self.airports = airports
+        self.origin = origin
+        self.min_day = min_day
+        self.max_day = max_day
+        self.min_days = min_days
+        self.max_days = max_days
+        self.max_price = max_price
+        self.max_flights_per_airport = max_flights_per_airport
+        self.n = n
+        self.block_days = block_days
+
+        # a destination contributes at most this many round-trips to the ranking, so does each of its blocks
+        limits = [limit for limit in (n, max_flights_per_airport) if limit is not None]
+        self.block_size = min(limits) if limits else None
+
+        # positions of the destinations break ties as in `top_k_candidates`
+        self.ranks = {destination: rank for rank, destination in enumerate(destinations) if destination != origin}
+
+        # flights to and from every destination by id, ids order flights like rows of a flight table
+        self.flights = {destination: {} for destination in self.ranks}
+        self.next_id = len(flights)
+
+        for flight_id, flight in enumerate(flights):
+            destination = self._destination(flight['origin'], flight['destination'])
+            if destination is not None:
+                self.flights[destination][flight_id] = flight
+
+        # destination -> block -> keys of candidates, destination -> sorted keys of the cheapest candidates
+        # of all blocks and key -> (flight to X, flight from X)
+        self.blocks = {destination: {} for destination in self.ranks}
+        self.keys = {}
+        self.candidates = {}
+
+        self._search([(destination, range(self._block(min_day), self._block(max_day) + 1))
+                      for destination in self.ranks])
+
+        self.ranking = self._rank()
+
+    def __len__(self):
+        return len(self.ranking)
+
+    def __iter__(self):
+        """
+        :return: iterator of (flight to X, flight from X) in ascending order by round-trip price
+        """
+        return (self.candidates[key] for key in self.ranking)
+
+    def update(self, from_airport: str, to_airport: str, first_date: datetime, last_date: datetime, flights: list):
+        """
+        Replaces the flights of a route between two dates, e.g. the flights of a refreshed slice, and updates
+        the ranking. Flights equal to replaced flights keep their place among flights of the same price.
+        :param from_airport: id of the departure airport of the route
+        :param to_airport: id of the arrival airport of the route
+        :param first_date: first date of the replaced flights
+        :param last_date: last date of the replaced flights
+        :param flights: flights of the route between both dates in the flight data format, an empty list removes
+        the flights
+        :return: tuple of inserted and removed round-trips, lists of (position, flight to X, flight from X) with
+        positions in the new ranking for inserted and in the previous ranking for removed round-trips
+        """
+        first_day, last_day = first_date.toordinal(), last_date.toordinal()
+        # ISO dates compare as strings
+        first, last = first_date.strftime('%Y-%m-%d'), last_date.strftime('%Y-%m-%d')
+
+        for flight in flights:
+            if flight['origin'] != from_airport or flight['destination'] != to_airport:
+                raise ValueError('flight %s -> %s is not on route %s -> %s'
+                                 % (flight['origin'], flight['destination'], from_airport, to_airport))
+            if not first <= flight['date'] <= last:
+                raise ValueError('flight on %s is not between %s and %s' % (flight['date'], first, last))
+
+        destination = self._destination(from_airport, to_airport)
+        if destination is None:
+            return [], []
+
+        previous_ranking = self.ranking
+
+        route_flights = self.flights[destination]
+        replaced = {}
+
+        for flight_id, flight in list(route_flights.items()):
+            if flight['origin'] == from_airport and first <= flight['date'] <= last:
+                replaced.setdefault(_flight_key(flight), []).append(flight_id)
+                del route_flights[flight_id]
+
+        for flight in flights:
+            flight_ids = replaced.get(_flight_key(flight))
+            if flight_ids:
+                flight_id = flight_ids.pop(0)
+            else:
+                flight_id, self.next_id = self.next_id, self.next_id + 1
+            route_flights[flight_id] = flight
+
+        # departures which may return on the updated days
+        if from_airport == self.origin:
+            first_departure, last_departure = first_day, last_day
+        else:
+            first_departure, last_departure = first_day - self.max_days, last_day - self.min_days
+
+        first_departure, last_departure = max(first_departure, self.min_day), min(last_departure, self.max_day)
+        if first_departure <= last_departure:
+            blocks = range(self._block(first_departure), self._block(last_departure) + 1)
+            dropped = self._search([(destination, blocks)])
+        else:
+            dropped = {}
+
+        self.ranking = self._rank()
+
+        ranked, previously_ranked = set(self.ranking), set(previous_ranking)
+        inserted = [(position, *self.candidates[key]) for position, key in enumerate(self.ranking)
+                    if key not in previously_ranked]
+        # removed round-trips may have been dropped from the candidates
+        removed = [(position, *self.candidates.get(key, dropped.get(key)))
+                   for position, key in enumerate(previous_ranking) if key not in ranked]
+
+        return inserted, removed
+
+    def _destination(self, from_airport, to_airport):
+        """
+        :return: destination of a route from or to the origin or None if the route is not searched
+        """
+        if from_airport == self.origin and to_airport in self.ranks:
+            return to_airport
+        if to_airport == self.origin and from_airport in self.ranks:
+            return from_airport
+        return None
+
+    def _block(self, day):
+        return (day - self.min_day) // self.block_days
+
+    def _search(self, searches):
+        """
+        Searches the cheapest round-trips of blocks of departures and replaces their candidates.
+        :param searches: list of (destination, blocks)
+        :return: dictionary key -> (flight to X, flight from X) of the replaced candidates
+        """
+        removed = {}
+
+        for destination, blocks in searches:
+            route_flights = self.flights[destination]
+            destination_blocks = self.blocks[destination]
+            ids = sorted(route_flights)
+            table = FlightTable.from_flight_data({
+                'airports': [self.airports[self.origin], self.airports[destination]],
+                'flights': [route_flights[flight_id] for flight_id in ids]
+            })
+
+            for block in blocks:
+                for key in destination_blocks.pop(block, []):
+                    removed[key] = self.candidates.pop(key)
+
+                candidates = self._search_block(table, ids, destination, block) if len(table) else []
+
+                for key, to_flight, from_flight in candidates:
+                    self.candidates[key] = to_flight, from_flight
+
+                if candidates:
+                    destination_blocks[block] = [key for key, _, _ in candidates]
+
+            # like a block, a destination contributes at most `block_size` round-trips
+            self.keys[destination] = list(heapq.merge(*destination_blocks.values()))[:self.block_size]
+
+        return removed
+
+    def _search_block(self, table, ids, destination, block):
+        """
+        :return: list of at most `block_size` (sort key, flight to X, flight from X) departing in the block,
+        in ascending order. Sort keys are the keys of `top_k_candidates` with days relative to `min_day` and ids of
+        the flights instead of rows.
+        """
+        first_day = self.min_day + block * self.block_days
+        last_day = min(first_day + self.block_days - 1, self.max_day)
+        # the grids of `top_k_candidates` only span the days of the departures and their returns
+        window_max_day = min(last_day + self.max_days, self.max_day)
+        offset = first_day - self.min_day
+        candidates = []
+
+        for full_price, departure_day, return_day, _, from_row, to_row in top_k_candidates(
+                table,
+                origin=self.origin,
+                destinations=[destination],
+                min_day=first_day,
+                max_day=window_max_day,
+                min_days=self.min_days,
+                max_days=self.max_days,
+                max_price=self.max_price,
+                max_flights_per_airport=self.block_size,
+                min_departure_day=first_day,
+                max_departure_day=last_day):
+            key = (full_price, departure_day + offset, return_day + offset, self.ranks[destination],
+                   ids[from_row], ids[to_row])
+            candidates.append((key, table.flight(to_row), table.flight(from_row)))
+
+            if len(candidates) == self.block_size:
+                break
+
+        return candidates
+
+    def _rank(self):
+        """
+        :return: list of keys of the `n` cheapest candidates. Destinations keep at most `block_size` candidates,
+        which respects `max_flights_per_airport`.
+        """
+        return list(islice(heapq.merge(*self.keys.values()), self.n))
+
+
+def _flight_key(flight):
+    return tuple(sorted(flight.items()))
@@ -0,0 +1,131 @@
+import threading
+import logging
+import json
+import os
+
+
+class Journal:
+    """
+    Append-only journal of downloaded flight data stored as JSON lines.
+
+    Every downloaded slice (flights on a route in a month) is written as soon as it is complete, so an interrupted
+    download can be resumed and compacted into flight data. Records are either
+    `{'type': 'airports', 'airports': [...]}` or
+    `{'type': 'slice', 'origin': ..., 'destination': ..., 'month': ..., 'updated': ..., 'flights': [...]}`.
+    """
+
+    def __init__(self,
+                 path: str,
+                 resume: bool = True):
+        """
+        :param path: path to the journal file
+        :param resume: keep records of an existing journal. Otherwise the journal is truncated. Default: True.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._fh = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+        # terminate a record cut off by an interruption, so that it does not corrupt the next record
+        if resume and self._fh.tell() > 0:
+            with open(path, 'rb') as fh:
+                fh.seek(-1, os.SEEK_END)
+                if fh.read(1) != b'\n':
+                    self._fh.write('\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Closes the journal file.
+        """
+        with self._lock:
+            self._fh.close()
+
+    def remove(self):
+        """
+        Closes and deletes the journal file.
+        """
+        self.close()
+        os.remove(self.path)
+
+    def append(self, record: dict):
+        """
+        Writes a record and flushes it to disk.
+        :param record: JSON serializable record
+        """
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+
+        with self._lock:
+            self._fh.write(line)
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+
+    def records(self):
+        """
+        :return: generator of written records. A record cut off by an interruption is skipped.
+        """
+        with self._lock:
+            self._fh.flush()
+
+        with open(self.path, encoding='utf-8') as fh:
+            for line_number, line in enumerate(fh, 1):
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    logging.warning('Skipping corrupted record in line %d of %s.' % (line_number, self.path))
+
+    def slices(self):
+        """
+        :return: (origin, destination, month) -> latest slice record
+        """
+        return {(record['origin'], record['destination'], record['month']): record
+                for record in self.records() if record['type'] == 'slice'}
+
+    def airports(self):
+        """
+        :return: latest written airports or None if no airports were written
+        """
+        airports = None
+
+        for record in self.records():
+            if record['type'] == 'airports':
+                airports = record['airports']
+
+        return airports
+
+    def to_flight_data(self, previous_data: dict = None):
+        """
+        Compacts the journal into flight data, keeping the latest record of every slice. An interrupted incremental
+        download journals only the slices it downloaded again, so the journal is merged into the previous data:
+        journaled slices replace the flights of the same route and month, all other flights are kept.
+        :param previous_data: flight data the journaled download started from, e.g. the existing data file
+        :return: data in the flight data format
+        """
+        journal_slices = self.slices()
+        data = {
+            'airports': self.airports() or [],
+            'flights': [],
+            'slices': []
+        }
+
+        if previous_data is not None:
+            airport_ids = {airport['id'] for airport in data['airports']}
+            data['airports'].extend(airport for airport in previous_data['airports']
+                                    if airport['id'] not in airport_ids)
+            data['flights'].extend(flight for flight in previous_data['flights']
+                                   if (flight['origin'], flight['destination'], flight['date'][:7])
+                                   not in journal_slices)
+            data['slices'].extend(previous_slice for previous_slice in previous_data.get('slices', [])
+                                  if (previous_slice['origin'], previous_slice['destination'],
+                                      previous_slice['month']) not in journal_slices)
+
+        for record in journal_slices.values():
+            data['flights'].extend(record['flights'])
+            data['slices'].append({field: value for field, value in record.items()
+                                   if field not in ('type', 'flights')})
+
+        return data
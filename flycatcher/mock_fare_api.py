@@ -0,0 +1,268 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from flycatcher.rate_limiter import TokenBucket
+from urllib.parse import urlsplit, parse_qs
+from datetime import date, datetime
+import numpy as np
+import threading
+import calendar
+import logging
+import math
+import gzip
+import json
+import time
+
+# path of the round trip fares endpoint, cheapest fares per day are served below it
+API_PATH = '/farefinder/3/roundTripFares'
+
+# server errors returned with probability `error_rate`
+ERROR_STATUS_CODES = (500, 502, 503)
+
+
+class MockFareApi(ThreadingHTTPServer):
+    """
+    Local stand-in for the Ryanair fare API serving `roundTripFares` and `cheapestPerDay` from flight data,
+    e.g. generated with `generate_flight_data`.
+
+    Responses are delayed by `latency` seconds, fail with a server error at random with probability `error_rate`
+    and are throttled with 429 and `Retry-After` beyond `requests_per_second`. Bodies are gzip-compressed
+    for clients accepting it.
+    """
+
+    daemon_threads = True
+
+    def __init__(self,
+                 address,
+                 data: dict,
+                 latency: float = 0,
+                 latency_jitter: float = 0,
+                 error_rate: float = 0,
+                 requests_per_second: float = None,
+                 burst: int = 1,
+                 compress: bool = True,
+                 seed: int = None):
+        """
+        :param address: tuple of host and port, port 0 picks a free port
+        :param data: data in the flight data format
+        :param latency: number of seconds every response is delayed. Default: 0.
+        :param latency_jitter: maximal number of seconds added to the latency at random. Default: 0.
+        :param error_rate: probability of a server error. Default: 0.
+        :param requests_per_second: number of requests per second answered before throttling.
+        By default requests are not throttled.
+        :param burst: number of requests answered at once before throttling. Default: 1.
+        :param compress: gzip-compress responses for clients sending `Accept-Encoding: gzip`. Default: True.
+        :param seed: seed of the random generator of latencies and errors
+        """
+        if not 0 <= error_rate <= 1:
+            raise ValueError('`error_rate` must be between 0 and 1')
+
+        super().__init__(address, MockFareApiHandler)
+        self.airports = {airport['id']: airport for airport in data['airports']}
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limiter = TokenBucket(requests_per_second, burst) if requests_per_second is not None else None
+        self.compress = compress
+        self.random = np.random.default_rng(seed)
+        self.stats = {'requests': 0, 'errors': 0, 'throttles': 0}
+        self._lock = threading.Lock()
+        self._thread = None
+
+        # cheapest flight on every route and day
+        self.fares = {}
+
+        for flight in data['flights']:
+            key = flight['origin'], flight['destination']
+            day_fares = self.fares.setdefault(key, {})
+            if flight['date'] not in day_fares or flight['price'] < day_fares[flight['date']]['price']:
+                day_fares[flight['date']] = flight
+
+    @property
+    def url(self):
+        """
+        :return: url of the round trip fares endpoint, see `RyanairDownloader`
+        """
+        host, port = self.server_address[:2]
+        return 'http://%s:%d%s' % (host, port, API_PATH)
+
+    def start(self):
+        """
+        Serves requests in a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops serving requests and closes the socket.
+        """
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+
+        self.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def count(self, **counters):
+        """
+        Increments counters of `stats`.
+        :param counters: counter name -> increment
+        """
+        with self._lock:
+            for name, increment in counters.items():
+                self.stats[name] += increment
+
+    def draw(self):
+        """
+        :return: tuple of the latency of a response and the status code of its server error or None
+        """
+        with self._lock:
+            jitter, error = self.random.random(2)
+            status = int(self.random.choice(ERROR_STATUS_CODES))
+
+        return self.latency + jitter * self.latency_jitter, status if error < self.error_rate else None
+
+    def round_trip_fares(self, parameters: dict):
+        """
+        :param parameters: query parameters of the `roundTripFares` endpoint
+        :return: cheapest round-trip from the origin to every destination in the requested dates
+        """
+        origin = parameters['departureAirportIataCode']
+        outbound_dates = parameters['outboundDepartureDateFrom'], parameters['outboundDepartureDateTo']
+        inbound_dates = parameters['inboundDepartureDateFrom'], parameters['inboundDepartureDateTo']
+        fares = []
+
+        for (from_airport, to_airport), day_fares in self.fares.items():
+            if from_airport != origin:
+                continue
+
+            outbound = [flight for day, flight in day_fares.items() if outbound_dates[0] <= day <= outbound_dates[1]]
+            inbound = [flight for day, flight in self.fares.get((to_airport, from_airport), {}).items()
+                       if inbound_dates[0] <= day <= inbound_dates[1]]
+
+            # the cheapest round-trip, returning on or after the day of departure
+            round_trips = [(to_flight['price'] + from_flight['price'], to_flight['date'], from_flight['date'],
+                            to_flight, from_flight)
+                           for to_flight in outbound for from_flight in inbound
+                           if from_flight['date'] >= to_flight['date']]
+            if not round_trips:
+                continue
+
+            *_, outbound, inbound = min(round_trips, key=lambda round_trip: round_trip[:3])
+            fares.append({
+                'outbound': self._fare(outbound),
+                'inbound': self._fare(inbound),
+                'summary': {'price': self._price(outbound['price'] + inbound['price'], outbound['currency'])}
+            })
+
+        fares.sort(key=lambda fare: fare['summary']['price']['value'])
+
+        return {'fares': fares, 'nextPage': None, 'size': len(fares)}
+
+    def cheapest_per_day(self, origin: str, destination: str, parameters: dict):
+        """
+        :param origin: IATA of the departure airport
+        :param destination: IATA of the arrival airport
+        :param parameters: query parameters of the `cheapestPerDay` endpoint
+        :return: cheapest flight of every day of the requested month
+        """
+        month = datetime.strptime(parameters['outboundMonthOfDate'], '%Y-%m-%d')
+        day_fares = self.fares.get((origin, destination), {})
+        fares = []
+
+        for day in range(1, calendar.monthrange(month.year, month.month)[1] + 1):
+            day = date(month.year, month.month, day).strftime('%Y-%m-%d')
+            flight = day_fares.get(day)
+            fares.append({
+                'day': day,
+                'price': self._price(flight['price'], flight['currency']) if flight is not None else None,
+                'soldOut': False,
+                'unavailable': flight is None
+            })
+
+        return {'outbound': {'fares': fares}}
+
+    def _fare(self, flight):
+        return {
+            'departureAirport': self._airport(flight['origin']),
+            'arrivalAirport': self._airport(flight['destination']),
+            'departureDate': '%sT%s' % (flight['date'], flight.get('time', '00:00:00')),
+            'price': self._price(flight['price'], flight['currency'])
+        }
+
+    def _airport(self, airport_id):
+        airport = self.airports.get(airport_id, {'id': airport_id})
+        response = {'iataCode': airport_id, 'name': airport.get('name', airport_id)}
+
+        if airport.get('group') is not None:
+            response['city'] = {'code': airport['group']}
+
+        return response
+
+    @staticmethod
+    def _price(value, currency):
+        return {'value': round(value, 2), 'currencyCode': currency}
+
+
+class MockFareApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, delayed acknowledgements would stall keep-alive connections
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parameters = {parameter: values[-1] for parameter, values in parse_qs(url.query).items()}
+        path = url.path[len(API_PATH):].strip('/').split('/') if url.path.startswith(API_PATH) else None
+        self.server.count(requests=1)
+
+        if self.server.rate_limiter is not None:
+            wait = self.server.rate_limiter.try_acquire()
+
+            if wait > 0:
+                self.server.count(throttles=1)
+                self._send(429, {'message': 'too many requests'}, {'Retry-After': str(math.ceil(wait))})
+                return
+
+        latency, error = self.server.draw()
+        time.sleep(latency)
+
+        if error is not None:
+            self.server.count(errors=1)
+            self._send(error, {'message': 'server error'})
+            return
+
+        try:
+            if path == ['']:
+                self._send(200, self.server.round_trip_fares(parameters))
+            elif path is not None and len(path) == 3 and path[2] == 'cheapestPerDay':
+                self._send(200, self.server.cheapest_per_day(path[0], path[1], parameters))
+            else:
+                self._send(404, {'message': 'not found'})
+        except (KeyError, ValueError) as e:
+            self._send(400, {'message': 'invalid parameters: %s' % e})
+
+    def _send(self, status, body, headers=None):
+        content = json.dumps(body).encode('utf-8')
+        compress = self.server.compress and 'gzip' in self.headers.get('Accept-Encoding', '')
+
+        if compress:
+            content = gzip.compress(content)
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        logging.debug('%s %s' % (self.address_string(), format % args))
@@ -0,0 +1,155 @@
+from flycatcher.flight_table import FlightTable
+from bisect import insort
+import numpy as np
+
+
+def group_airports(airports):
+    """
+    :param airports: airports in the flight data format
+    :return: dictionary group -> ids of the airports of the group, built from the `group` field of the airports
+    """
+    groups = {}
+
+    for airport in airports:
+        if airport.get('group') is not None:
+            groups.setdefault(airport['group'], []).append(airport['id'])
+
+    return groups
+
+
+def open_jaw_round_trips(table: FlightTable,
+                         origin: str,          # airport id
+                         destinations: list,
+                         min_day: int,
+                         max_day: int,
+                         min_days: int,
+                         max_days: int,
+                         groups: dict,
+                         max_price: float = None,
+                         max_flights_per_airport: int = None,
+                         n: int = None):
+    """
+    Finds open-jaw round-trips: flights to X combined with flights from any airport of the group of X to any airport
+    of the group of the origin. Airports without a group only pair with themselves, so without groups the result
+    equals the round-trip search.
+
+    Flights of every destination are sorted by price and joined in price order. Once `n` round-trips are found,
+    the price of the n-th cheapest is an upper bound for the rest of the search (branch and bound): the join of
+    a destination stops at the first outbound flight that cannot beat it and every outbound flight is joined only
+    with return flights below it.
+    :param table: flight table
+    :param origin: id of the starting airport
+    :param destinations: ids of the considered destination airports
+    :param min_day: earliest date of departure as day ordinal
+    :param max_day: latest date of return as day ordinal
+    :param min_days: minimal number of days a round-trip should last
+    :param max_days: maximal number of days a round-trip may last
+    :param groups: dictionary group -> ids of the airports of the group
+    :param max_price: maximal full price of the round-trip
+    :param max_flights_per_airport: maximal number of round-trip flights per destination airport
+    :param n: number of needed round-trips. By default all round-trips.
+    :return: generator of (flight to X, flight from Y) in ascending order by round-trip price
+    """
+    members = _group_members(groups)
+    origin_code = table.airport_index[origin]
+    return_codes = table.encode_airports(members.get(origin, [origin]))
+
+    # round-trips per destination needed at most, the airport limit is applied again by the caller
+    limits = [limit for limit in (n, max_flights_per_airport) if limit is not None]
+    limit = min(limits) if limits else None
+
+    # cheapest round-trips of all searched destinations, at most `n`
+    round_trips = []
+
+    for rank, destination in enumerate(destinations):
+        if destination not in table.airport_index:
+            continue
+
+        to_rows = table.route_rows(origin_code, table.airport_index[destination], min_day, max_day)
+        from_rows = [table.route_rows(code, return_code, min_day, max_day)
+                     for code in table.encode_airports(members.get(destination, [destination])).tolist()
+                     for return_code in return_codes.tolist()]
+        from_rows = np.concatenate(from_rows) if from_rows else np.empty(0, dtype=np.int64)
+
+        if len(to_rows) == 0 or len(from_rows) == 0:
+            continue
+
+        # per-route price lists, equally priced flights keep the row order
+        to_rows = to_rows[np.lexsort((to_rows, table.price[to_rows]))]
+        from_rows = from_rows[np.lexsort((from_rows, table.price[from_rows]))]
+        from_prices = table.price[from_rows]
+        from_days = table.day[from_rows]
+
+        # cheapest round-trips of the destination, at most `limit`
+        candidates = []
+
+        for to_row, to_price, departure_day in zip(to_rows.tolist(), table.price[to_rows].tolist(),
+                                                   table.day[to_rows].tolist()):
+            bound = _bound(max_price, round_trips, n, candidates, limit)
+
+            # outbound flights are sorted by price, no later flight beats the bound either
+            if bound is not None and to_price + from_prices[0] > bound:
+                break
+
+            # consider return flights up to the bound, which are a prefix of the sorted return flights
+            end = len(from_rows) if bound is None else np.searchsorted(from_prices, bound - to_price + 1e-6, 'right')
+            full_prices = to_price + from_prices[:end]
+            duration = from_days[:end] - departure_day
+            valid = (duration >= min_days) & (duration <= max_days)
+
+            if bound is not None:
+                valid &= full_prices <= bound
+
+            index = np.nonzero(valid)[0]
+
+            # only the `limit` cheapest return flights, and those priced equally to the last of them, may be needed
+            if limit is not None and len(index) > limit:
+                index = index[full_prices[index] <= full_prices[index[limit - 1]]]
+
+            for i in index.tolist():
+                candidate = (float(full_prices[i]), departure_day, int(from_days[i]), rank, int(from_rows[i]), to_row)
+
+                if limit is None:
+                    candidates.append(candidate)
+                elif len(candidates) < limit or candidate < candidates[-1]:
+                    insort(candidates, candidate)
+                    del candidates[limit:]
+
+        round_trips.extend(candidates)
+
+        if n is not None:
+            round_trips.sort()
+            del round_trips[n:]
+
+    # order by price and break ties the same way the index search does
+    for _, _, _, _, from_row, to_row in sorted(round_trips):
+        yield table.flight(to_row), table.flight(from_row)
+
+
+def _group_members(groups):
+    """
+    :return: dictionary airport id -> ids of the airports of its group, starting with the airport itself
+    """
+    members = {}
+
+    for airport_ids in groups.values():
+        for airport_id in airport_ids:
+            members[airport_id] = [airport_id] + [other for other in airport_ids if other != airport_id]
+
+    return members
+
+
+def _bound(max_price, round_trips, n, candidates, limit):
+    """
+    :return: highest full price a round-trip may have to be yielded or None if there is no bound yet
+    """
+    bounds = [max_price]
+
+    if n is not None and len(round_trips) >= n:
+        bounds.append(round_trips[n - 1][0])
+    if limit is not None and len(candidates) >= limit:
+        bounds.append(candidates[limit - 1][0])
+
+    bounds = [bound for bound in bounds if bound is not None]
+
+    return min(bounds) if bounds else None
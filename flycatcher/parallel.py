@@ -0,0 +1,218 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from flycatcher.flight_table import FlightTable
+from flycatcher.search import top_k_candidates
+from itertools import islice
+import numpy as np
+import weakref
+import heapq
+import os
+
+# columns copied to shared memory, 8-byte columns first to keep every column aligned
+SHARED_COLUMNS = (('price', np.float64), ('origin', np.int32), ('destination', np.int32),
+                  ('day', np.int32), ('currency', np.int32))
+
+# flight table attached to shared memory in a worker process
+_worker_table = None
+
+
+class SharedFlightTable:
+    """
+    Copy of the flight table columns in shared memory. Worker processes attach to it by name instead of
+    receiving a pickled copy of the flight data.
+    """
+
+    def __init__(self, table: FlightTable):
+        """
+        :param table: flight table
+        """
+        size = sum(np.dtype(dtype).itemsize for _, dtype in SHARED_COLUMNS) * len(table)
+        self.shared_memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.spec = self.shared_memory.name, len(table), table.airport_ids, table.currencies
+
+        for name, column in _column_views(self.shared_memory.buf, len(table)).items():
+            column[:] = getattr(table, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Releases the shared memory.
+        """
+        self.shared_memory.close()
+        self.shared_memory.unlink()
+
+
+class ParallelSearch:
+    """
+    Shared copy of a flight table and a process pool whose workers are attached to it. Both are created once
+    per table and reused by all its searches, see `parallel_round_trips`.
+    """
+
+    def __init__(self, table: FlightTable, workers: int = None):
+        """
+        :param table: flight table
+        :param workers: number of worker processes. By default the number of CPUs.
+        """
+        self.workers = workers
+        self.shared_table = SharedFlightTable(table)
+        self.executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_attach,
+                                            initargs=(self.shared_table.spec,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Shuts the workers down and releases the shared memory.
+        """
+        self.executor.shutdown()
+        self.shared_table.close()
+
+
+def parallel_search(table: FlightTable, workers: int = None):
+    """
+    :param table: flight table
+    :param workers: number of worker processes. By default the number of CPUs.
+    :return: parallel search of the table, created on first use and kept with the table until it is garbage
+    collected or the number of workers changes
+    """
+    search = getattr(table, '_parallel_search', None)
+
+    if search is None or search.workers != workers:
+        if search is not None:
+            search.close()
+        search = table._parallel_search = ParallelSearch(table, workers)
+        # the search does not reference the table, which releases it once the table is gone
+        weakref.finalize(table, search.close)
+
+    return search
+
+
+def parallel_round_trips(table: FlightTable,
+                         origin: str,          # airport id
+                         destinations: list,
+                         min_day: int,
+                         max_day: int,
+                         min_days: int,
+                         max_days: int,
+                         max_price: float = None,
+                         max_flights_per_airport: int = None,
+                         n: int = None,
+                         workers: int = None):
+    """
+    Finds round-trip flights on a process pool. The search is partitioned by destination airport and by departure
+    day range, every partition yields its cheapest `n` round-trips with the `top_k` algorithm and the sorted
+    partition results are merged by price. Taking `n` round-trips per partition suffices: a round-trip among
+    the `n` cheapest overall, after the airport limit, is among the `n` cheapest of its partition.
+    The shared table and the pool are reused by all searches of the table, see `parallel_search`, and every
+    partition is sent the part of the route index it searches.
+    :param table: flight table
+    :param origin: id of the starting airport
+    :param destinations: ids of the considered destination airports
+    :param min_day: earliest date of departure as day ordinal
+    :param max_day: latest date of return as day ordinal
+    :param min_days: minimal number of days a round-trip should last
+    :param max_days: maximal number of days a round-trip may last
+    :param max_price: maximal full price of the round-trip
+    :param max_flights_per_airport: maximal number of round-trip flights per airport
+    :param n: number of round-trips needed from every partition. By default all round-trips.
+    :param workers: number of worker processes. By default the number of CPUs.
+    :return: generator of (flight to X, flight from X) in ascending order by round-trip price
+    """
+    search = parallel_search(table, workers)
+
+    # ranks of the destinations are global, so that merged results are ordered as in a single search
+    destinations = [destination for destination in destinations if destination in table.airport_index]
+    partitions = _partitions(destinations, min_day, max_day - min_days, workers or os.cpu_count())
+    origin_code = table.airport_index[origin]
+
+    futures = []
+
+    for ranks, (min_departure_day, max_departure_day) in partitions:
+        codes = [table.airport_index[destinations[rank]] for rank in ranks]
+        route_index = table.route_index_part([(origin_code, code) for code in codes]
+                                             + [(code, origin_code) for code in codes])
+        futures.append(search.executor.submit(_search_partition,
+                                              route_index=route_index,
+                                              origin=origin,
+                                              destinations=[destinations[rank] for rank in ranks],
+                                              ranks=ranks,
+                                              min_day=min_day,
+                                              max_day=max_day,
+                                              min_days=min_days,
+                                              max_days=max_days,
+                                              max_price=max_price,
+                                              max_flights_per_airport=max_flights_per_airport,
+                                              min_departure_day=min_departure_day,
+                                              max_departure_day=max_departure_day,
+                                              n=n))
+
+    results = [future.result() for future in futures]
+
+    for _, _, _, _, from_row, to_row in heapq.merge(*results):
+        yield table.flight(to_row), table.flight(from_row)
+
+
+def _partitions(destinations, min_departure_day, max_departure_day, workers):
+    """
+    Splits the search into about two partitions per worker, first by destination and then by departure days.
+    :return: list of (destination ranks, (min departure day, max departure day))
+    """
+    target = 2 * workers
+    destination_groups = min(len(destinations), target) or 1
+    day_groups = max(1, min(-(-target // destination_groups), max_departure_day - min_departure_day + 1))
+    day_bounds = np.linspace(min_departure_day, max_departure_day + 1, day_groups + 1).astype(int)
+
+    return [(list(range(group, len(destinations), destination_groups)), (int(start), int(end) - 1))
+            for group in range(destination_groups)
+            for start, end in zip(day_bounds[:-1], day_bounds[1:]) if start < end]
+
+
+def _column_views(buffer, length):
+    """
+    :return: column name -> array backed by the buffer
+    """
+    columns = {}
+    offset = 0
+
+    for name, dtype in SHARED_COLUMNS:
+        columns[name] = np.ndarray(length, dtype=dtype, buffer=buffer, offset=offset)
+        offset += np.dtype(dtype).itemsize * length
+
+    return columns
+
+
+def _attach(spec):
+    """
+    Attaches a worker process to the shared flight table.
+    :param spec: tuple of shared memory name, number of flights, airport id table and currency table
+    """
+    global _worker_table
+
+    name, length, airport_ids, currencies = spec
+    # worker processes share the resource tracker of the parent process, which unlinks the memory
+    memory = shared_memory.SharedMemory(name=name)
+
+    _worker_table = FlightTable(airports=[], airport_ids=airport_ids, currencies=currencies,
+                                **_column_views(memory.buf, length))
+    _worker_table.shared_memory = memory
+
+
+def _search_partition(route_index, origin, destinations, ranks, n, **kwargs):
+    """
+    :param route_index: part of the route index of the parent's table with the routes of the partition
+    :return: list of sort keys of the cheapest `n` round-trips of the partition with global destination ranks
+    """
+    _worker_table._route_index = route_index
+    candidates = top_k_candidates(_worker_table, origin=origin, destinations=destinations, **kwargs)
+
+    return [(full_price, departure_day, return_day, ranks[rank], from_row, to_row)
+            for full_price, departure_day, return_day, rank, from_row, to_row in islice(candidates, n)]
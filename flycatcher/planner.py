@@ -0,0 +1,129 @@
+class RequestPlan:
+    """
+    Slices of flight data (flights on a route in a month) to download in priority order, and the slices which are
+    skipped because their destination is too expensive or the request budget is spent.
+    """
+
+    def __init__(self, origin: str, requests: list, skipped_price: list, skipped_budget: list, fresh: int,
+                 cheapest_fares: dict):
+        """
+        :param origin: id of the starting airport
+        :param requests: (from_airport, to_airport, year, month) tuples to download in this order
+        :param skipped_price: slices of destinations whose cheapest round-trip exceeds the price cap
+        :param skipped_budget: slices beyond the request budget
+        :param fresh: number of slices which are fresh and need no request
+        :param cheapest_fares: destination -> price of the cheapest round-trip
+        """
+        self.origin = origin
+        self.requests = requests
+        self.skipped_price = skipped_price
+        self.skipped_budget = skipped_budget
+        self.fresh = fresh
+        self.cheapest_fares = cheapest_fares
+
+    def __len__(self):
+        return len(self.requests)
+
+    def as_dict(self):
+        """
+        :return: request counts as dictionary
+        """
+        return {
+            'requests': len(self.requests),
+            'skipped_price': len(self.skipped_price),
+            'skipped_budget': len(self.skipped_budget),
+            'fresh': self.fresh
+        }
+
+    def __str__(self):
+        statuses = {}
+        for status, slices in (('download', self.requests), ('over price', self.skipped_price),
+                               ('over budget', self.skipped_budget)):
+            for flight_slice in slices:
+                destination = _destination(flight_slice, self.origin)
+                statuses.setdefault(destination, {}).setdefault(status, []).append('%04d-%02d' % flight_slice[2:])
+
+        lines = ['%-12s %12s %-12s %8s  %s' % ('destination', 'cheapest', 'status', 'requests', 'months')]
+
+        for destination, destination_statuses in statuses.items():
+            cheapest = self.cheapest_fares.get(destination)
+            for status, months in destination_statuses.items():
+                lines.append('%-12s %12s %-12s %8d  %s'
+                             % (destination, '-' if cheapest is None else '%.2f' % cheapest, status, len(months),
+                                ', '.join(sorted(set(months)))))
+
+        lines.append('%d requests planned, %d skipped over price, %d skipped over budget, %d slices fresh'
+                     % (len(self.requests), len(self.skipped_price), len(self.skipped_budget), self.fresh))
+
+        return '\n'.join(lines)
+
+
+def plan_requests(flight_slices: list,
+                  origin: str,
+                  cheapest_fares: dict,
+                  max_price: float = None,
+                  max_requests: int = None,
+                  destination_priority: list = None,
+                  month_priority: list = None,
+                  fresh: int = 0):
+    """
+    Plans downloads of flight slices. Slices of destinations whose cheapest round-trip is more expensive than
+    `max_price` are skipped: no round-trip to them can be cheaper. The remaining slices are ordered by destination,
+    then by month, and requested until `max_requests` is reached. Both directions of a route in a month
+    are planned together, since only together they make round-trips.
+
+    Destinations are ordered as in `destination_priority` followed by the others from the cheapest, months are
+    ordered as in `month_priority` followed by the others in chronological order.
+    :param flight_slices: (from_airport, to_airport, year, month) tuples which need to be downloaded
+    :param origin: id of the starting airport, every slice leads from or to it
+    :param cheapest_fares: destination -> price of the cheapest round-trip in the downloaded date range,
+    e.g. from round trip fares. Destinations without a price are never skipped for their price.
+    :param max_price: maximal price of a round-trip. By default no destination is skipped for its price.
+    :param max_requests: maximal number of requests. By default all slices are requested.
+    :param destination_priority: ids of the destinations to download first
+    :param month_priority: months (%Y-%m) to download first
+    :param fresh: number of slices which need no download, reported in the plan. Default: 0.
+    :return: request plan
+    """
+    if max_requests is not None and max_requests < 0:
+        raise ValueError('`max_requests` must be larger or equal 0')
+
+    destination_priority = {destination: rank for rank, destination in enumerate(destination_priority or [])}
+    month_priority = {month: rank for rank, month in enumerate(month_priority or [])}
+
+    def priority(flight_slice):
+        destination = _destination(flight_slice, origin)
+        month = '%04d-%02d' % flight_slice[2:]
+        return (destination_priority.get(destination, len(destination_priority)),
+                cheapest_fares.get(destination, float('inf')),
+                destination,
+                month_priority.get(month, len(month_priority)),
+                month)
+
+    # both directions of a route in a month form one group, which is requested as a whole
+    groups = {}
+    skipped_price = []
+
+    for flight_slice in flight_slices:
+        cheapest = cheapest_fares.get(_destination(flight_slice, origin))
+
+        if max_price is not None and cheapest is not None and cheapest > max_price:
+            skipped_price.append(flight_slice)
+        else:
+            groups.setdefault(priority(flight_slice), []).append(flight_slice)
+
+    requests = []
+    skipped_budget = []
+
+    for key in sorted(groups):
+        if max_requests is None or len(requests) + len(groups[key]) <= max_requests:
+            requests.extend(groups[key])
+        else:
+            skipped_budget.extend(groups[key])
+
+    return RequestPlan(origin, requests, skipped_price, skipped_budget, fresh, cheapest_fares)
+
+
+def _destination(flight_slice, origin):
+    from_airport, to_airport, _, _ = flight_slice
+    return to_airport if from_airport == origin else from_airport
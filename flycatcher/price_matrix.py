@@ -0,0 +1,153 @@
+from flycatcher.flight_table import FlightTable
+from flycatcher.search import _select_round_trip_rows, _cheapest_per_day
+from datetime import date
+import numpy as np
+import csv
+
+# output formats of the price matrix
+MATRIX_FORMATS = ('heatmap', 'csv', 'npz')
+
+# heatmap cells from the cheapest to the most expensive price class, days without a round-trip are blank
+HEATMAP_SHADES = '█▓▒░·'
+
+
+class PriceMatrix:
+    """
+    Cheapest round-trip prices for every pair of departure and return day.
+
+    `prices[d, i, j]` is the price of the cheapest round-trip to `destinations[d]` departing on `departure_days[i]`
+    and returning on `return_days[j]`, or inf if there is no such round-trip.
+    """
+
+    def __init__(self, destinations: list, departure_days: np.ndarray, return_days: np.ndarray, prices: np.ndarray):
+        """
+        :param destinations: ids of the destination airports
+        :param departure_days: departure days as day ordinals
+        :param return_days: return days as day ordinals
+        :param prices: array of prices of shape (destinations, departure days, return days)
+        """
+        self.destinations = destinations
+        self.departure_days = departure_days
+        self.return_days = return_days
+        self.prices = prices
+
+    @property
+    def departure_dates(self):
+        return [date.fromordinal(int(day)).strftime('%Y-%m-%d') for day in self.departure_days]
+
+    @property
+    def return_dates(self):
+        return [date.fromordinal(int(day)).strftime('%Y-%m-%d') for day in self.return_days]
+
+    def cheapest(self):
+        """
+        :return: array of the cheapest price of any destination for every pair of departure and return day
+        """
+        if len(self.destinations) == 0:
+            return np.full((len(self.departure_days), len(self.return_days)), np.inf)
+
+        return self.prices.min(axis=0)
+
+    def save(self, path: str):
+        """
+        Stores the matrix as NumPy arrays `destinations`, `departure_days`, `return_days` and `prices`.
+        :param path: path to the `.npz` file
+        """
+        np.savez(path,
+                 destinations=np.array(self.destinations, dtype=str),
+                 departure_days=self.departure_days,
+                 return_days=self.return_days,
+                 prices=self.prices)
+
+    def to_csv(self, fh):
+        """
+        Writes one row per destination and departure date with a column per return date.
+        Cells without a round-trip are empty.
+        :param fh: file opened for text writing
+        """
+        writer = csv.writer(fh)
+        writer.writerow(['destination', 'departure'] + self.return_dates)
+
+        for destination, prices in zip(self.destinations, self.prices):
+            for departure_date, row in zip(self.departure_dates, prices.tolist()):
+                writer.writerow([destination, departure_date] + ['' if price == np.inf else '%.2f' % price
+                                                                 for price in row])
+
+    def heatmap(self, destination: str = None):
+        """
+        Renders the matrix as text, rows are departure dates and columns are return dates. Prices are divided into
+        equally sized price classes, see `HEATMAP_SHADES`.
+        :param destination: id of the destination. By default the cheapest price of any destination.
+        :return: heatmap
+        """
+        prices = self.cheapest() if destination is None else self.prices[self.destinations.index(destination)]
+        valid = prices != np.inf
+
+        if not valid.any():
+            return 'no round-trips'
+
+        # price class boundaries at equally spaced quantiles of the available prices
+        bounds = np.quantile(prices[valid], np.linspace(0, 1, len(HEATMAP_SHADES) + 1)[1:-1])
+        shades = np.searchsorted(bounds, prices, 'right')
+
+        return_dates = self.return_dates
+        lines = [' ' * 11 + ''.join(return_date[-2] for return_date in return_dates),
+                 ' ' * 11 + ''.join(return_date[-1] for return_date in return_dates)]
+
+        for departure_date, row_shades, row_valid in zip(self.departure_dates, shades.tolist(), valid.tolist()):
+            lines.append('%s ' % departure_date + ''.join(HEATMAP_SHADES[shade] if available else ' '
+                                                          for shade, available in zip(row_shades, row_valid)))
+
+        limits = [prices[valid].min()] + bounds.tolist() + [prices[valid].max()]
+        lines.append('returns from %s to %s, price classes: %s' % (
+            return_dates[0], return_dates[-1],
+            ', '.join('%s %.2f-%.2f' % (shade, low, high)
+                      for shade, low, high in zip(HEATMAP_SHADES, limits[:-1], limits[1:]))))
+
+        return '\n'.join(lines)
+
+
+def price_matrix(table: FlightTable,
+                 origin: str,          # airport id
+                 destinations: list,
+                 min_day: int,
+                 max_day: int,
+                 min_days: int,
+                 max_days: int,
+                 max_price: float = None):
+    """
+    Computes the price matrix from dense destination x day grids of the cheapest flights, every pair of departure
+    and return day is priced at once with array broadcasting.
+    :param table: flight table
+    :param origin: id of the starting airport
+    :param destinations: ids of the considered destination airports
+    :param min_day: earliest date of departure as day ordinal
+    :param max_day: latest date of return as day ordinal
+    :param min_days: minimal number of days a round-trip should last
+    :param max_days: maximal number of days a round-trip may last
+    :param max_price: maximal full price of the round-trip
+    :return: price matrix of the destinations known to the flight table
+    """
+    destination_codes, outbound, inbound = _select_round_trip_rows(table, origin, destinations, min_day, max_day)
+
+    days = max_day - min_day + 1
+    outbound_price, _ = _cheapest_per_day(table, outbound, table.destination, destination_codes, min_day, days)
+    inbound_price, _ = _cheapest_per_day(table, inbound, table.origin, destination_codes, min_day, days)
+
+    # departures leave at least `min_days` until `max_day`, returns are at least `min_days` after `min_day`
+    departure_days = np.arange(min_day, max_day - min_days + 1)
+    return_days = np.arange(min_day + min_days, max_day + 1)
+
+    prices = outbound_price[:, :len(departure_days), np.newaxis] + inbound_price[:, np.newaxis, min_days:]
+
+    duration = return_days[np.newaxis, :] - departure_days[:, np.newaxis]
+    invalid = (duration < min_days) | (duration > max_days)
+    prices[:, invalid] = np.inf
+
+    if max_price is not None:
+        prices[prices > max_price] = np.inf
+
+    return PriceMatrix(destinations=[table.airport_ids[code] for code in destination_codes.tolist()],
+                       departure_days=departure_days,
+                       return_days=return_days,
+                       prices=prices)
@@ -0,0 +1,123 @@
+from contextlib import contextmanager, nullcontext
+import tracemalloc
+import time
+import json
+
+
+class Profile:
+    """
+    Per-phase wall and CPU time, peak memory and counters of a search.
+
+    Phases are named and accumulate over repeated calls, a phase may contain other phases. Peak memory is measured
+    with `tracemalloc`, which slows the code down, so it is only recorded with `memory`. Functions taking
+    an optional profile do no bookkeeping without one, see `phase`.
+    """
+
+    def __init__(self, memory: bool = False):
+        """
+        :param memory: record the peak memory allocated within every phase. Default: False.
+        """
+        self.memory = memory
+        self.phases = {}
+        self.counters = {}
+        # (traced memory at the start, highest peak of finished inner phases) of every open phase
+        self._stack = []
+
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Records the time spent and the memory allocated within the block as phase `name`.
+        :param name: name of the phase
+        """
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # the peak so far belongs to the enclosing phase
+            if self._stack:
+                self._stack[-1][1] = max(self._stack[-1][1], peak)
+            tracemalloc.reset_peak()
+            self._stack.append([current, current])
+
+        wall, cpu = time.perf_counter(), time.process_time()
+
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            stats = self.phases.setdefault(name, {'calls': 0, 'wall': 0., 'cpu': 0., 'peak_memory': 0})
+            stats['calls'] += 1
+            stats['wall'] += wall
+            stats['cpu'] += cpu
+
+            if self.memory:
+                start, inner_peak = self._stack.pop()
+                peak = max(inner_peak, tracemalloc.get_traced_memory()[1])
+                stats['peak_memory'] = max(stats['peak_memory'], peak - start)
+                if self._stack:
+                    self._stack[-1][1] = max(self._stack[-1][1], peak)
+                tracemalloc.reset_peak()
+
+    def iterate(self, name: str, iterable):
+        """
+        Records the time spent producing the items of a lazy iterable as phase `name`, the time the consumer
+        spends on the items is not included.
+        :param name: name of the phase
+        :param iterable: iterable, e.g. a generator of round-trips
+        :return: generator of the items of the iterable
+        """
+        iterator = iter(iterable)
+
+        try:
+            while True:
+                with self.phase(name):
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                yield item
+        finally:
+            # finish abandoned generators so that they record their counters
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    def count(self, **counters):
+        """
+        Increments counters.
+        :param counters: counter name -> increment
+        """
+        for name, increment in counters.items():
+            self.counters[name] = self.counters.get(name, 0) + increment
+
+    def as_dict(self):
+        """
+        :return: phases and counters as dictionary
+        """
+        return {'phases': self.phases, 'counters': self.counters}
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent=2)
+
+    def __str__(self):
+        lines = ['%-20s %8s %12s %12s %12s' % ('phase', 'calls', 'wall [ms]', 'cpu [ms]',
+                                               'memory [MB]' if self.memory else '')]
+
+        for name, stats in self.phases.items():
+            lines.append('%-20s %8d %12.2f %12.2f %12s'
+                         % (name, stats['calls'], stats['wall'] * 1000, stats['cpu'] * 1000,
+                            '%.2f' % (stats['peak_memory'] / 1024 / 1024) if self.memory else ''))
+
+        for name, value in self.counters.items():
+            lines.append('%-20s %d' % (name, value))
+
+        return '\n'.join(lines)
+
+
+def phase(profile: Profile, name: str):
+    """
+    :param profile: profile or None
+    :param name: name of the phase
+    :return: context recording phase `name` in the profile, doing nothing without a profile
+    """
+    return nullcontext() if profile is None else profile.phase(name)
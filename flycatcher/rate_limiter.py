@@ -0,0 +1,78 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+    """
+
+    def __init__(self,
+                 rate: float,
+                 capacity: float = 1):
+        """
+        :param rate: number of tokens added per second
+        :param capacity: maximal number of stored tokens, i.e. the size of a burst. Default: 1.
+        """
+        if rate <= 0:
+            raise ValueError('`rate` must be larger than 0')
+        if capacity < 1:
+            raise ValueError('`capacity` must be at least 1')
+
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate: float):
+        """
+        Changes the number of tokens added per second. Tokens accumulated so far are kept.
+        :param rate: number of tokens added per second
+        """
+        if rate <= 0:
+            raise ValueError('`rate` must be larger than 0')
+
+        with self._lock:
+            self._refill()
+            self.rate = rate
+
+    def _refill(self):
+        """
+        Adds tokens accumulated since the last update. Must be called while holding the lock.
+        """
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1):
+        """
+        Blocks until the requested number of tokens is available and takes them.
+        :param tokens: number of tokens. Default: 1.
+        """
+        while True:
+            with self._lock:
+                self._refill()
+
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+
+                sleep_duration = (tokens - self._tokens) / self.rate
+
+            time.sleep(sleep_duration)
+
+    def try_acquire(self, tokens: float = 1):
+        """
+        Takes the requested number of tokens if they are available without waiting.
+        :param tokens: number of tokens. Default: 1.
+        :return: number of seconds until the tokens are available, 0 if they were taken
+        """
+        with self._lock:
+            self._refill()
+
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0
+
+            return (tokens - self._tokens) / self.rate
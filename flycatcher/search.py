@@ -0,0 +1,390 @@
+from flycatcher.profiling import Profile, phase
+from collections import deque
+import numpy as np
+import heapq
+
+
+def vectorized_round_trips(table,
+                           origin: str,          # airport id
+                           destinations: list,
+                           min_day: int,
+                           max_day: int,
+                           min_days: int,
+                           max_days: int,
+                           max_price: float = None,
+                           profile: Profile = None):
+    """
+    Finds round-trip flights by joining outbound and return flights of every destination with array broadcasting.
+    :param table: flight table
+    :param origin: id of the starting airport
+    :param destinations: ids of the considered destination airports
+    :param min_day: earliest date of departure as day ordinal
+    :param max_day: latest date of return as day ordinal
+    :param min_days: minimal number of days a round-trip should last
+    :param max_days: maximal number of days a round-trip may last
+    :param max_price: maximal full price of the round-trip
+    :param profile: profile recording the join and sort phases and search counters
+    :return: generator of (flight to X, flight from X) in ascending order by round-trip price
+    """
+    with phase(profile, 'join'):
+        candidates, outbound_flights, date_pairs = _join_round_trips(table, origin, destinations, min_day, max_day,
+                                                                     min_days, max_days, max_price)
+
+    if profile is not None:
+        found = sum(len(full_price) for full_price, *_ in candidates)
+        profile.count(outbound_flights=outbound_flights, date_pairs=date_pairs, candidates=found,
+                      pruned=date_pairs - found)
+
+    if not candidates:
+        return
+
+    with phase(profile, 'sort'):
+        full_price, departure_day, return_day, rank, from_rows, to_rows = (np.concatenate(column)
+                                                                           for column in zip(*candidates))
+
+        # order by price and break ties the same way the index search does
+        order = np.lexsort((to_rows, from_rows, rank, return_day, departure_day, full_price))
+
+    for i in order:
+        yield table.flight(to_rows[i]), table.flight(from_rows[i])
+
+
+def _join_round_trips(table, origin, destinations, min_day, max_day, min_days, max_days, max_price):
+    """
+    :return: tuple of a list of candidate columns (full price, departure day, return day, destination rank,
+    row of flight from X, row of flight to X) per destination, the number of flights to destinations and the number
+    of joined pairs of flights
+    """
+    destination_codes, outbound, inbound = _select_round_trip_rows(table, origin, destinations, min_day, max_day)
+
+    # group flights by destination, stable sort keeps the original flight order within each group
+    outbound = outbound[np.argsort(table.destination[outbound], kind='stable')]
+    inbound = inbound[np.argsort(table.origin[inbound], kind='stable')]
+    outbound_keys = table.destination[outbound]
+    inbound_keys = table.origin[inbound]
+
+    candidates = []
+    date_pairs = 0
+
+    for rank, code in enumerate(destination_codes):
+        to_rows = outbound[np.searchsorted(outbound_keys, code, 'left'):np.searchsorted(outbound_keys, code, 'right')]
+        from_rows = inbound[np.searchsorted(inbound_keys, code, 'left'):np.searchsorted(inbound_keys, code, 'right')]
+
+        if len(to_rows) == 0 or len(from_rows) == 0:
+            continue
+
+        date_pairs += len(to_rows) * len(from_rows)
+
+        # outbound x return join, rows are flights to X and columns are flights from X
+        duration = table.day[from_rows][np.newaxis, :] - table.day[to_rows][:, np.newaxis]
+        full_price = table.price[to_rows][:, np.newaxis] + table.price[from_rows][np.newaxis, :]
+
+        valid = (duration >= min_days) & (duration <= max_days)
+        if max_price is not None:
+            valid &= full_price <= max_price
+
+        to_idx, from_idx = np.nonzero(valid)
+        candidates.append((full_price[to_idx, from_idx],
+                           table.day[to_rows[to_idx]],
+                           table.day[from_rows[from_idx]],
+                           np.full(len(to_idx), rank),
+                           from_rows[from_idx],
+                           to_rows[to_idx]))
+
+    return candidates, len(outbound), date_pairs
+
+
+def sliding_window_round_trips(table,
+                               origin: str,          # airport id
+                               destinations: list,
+                               min_day: int,
+                               max_day: int,
+                               min_days: int,
+                               max_days: int,
+                               max_price: float = None):
+    """
+    Finds for each destination and departure day the cheapest round-trip flight, i.e. the cheapest flight to X
+    on that day combined with the cheapest return within the trip length window. The window minimum is maintained
+    with a monotonic deque, so the search is linear in the number of days.
+    :param table: flight table
+    :param origin: id of the starting airport
+    :param destinations: ids of the considered destination airports
+    :param min_day: earliest date of departure as day ordinal
+    :param max_day: latest date of return as day ordinal
+    :param min_days: minimal number of days a round-trip should last
+    :param max_days: maximal number of days a round-trip may last
+    :param max_price: maximal full price of the round-trip
+    :return: generator of (flight to X, flight from X) in ascending order by round-trip price
+    """
+    destination_codes, outbound, inbound = _select_round_trip_rows(table, origin, destinations, min_day, max_day)
+
+    days = max_day - min_day + 1
+    outbound_price, outbound_row = _cheapest_per_day(table, outbound, table.destination, destination_codes,
+                                                     min_day, days)
+    inbound_price, inbound_row = _cheapest_per_day(table, inbound, table.origin, destination_codes,
+                                                   min_day, days)
+
+    candidates = []
+
+    for rank in range(len(destination_codes)):
+        to_prices = outbound_price[rank].tolist()
+        from_prices = inbound_price[rank].tolist()
+        return_days = _window_minimum(from_prices, min_days, max_days)
+
+        for departure_day, return_day in enumerate(return_days):
+            if return_day < 0 or to_prices[departure_day] == np.inf:
+                continue
+
+            full_price = to_prices[departure_day] + from_prices[return_day]
+            if max_price is None or full_price <= max_price:
+                candidates.append((full_price, departure_day, return_day, rank,
+                                   outbound_row[rank, departure_day], inbound_row[rank, return_day]))
+
+    candidates.sort(key=lambda candidate: candidate[:4])
+
+    for _, _, _, _, to_row, from_row in candidates:
+        yield table.flight(to_row), table.flight(from_row)
+
+
+def top_k_round_trips(table,
+                      origin: str,          # airport id
+                      destinations: list,
+                      min_day: int,
+                      max_day: int,
+                      min_days: int,
+                      max_days: int,
+                      max_price: float = None,
+                      max_flights_per_airport: int = None,
+                      profile: Profile = None):
+    """
+    Lazily finds round-trip flights by a k-way merge over per-flight candidate streams. Every flight to X starts
+    a stream of its returns sorted by price. Only the head of each stream, the cheapest return in the trip length
+    window, is computed upfront. The rest of a stream is built once its head is yielded, so the cost of the search
+    depends on the number of consumed round-trips rather than on the number of all possible round-trips.
+    :param table: flight table
+    :param origin: id of the starting airport
+    :param destinations: ids of the considered destination airports
+    :param min_day: earliest date of departure as day ordinal
+    :param max_day: latest date of return as day ordinal
+    :param min_days: minimal number of days a round-trip should last
+    :param max_days: maximal number of days a round-trip may last
+    :param max_price: maximal full price of the round-trip
+    :param max_flights_per_airport: maximal number of yielded round-trip flights per airport.
+    Streams of airports that reached the limit are dropped.
+    :param profile: profile recording the phase of building stream heads and search counters
+    :return: generator of (flight to X, flight from X) in ascending order by round-trip price
+    """
+    for _, _, _, _, from_row, to_row in top_k_candidates(table,
+                                                         origin=origin,
+                                                         destinations=destinations,
+                                                         min_day=min_day,
+                                                         max_day=max_day,
+                                                         min_days=min_days,
+                                                         max_days=max_days,
+                                                         max_price=max_price,
+                                                         max_flights_per_airport=max_flights_per_airport,
+                                                         profile=profile):
+        yield table.flight(to_row), table.flight(from_row)
+
+
+def top_k_candidates(table,
+                     origin: str,          # airport id
+                     destinations: list,
+                     min_day: int,
+                     max_day: int,
+                     min_days: int,
+                     max_days: int,
+                     max_price: float = None,
+                     max_flights_per_airport: int = None,
+                     min_departure_day: int = None,
+                     max_departure_day: int = None,
+                     profile: Profile = None):
+    """
+    Lazy k-way merge of `top_k_round_trips` yielding sort keys of round-trip flights.
+    :param min_departure_day: consider only departures on or after this day ordinal. Default: `min_day`.
+    :param max_departure_day: consider only departures on or before this day ordinal. Default: `max_day`.
+    :param profile: profile, see `top_k_round_trips`
+    :return: generator of (full price, departure day, return day, destination rank, row of flight from X,
+    row of flight to X) in ascending order. Days are relative to `min_day` and ranks are positions
+    of the destinations in `destinations`, skipping destinations missing from the table.
+    """
+    with phase(profile, 'heads'):
+        destination_codes, outbound, inbound = _select_round_trip_rows(table, origin, destinations, min_day, max_day)
+
+        days = max_day - min_day + 1
+        inbound_price, inbound_row = _cheapest_per_day(table, inbound, table.origin, destination_codes, min_day, days)
+
+        ranks = np.full(len(table.airport_ids), -1, dtype=np.int64)
+        ranks[destination_codes] = np.arange(len(destination_codes))
+
+        # group flights from X by destination and day, streams of returns are cut out of these groups
+        inbound_rank = ranks[table.origin[inbound]]
+        inbound_day = table.day[inbound] - min_day
+        order = np.lexsort((inbound, inbound_day, inbound_rank))
+        inbound, inbound_rank, inbound_day = inbound[order], inbound_rank[order], inbound_day[order]
+        inbound_bounds = np.searchsorted(inbound_rank, np.arange(len(destination_codes) + 1))
+
+        # cheapest return day for every destination and departure day
+        return_days = [_window_minimum(inbound_price[rank].tolist(), min_days, max_days)
+                       for rank in range(len(destination_codes))]
+
+        # restrict departures, returns may still be any day up to `max_day`
+        if min_departure_day is not None or max_departure_day is not None:
+            outbound_day = table.day[outbound]
+            outbound = outbound[(outbound_day >= (min_departure_day if min_departure_day is not None else min_day))
+                                & (outbound_day <= (max_departure_day if max_departure_day is not None else max_day))]
+
+        flight_queue = []
+
+        for to_row, rank, departure_day in zip(outbound.tolist(),
+                                               ranks[table.destination[outbound]].tolist(),
+                                               (table.day[outbound] - min_day).tolist()):
+            return_day = return_days[rank][departure_day]
+            if return_day < 0:
+                continue
+
+            full_price = float(table.price[to_row] + inbound_price[rank, return_day])
+            if max_price is None or full_price <= max_price:
+                flight_queue.append((full_price, departure_day, return_day, rank,
+                                     int(inbound_row[rank, return_day]), to_row, None))
+
+        heapq.heapify(flight_queue)
+
+    # expanded streams of returns per flight to X
+    streams = {}
+    visited_airports = [0] * len(destination_codes)
+    # search counters, recorded once the search is finished
+    heads = len(flight_queue)
+    heap_pops = heap_pushes = dropped = streams_expanded = date_pairs = 0
+
+    try:
+        while flight_queue:
+            full_price, departure_day, return_day, rank, from_row, to_row, position = heapq.heappop(flight_queue)
+            heap_pops += 1
+
+            if max_flights_per_airport is not None:
+                if visited_airports[rank] >= max_flights_per_airport:
+                    # drop the stream, all further round-trips to this airport would be skipped anyway
+                    streams.pop(to_row, None)
+                    dropped += 1
+                    continue
+                visited_airports[rank] += 1
+
+            yield full_price, departure_day, return_day, rank, from_row, to_row
+
+            if position is None:
+                start, end = inbound_bounds[rank], inbound_bounds[rank + 1]
+                window_start = start + np.searchsorted(inbound_day[start:end], departure_day + min_days, 'left')
+                window_end = start + np.searchsorted(inbound_day[start:end], departure_day + max_days, 'right')
+
+                window_rows = inbound[window_start:window_end]
+                window_days = inbound_day[window_start:window_end]
+                streams_expanded += 1
+                date_pairs += int(window_end - window_start)
+
+                # the head of the stream was already yielded
+                keep = window_rows != from_row
+                if max_price is not None:
+                    keep &= table.price[to_row] + table.price[window_rows] <= max_price
+                window_rows, window_days = window_rows[keep], window_days[keep]
+                full_prices = table.price[to_row] + table.price[window_rows]
+                order = np.lexsort((window_rows, window_days, full_prices))
+
+                streams[to_row] = list(zip(full_prices[order].tolist(),
+                                           window_days[order].tolist(),
+                                           window_rows[order].tolist()))
+                position = -1
+
+            stream = streams.get(to_row)
+            if stream is not None and position + 1 < len(stream):
+                full_price, return_day, from_row = stream[position + 1]
+                heapq.heappush(flight_queue, (full_price, departure_day, return_day, rank, from_row, to_row,
+                                              position + 1))
+                heap_pushes += 1
+            else:
+                streams.pop(to_row, None)
+    finally:
+        if profile is not None:
+            profile.count(outbound_flights=len(outbound), heads=heads, date_pairs=date_pairs,
+                          candidates=heads + heap_pushes, pruned=dropped, heap_pushes=heads + heap_pushes,
+                          heap_pops=heap_pops, streams_expanded=streams_expanded)
+
+
+def _select_round_trip_rows(table, origin, destinations, min_day, max_day):
+    """
+    :return: tuple of destination codes, rows of flights to destinations and rows of flights from destinations
+    within the date range
+    """
+    origin_code = table.airport_index[origin]
+    destination_codes = table.encode_airports(destinations)
+
+    outbound = [table.route_rows(origin_code, code, min_day, max_day) for code in destination_codes.tolist()]
+    inbound = [table.route_rows(code, origin_code, min_day, max_day) for code in destination_codes.tolist()]
+    outbound = np.concatenate(outbound) if outbound else np.empty(0, dtype=np.int64)
+    inbound = np.concatenate(inbound) if inbound else np.empty(0, dtype=np.int64)
+
+    return destination_codes, outbound, inbound
+
+
+def _window_minimum(prices: list, min_days: int, max_days: int):
+    """
+    Finds the cheapest day in a sliding window with a monotonic deque.
+    :param prices: price per day, inf if there is no flight
+    :param min_days: start of the window relative to the current day
+    :param max_days: end of the window relative to the current day
+    :return: list of the cheapest day within [day + min_days, day + max_days] for every day, -1 if there is none
+    """
+    days = len(prices)
+    cheapest = [-1] * days
+    # days in the current window, their prices are increasing
+    window = deque()
+    end = 0
+
+    for day in range(days - min_days):
+        # extend the window up to `max_days` after the current day
+        while end < days and end <= day + max_days:
+            if prices[end] != np.inf:
+                while window and prices[window[-1]] > prices[end]:
+                    window.pop()
+                window.append(end)
+            end += 1
+
+        # drop days earlier than `min_days` after the current day
+        while window and window[0] < day + min_days:
+            window.popleft()
+
+        if window:
+            cheapest[day] = window[0]
+
+    return cheapest
+
+
+def _cheapest_per_day(table, rows, airport_column, destination_codes, min_day, days):
+    """
+    Builds dense destination x day grids of the cheapest flight.
+    :param rows: rows of the considered flights
+    :param airport_column: column identifying the destination of a flight
+    :param destination_codes: destination codes, their positions are the grid rows
+    :param min_day: day ordinal of the first grid column
+    :param days: number of grid columns
+    :return: tuple of price grid (inf if there is no flight) and row grid (-1 if there is no flight)
+    """
+    ranks = np.full(len(table.airport_ids), -1, dtype=np.int64)
+    ranks[destination_codes] = np.arange(len(destination_codes))
+
+    rank = ranks[airport_column[rows]]
+    day = table.day[rows] - min_day
+    price = table.price[rows]
+
+    # keep the cheapest, and among equally cheap the first, flight of every destination and day
+    order = np.lexsort((rows, price, day, rank))
+    rank, day, price, rows = rank[order], day[order], price[order], rows[order]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (rank[1:] != rank[:-1]) | (day[1:] != day[:-1])
+
+    price_grid = np.full((len(destination_codes), days), np.inf)
+    row_grid = np.full((len(destination_codes), days), -1, dtype=np.int64)
+    price_grid[rank[first], day[first]] = price[first]
+    row_grid[rank[first], day[first]] = rows[first]
+
+    return price_grid, row_grid
@@ -0,0 +1,86 @@
+from flycatcher.binary_format import is_binary_flight_data, read_flight_table, write_flight_table
+from flycatcher.flight_table import FlightTable
+import tempfile
+import pickle
+import json
+import os
+
+# flight data formats, chosen by the file extension when storing and by the content when loading
+BINARY_EXTENSION = '.flights'
+JSON_EXTENSION = '.json'
+
+
+def load_flight_data(path: str):
+    """
+    :param path: path to flight data stored as pickle, JSON or in the binary flight data format
+    :return: data in the flight data format
+    """
+    if is_binary_flight_data(path):
+        return read_flight_table(path, mmap=False).to_flight_data()
+
+    if path.endswith(JSON_EXTENSION):
+        with open(path, encoding='utf-8') as fh:
+            return json.load(fh)
+
+    with open(path, 'rb') as fh:
+        return pickle.load(fh)
+
+
+def load_flight_table(path: str):
+    """
+    :param path: path to flight data stored as pickle, JSON or in the binary flight data format
+    :return: flight table, memory-mapped if the data is stored in the binary flight data format
+    """
+    if is_binary_flight_data(path):
+        return read_flight_table(path)
+
+    return FlightTable.from_flight_data(load_flight_data(path))
+
+
+def save_flight_data(data, path: str):
+    """
+    Stores flight data atomically, see `write_atomically`.
+    The format is chosen by the extension of `path`: `.flights` for the binary flight data format,
+    `.json` for JSON and pickle otherwise.
+    :param data: data in the flight data format or flight table
+    :param path: path to flight data
+    """
+    def write(fh):
+        if path.endswith(BINARY_EXTENSION):
+            write_flight_table(data if isinstance(data, FlightTable) else FlightTable.from_flight_data(data), fh)
+        elif path.endswith(JSON_EXTENSION):
+            fh.write(json.dumps(data.to_flight_data() if isinstance(data, FlightTable) else data).encode('utf-8'))
+        else:
+            pickle.dump(data.to_flight_data() if isinstance(data, FlightTable) else data, fh)
+
+    write_atomically(path, write)
+
+
+def write_atomically(path: str, write):
+    """
+    Writes a file atomically: the content is written to a temporary file which then replaces `path`,
+    so readers never see a partially written file and a failed write keeps the previous content.
+    :param path: path to the file
+    :param write: function writing the content to a file opened for binary writing
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.%s.' % os.path.basename(path), suffix='.tmp')
+
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            write(fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def file_fingerprint(path: str):
+    """
+    :param path: path to a file
+    :return: fingerprint which changes when the file is modified or replaced
+    """
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
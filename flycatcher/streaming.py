@@ -0,0 +1,228 @@
+from flycatcher.binary_format import read_flight_header, read_flight_records, RECORD_DTYPE, SORTED_BY_DAY
+from flycatcher.flight_table import FlightTable
+from flycatcher.search import top_k_candidates
+from datetime import datetime
+import numpy as np
+
+# number of flight records read from disk at once
+CHUNK_SIZE = 65536
+
+
+class FlightStream:
+    """
+    Flight data stored in the binary flight data format with records sorted by day, read in date-ordered chunks
+    instead of being loaded. Only the airports and the string table are kept in memory.
+    """
+
+    def __init__(self, path: str, chunk_size: int = CHUNK_SIZE):
+        """
+        :param path: path to flight data stored in the binary flight data format
+        :param chunk_size: number of flight records read from disk at once. Default: 65536.
+        """
+        if chunk_size <= 0:
+            raise ValueError('`chunk_size` must be larger than 0')
+
+        strings, self.flight_count, self.records_offset, flags = read_flight_header(path)
+
+        if not flags & SORTED_BY_DAY:
+            raise ValueError('flights of %s are not sorted by day, store the flight data again to sort them' % path)
+
+        self.path = path
+        self.chunk_size = chunk_size
+        self.airports = strings['airports']
+        self.airport_ids = strings['airport_ids']
+        self.airport_index = {airport_id: code for code, airport_id in enumerate(self.airport_ids)}
+        self.currencies = strings['currencies']
+
+    def __len__(self):
+        return self.flight_count
+
+    def date_range(self):
+        """
+        :return: tuple of earliest and latest flight date or None if there are no flights
+        """
+        if self.flight_count == 0:
+            return None
+
+        return (datetime.fromordinal(self._day(0)),
+                datetime.fromordinal(self._day(self.flight_count - 1)))
+
+    def first_row(self, day: int):
+        """
+        Finds the first flight on or after a day with a binary search reading one record per step.
+        :param day: day ordinal
+        :return: row of the first flight on or after the day, the flight count if there is none
+        """
+        low, high = 0, self.flight_count
+
+        while low < high:
+            middle = (low + high) // 2
+            if self._day(middle) < day:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def chunks(self, min_day: int = None):
+        """
+        :param min_day: skip flights before this day ordinal. By default read all flights.
+        :return: generator of (row of the first record, array of `RECORD_DTYPE` records) in date order
+        """
+        start = 0 if min_day is None else self.first_row(min_day)
+        return read_flight_records(self.path, start=start, chunk_size=self.chunk_size)
+
+    def _day(self, row):
+        with open(self.path, 'rb') as fh:
+            fh.seek(self.records_offset + row * RECORD_DTYPE.itemsize)
+            return int(np.fromfile(fh, dtype=RECORD_DTYPE, count=1)['day'][0])
+
+
+def streaming_round_trips(stream: FlightStream,
+                          origin: str,          # airport id
+                          destinations: list,
+                          min_day: int,
+                          max_day: int,
+                          min_days: int,
+                          max_days: int,
+                          max_price: float = None,
+                          max_flights_per_airport: int = None,
+                          n: int = None):
+    """
+    Finds round-trip flights reading the flight data once in date order. Flights to and from the destinations are
+    buffered until every return of their departures was read, i.e. for `max_days` days. Departures are then
+    searched in batches with `top_k_candidates` and the `n` cheapest round-trips of every batch, respecting
+    `max_flights_per_airport`, are merged into the `n` cheapest round-trips so far. Memory is bounded by the flights
+    of `max_days` days and `n` round-trips rather than by the size of the flight data.
+    :param stream: flight data sorted by day
+    :param origin: id of the starting airport
+    :param destinations: ids of the considered destination airports
+    :param min_day: earliest date of departure as day ordinal
+    :param max_day: latest date of return as day ordinal
+    :param min_days: minimal number of days a round-trip should last
+    :param max_days: maximal number of days a round-trip may last
+    :param max_price: maximal full price of the round-trip
+    :param max_flights_per_airport: maximal number of round-trip flights per destination airport
+    :param n: number of needed round-trips. By default all round-trips, which are then all kept in memory.
+    :return: generator of (flight to X, flight from X) in ascending order by round-trip price
+    """
+    origin_code = stream.airport_index[origin]
+    is_destination = np.zeros(len(stream.airport_ids), dtype=bool)
+    is_destination[[stream.airport_index[airport_id] for airport_id in destinations
+                    if airport_id in stream.airport_index]] = True
+    is_destination[origin_code] = False
+
+    # buffered flights to and from the destinations with their rows in the file
+    buffer = np.empty(0, dtype=RECORD_DTYPE)
+    buffer_rows = np.empty(0, dtype=np.int64)
+    # cheapest round-trips so far as (sort key, flight to X, flight from X)
+    round_trips = []
+    # departures up to this day were searched
+    searched_day = min_day - 1
+
+    for row, records in stream.chunks(min_day):
+        days = records['day']
+        keep = (((records['origin'] == origin_code) & is_destination[records['destination']])
+                | ((records['destination'] == origin_code) & is_destination[records['origin']]))
+        keep &= days <= max_day
+
+        buffer = np.concatenate((buffer, records[keep]))
+        buffer_rows = np.concatenate((buffer_rows, row + np.nonzero(keep)[0]))
+
+        if days[-1] > max_day:
+            break
+
+        # flights of the last day of the chunk may continue in the next chunk
+        last_complete_day = int(days[-1]) - 1
+
+        if last_complete_day - max_days > searched_day:
+            round_trips = _merge(round_trips, _search_departures(stream, buffer, buffer_rows, origin, destinations,
+                                                                 searched_day + 1, last_complete_day - max_days,
+                                                                 min_day, max_day, min_days, max_days, max_price,
+                                                                 max_flights_per_airport, n),
+                                 max_flights_per_airport, n)
+            searched_day = last_complete_day - max_days
+
+            # drop flights to the destinations which departed and returns before the next departure's window
+            departed = (buffer['origin'] == origin_code) & (buffer['day'] <= searched_day)
+            passed = (buffer['destination'] == origin_code) & (buffer['day'] < searched_day + 1 + min_days)
+            buffer, buffer_rows = buffer[~(departed | passed)], buffer_rows[~(departed | passed)]
+
+    if searched_day < max_day:
+        round_trips = _merge(round_trips, _search_departures(stream, buffer, buffer_rows, origin, destinations,
+                                                             searched_day + 1, max_day, min_day, max_day, min_days,
+                                                             max_days, max_price, max_flights_per_airport, n),
+                             max_flights_per_airport, n)
+
+    for _, to_flight, from_flight in round_trips:
+        yield to_flight, from_flight
+
+
+def _search_departures(stream, buffer, buffer_rows, origin, destinations, first_day, last_day, min_day, max_day,
+                       min_days, max_days, max_price, max_flights_per_airport, n):
+    """
+    Searches round-trips departing between `first_day` and `last_day` among the buffered flights.
+    :return: list of at most `n` (sort key, flight to X, flight from X) in ascending order, respecting
+    `max_flights_per_airport`. Sort keys are the keys of `top_k_candidates` with days relative to `min_day`
+    and rows of the file.
+    """
+    if len(buffer) == 0:
+        return []
+
+    table = FlightTable(airports=stream.airports,
+                        airport_ids=stream.airport_ids,
+                        currencies=stream.currencies,
+                        origin=buffer['origin'],
+                        destination=buffer['destination'],
+                        day=buffer['day'],
+                        price=buffer['price'],
+                        currency=buffer['currency'])
+
+    # the grids of `top_k_candidates` only span the days of the buffered departures and their returns
+    window_min_day, window_max_day = first_day, min(last_day + max_days, max_day)
+    round_trips = []
+
+    for full_price, departure_day, return_day, rank, from_row, to_row in top_k_candidates(
+            table,
+            origin=origin,
+            destinations=destinations,
+            min_day=window_min_day,
+            max_day=window_max_day,
+            min_days=min_days,
+            max_days=max_days,
+            max_price=max_price,
+            max_flights_per_airport=max_flights_per_airport,
+            min_departure_day=first_day,
+            max_departure_day=last_day):
+        offset = window_min_day - min_day
+        key = (full_price, departure_day + offset, return_day + offset, rank,
+               int(buffer_rows[from_row]), int(buffer_rows[to_row]))
+        round_trips.append((key, table.flight(to_row), table.flight(from_row)))
+
+        if len(round_trips) == n:
+            break
+
+    return round_trips
+
+
+def _merge(round_trips, new_round_trips, max_flights_per_airport, n):
+    """
+    :return: list of the `n` cheapest of both lists of round-trips respecting `max_flights_per_airport`
+    """
+    merged = []
+    visited_airports = {}
+
+    for round_trip in sorted(round_trips + new_round_trips, key=lambda round_trip: round_trip[0]):
+        destination = round_trip[1]['destination']
+
+        if max_flights_per_airport is not None:
+            if visited_airports.get(destination, 0) >= max_flights_per_airport:
+                continue
+            visited_airports[destination] = visited_airports.get(destination, 0) + 1
+
+        merged.append(round_trip)
+
+        if len(merged) == n:
+            break
+
+    return merged
@@ -0,0 +1,378 @@
+from flycatcher.flight_table import FlightTable
+from flycatcher.storage import load_flight_table, write_atomically, file_fingerprint
+from collections import namedtuple
+import numpy as np
+import hashlib
+import logging
+import weakref
+import json
+import os
+
+# summaries are stored next to the flight data as `<path to flight data>.summary`
+SUMMARY_EXTENSION = '.summary'
+
+# version of the stored summaries, summaries of other versions are compiled again
+SUMMARY_VERSION = 1
+
+# cheapest flight of every day on a route, `price[i]` and `position[i]` describe day `first_day + i`.
+# days without flights have an infinite price. `position` indexes the flights on the route sorted by day and row,
+# which stays valid as long as the flights on the route are unchanged, i.e. the digest of the route is the same.
+RouteSummary = namedtuple('RouteSummary', ['digest', 'first_day', 'price', 'position'])
+
+# cheapest round-trip of every trip length on a route and its inverse route, index `i` describes round-trips
+# lasting `i` days. `departure_day` is the day ordinal of the first departure with the cheapest price.
+TripSummary = namedtuple('TripSummary', ['price', 'departure_day'])
+
+
+class FlightSummary:
+    """
+    Materialized summaries of flight data: per-route series of the cheapest flight of every day and per-destination
+    tables of the cheapest round-trip of every trip length. Queries yielding the cheapest round-trip per destination
+    are answered from the summaries without searching the flights.
+    """
+
+    def __init__(self, routes: dict, trips: dict, flight_count: int, date_range: tuple = None, source=None):
+        """
+        :param routes: (origin id, destination id) -> route summary
+        :param trips: (origin id, destination id) -> trip summary
+        :param flight_count: number of flights in the summarized flight data
+        :param date_range: tuple of earliest and latest flight date as day ordinals or None if there are no flights
+        :param source: fingerprint of the summarized flight data file, see `file_fingerprint`
+        """
+        self.routes = routes
+        self.trips = trips
+        self.flight_count = flight_count
+        self.date_range = date_range
+        self.source = source
+        # tables the summary was checked against, see `matches`
+        self._matching_tables = weakref.WeakSet()
+
+    @classmethod
+    def compile(cls, table: FlightTable, previous=None, source=None):
+        """
+        Summarizes the flight table. Summaries of routes whose flights did not change are taken over from
+        the previous summary, so that refreshing some routes only recomputes the summaries of these routes.
+        :param table: flight table
+        :param previous: summary of a previous version of the flight data
+        :param source: fingerprint of the flight data file, see `file_fingerprint`
+        :return: summary
+        """
+        routes = {}
+        reused = 0
+
+        for route, rows, digest in _route_digests(table):
+            if previous is not None and route in previous.routes and previous.routes[route].digest == digest:
+                routes[route] = previous.routes[route]
+                reused += 1
+            else:
+                routes[route] = _summarize_route(table, rows, digest)
+
+        trips = {}
+
+        for (origin, destination), outbound in routes.items():
+            inbound = routes.get((destination, origin))
+
+            if inbound is None:
+                continue
+
+            # unchanged route summaries are the same objects as in the previous summary
+            if previous is not None and (origin, destination) in previous.trips \
+                    and previous.routes.get((origin, destination)) is outbound \
+                    and previous.routes.get((destination, origin)) is inbound:
+                trips[origin, destination] = previous.trips[origin, destination]
+            else:
+                trips[origin, destination] = _summarize_trips(outbound, inbound)
+
+        logging.info('Summarized %d routes, %d unchanged routes taken over from the previous summary.'
+                     % (len(routes), reused))
+
+        return cls(routes=routes,
+                   trips=trips,
+                   flight_count=len(table),
+                   date_range=(int(table.day.min()), int(table.day.max())) if len(table) else None,
+                   source=source)
+
+    def matches(self, table: FlightTable):
+        """
+        :param table: flight table
+        :return: whether the summary was compiled from flights equal to those of the table, i.e. the digests
+        of all routes are equal. Matching tables are remembered, so a table served for many queries is digested once.
+        """
+        if table in self._matching_tables:
+            return True
+        if self.flight_count != len(table):
+            return False
+
+        digests = {route: digest for route, _, digest in _route_digests(table)}
+        if digests != {route: summary.digest for route, summary in self.routes.items()}:
+            return False
+
+        self._matching_tables.add(table)
+        return True
+
+    def round_trips(self,
+                    table: FlightTable,
+                    origin: str,          # airport id
+                    destinations: list,
+                    min_day: int,
+                    max_day: int,
+                    min_days: int,
+                    max_days: int,
+                    max_price: float = None):
+        """
+        Finds the cheapest round-trip to every destination. Queries over the whole date range are looked up in
+        the trip summaries, other queries combine the daily cheapest flights within the date range.
+        :param table: flight table the summary was compiled from
+        :param origin: id of the starting airport
+        :param destinations: ids of the considered destination airports
+        :param min_day: earliest date of departure as day ordinal
+        :param max_day: latest date of return as day ordinal
+        :param min_days: minimal number of days a round-trip should last
+        :param max_days: maximal number of days a round-trip may last
+        :param max_price: maximal full price of the round-trip
+        :return: generator of (flight to X, flight from X) in ascending order by round-trip price
+        """
+        full_range = self.date_range is not None and min_day <= self.date_range[0] and max_day >= self.date_range[1]
+        candidates = []
+
+        for rank, destination in enumerate(destinations):
+            outbound = self.routes.get((origin, destination))
+            inbound = self.routes.get((destination, origin))
+
+            if outbound is None or inbound is None:
+                continue
+
+            if full_range:
+                trip = self.trips[origin, destination]
+                lengths = np.arange(min_days, min(max_days, len(trip.price) - 1) + 1)
+
+                if len(lengths) == 0:
+                    continue
+
+                # cheapest round-trip, ties are broken by departure day and then by return day
+                length = int(lengths[np.lexsort((trip.departure_day[lengths], trip.price[lengths]))[0]])
+                full_price, departure_day = trip.price[length], int(trip.departure_day[length])
+            else:
+                prices = _trip_prices(outbound, inbound, min_day, max_day - min_days, min_days, max_days, max_day)
+
+                if prices.size == 0:
+                    continue
+
+                # argmin returns the first cheapest round-trip in order of departure day and return day
+                departure, length = divmod(int(np.argmin(prices)), prices.shape[1])
+                full_price, departure_day, length = prices[departure, length], min_day + departure, min_days + length
+
+            if full_price == np.inf or (max_price is not None and full_price > max_price):
+                continue
+
+            return_day = departure_day + length
+            origin_code, destination_code = table.airport_index[origin], table.airport_index[destination]
+            to_rows = table.route_rows(origin_code, destination_code)
+            from_rows = table.route_rows(destination_code, origin_code)
+            to_row = to_rows[outbound.position[departure_day - outbound.first_day]]
+            from_row = from_rows[inbound.position[return_day - inbound.first_day]]
+
+            candidates.append((float(full_price), departure_day, return_day, rank, int(from_row), int(to_row)))
+
+        # order by price and break ties the same way the index search does
+        for _, _, _, _, from_row, to_row in sorted(candidates):
+            yield table.flight(to_row), table.flight(from_row)
+
+
+def summarize_flight_data(path: str, incremental: bool = True):
+    """
+    Compiles the summary of flight data and stores it next to the flight data.
+    :param path: path to flight data
+    :param incremental: take over summaries of unchanged routes from the stored summary. Default: True.
+    :return: summary
+    """
+    # fingerprint the file before loading it, a summary of a file replaced meanwhile is then out of date
+    source = file_fingerprint(path)
+    previous = load_summary(path, check=False) if incremental else None
+    summary = FlightSummary.compile(load_flight_table(path), previous=previous, source=source)
+    save_summary(summary, path)
+    return summary
+
+
+def summary_path(path: str):
+    """
+    :param path: path to flight data
+    :return: path to the summary of the flight data
+    """
+    return path + SUMMARY_EXTENSION
+
+
+def save_summary(summary: FlightSummary, path: str):
+    """
+    Stores the summary next to the flight data. The summaries are stored as concatenated arrays in NumPy's `.npz`
+    format, their routes and the other attributes as JSON, so loading a summary does not unpickle anything.
+    :param summary: summary
+    :param path: path to the summarized flight data
+    """
+    routes, trips = list(summary.routes.items()), list(summary.trips.items())
+
+    metadata = json.dumps({
+        'version': SUMMARY_VERSION,
+        'flight_count': summary.flight_count,
+        'date_range': summary.date_range,
+        'source': summary.source,
+        'routes': [[origin, destination, route.digest, route.first_day] for (origin, destination), route in routes],
+        'trips': [[origin, destination] for origin, destination in summary.trips]
+    }).encode('utf-8')
+
+    arrays = {
+        'metadata': np.frombuffer(metadata, dtype=np.uint8),
+        'route_offsets': _offsets([route.price for _, route in routes]),
+        'route_price': _concatenate([route.price for _, route in routes], np.float64),
+        'route_position': _concatenate([route.position for _, route in routes], np.int32),
+        'trip_offsets': _offsets([trip.price for _, trip in trips]),
+        'trip_price': _concatenate([trip.price for _, trip in trips], np.float64),
+        'trip_departure_day': _concatenate([trip.departure_day for _, trip in trips], np.int32)
+    }
+
+    write_atomically(summary_path(path), lambda fh: np.savez(fh, **arrays))
+
+
+def load_summary(path: str, check: bool = True):
+    """
+    :param path: path to flight data
+    :param check: return the summary only if it was compiled from the current flight data file. Default: True.
+    :return: summary stored next to the flight data or None
+    """
+    if not os.path.isfile(summary_path(path)):
+        return None
+
+    try:
+        with np.load(summary_path(path), allow_pickle=False) as arrays:
+            metadata = json.loads(arrays['metadata'].tobytes().decode('utf-8'))
+            if metadata.get('version') != SUMMARY_VERSION:
+                raise ValueError('unsupported version %s' % metadata.get('version'))
+
+            route_price = np.split(arrays['route_price'], arrays['route_offsets'][1:-1])
+            route_position = np.split(arrays['route_position'], arrays['route_offsets'][1:-1])
+            trip_price = np.split(arrays['trip_price'], arrays['trip_offsets'][1:-1])
+            trip_departure_day = np.split(arrays['trip_departure_day'], arrays['trip_offsets'][1:-1])
+    except (OSError, ValueError, KeyError) as e:
+        # e.g. a summary stored by a previous version
+        logging.warning('Summary of %s cannot be read: %s' % (path, e))
+        return None
+
+    routes = {(origin, destination): RouteSummary(digest, first_day, price, position)
+              for (origin, destination, digest, first_day), price, position
+              in zip(metadata['routes'], route_price, route_position)}
+    trips = {(origin, destination): TripSummary(price, departure_day)
+             for (origin, destination), price, departure_day in zip(metadata['trips'], trip_price, trip_departure_day)}
+
+    summary = FlightSummary(routes=routes,
+                            trips=trips,
+                            flight_count=metadata['flight_count'],
+                            date_range=None if metadata['date_range'] is None else tuple(metadata['date_range']),
+                            source=None if metadata['source'] is None else tuple(metadata['source']))
+
+    if check and summary.source != file_fingerprint(path):
+        logging.info('Summary of %s is out of date.' % path)
+        return None
+
+    return summary
+
+
+def _offsets(arrays):
+    """
+    :return: offsets of the arrays in their concatenation followed by its length
+    """
+    return np.cumsum([0] + [len(array) for array in arrays], dtype=np.int64)
+
+
+def _concatenate(arrays, dtype):
+    return np.concatenate(arrays).astype(dtype, copy=False) if arrays else np.empty(0, dtype=dtype)
+
+
+def _route_digests(table):
+    """
+    :return: generator of ((origin id, destination id), rows sorted by day and row, digest) of every route
+    """
+    pairs = np.unique(np.stack([table.origin, table.destination], axis=1), axis=0) if len(table) else []
+
+    for origin_code, destination_code in pairs:
+        rows = table.route_rows(origin_code, destination_code)
+        yield (table.airport_ids[origin_code], table.airport_ids[destination_code]), rows, _route_digest(table, rows)
+
+
+def _route_digest(table, rows):
+    """
+    :return: digest of days, prices and currencies of the flights on a route
+    """
+    digest = hashlib.sha1()
+    digest.update(table.day[rows].astype('<i4').tobytes())
+    digest.update(table.price[rows].astype('<f8').tobytes())
+    digest.update('\0'.join(table.currencies[code] for code in table.currency[rows].tolist()).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _summarize_route(table, rows, digest):
+    """
+    :param rows: rows of the flights on the route sorted by day and row
+    :return: route summary
+    """
+    days = table.day[rows]
+    prices = table.price[rows]
+    first_day = int(days[0])
+
+    # the first of equally priced flights of a day is the cheapest, as in the search
+    order = np.lexsort((np.arange(len(rows)), prices, days))
+    _, first = np.unique(days[order], return_index=True)
+    cheapest = order[first]
+
+    price = np.full(int(days[-1]) - first_day + 1, np.inf)
+    position = np.full(len(price), -1, dtype=np.int32)
+    price[days[cheapest] - first_day] = prices[cheapest]
+    position[days[cheapest] - first_day] = cheapest
+
+    return RouteSummary(digest, first_day, price, position)
+
+
+def _summarize_trips(outbound, inbound):
+    """
+    :return: trip summary of the route and its inverse route
+    """
+    max_days = inbound.first_day + len(inbound.price) - 1 - outbound.first_day
+
+    price = np.full(max(max_days, 0) + 1, np.inf)
+    departure_day = np.zeros(len(price), dtype=np.int32)
+
+    if max_days >= 1:
+        prices = _trip_prices(outbound, inbound, outbound.first_day, outbound.first_day + len(outbound.price) - 1,
+                              1, max_days, inbound.first_day + len(inbound.price) - 1)
+        # argmin returns the earliest departure of the cheapest round-trips
+        departure = np.argmin(prices, axis=0)
+        price[1:] = prices[departure, np.arange(prices.shape[1])]
+        departure_day[1:] = outbound.first_day + departure
+
+    return TripSummary(price, departure_day)
+
+
+def _trip_prices(outbound, inbound, min_departure_day, max_departure_day, min_days, max_days, max_return_day):
+    """
+    :return: array of round-trip prices, rows are departure days and columns are trip lengths.
+    Impossible round-trips have an infinite price.
+    """
+    departure_day = np.arange(min_departure_day, max_departure_day + 1)
+    return_day = departure_day[:, np.newaxis] + np.arange(min_days, max_days + 1)[np.newaxis, :]
+
+    prices = _daily_prices(outbound, departure_day)[:, np.newaxis] + _daily_prices(inbound, return_day)
+    prices[return_day > max_return_day] = np.inf
+
+    return prices
+
+
+def _daily_prices(route, days):
+    """
+    :return: prices of the cheapest flights on the route on the given days, infinite if there is no flight
+    """
+    index = days - route.first_day
+    valid = (index >= 0) & (index < len(route.price))
+
+    prices = np.full(days.shape, np.inf)
+    prices[valid] = route.price[index[valid]]
+
+    return prices
@@ -0,0 +1,91 @@
+from datetime import date, timedelta
+from itertools import product
+from string import ascii_uppercase
+import numpy as np
+
+PRICE_DISTRIBUTIONS = ('lognormal', 'uniform', 'fares')
+
+# base fares of the `fares` price distribution, a surcharge is added to every fare
+BASE_FARES = (9.99, 14.99, 19.99, 29.99, 39.99)
+
+
+def generate_flight_data(airports: int = 50,
+                         days: int = 90,
+                         flights_per_route: float = 1.0,
+                         origins: int = 1,
+                         price_distribution: str = 'lognormal',
+                         mean_price: float = 50.0,
+                         price_spread: float = 0.5,
+                         currency: str = 'EUR',
+                         start_date: date = None,
+                         seed: int = None):
+    """
+    Generates synthetic flight data in the flight data format. Every origin airport is connected in both directions
+    with every other airport, like flight data downloaded for `origins` airports.
+    :param airports: number of airports, including origins
+    :param days: number of days with flights
+    :param flights_per_route: mean number of flights on a route per day, the number of flights is Poisson distributed
+    :param origins: number of origin airports, the first airports in the airport list
+    :param price_distribution: one of `PRICE_DISTRIBUTIONS`. `lognormal` prices have mean `mean_price`
+    and shape `price_spread`. `uniform` prices lie within `mean_price` +/- `price_spread` * `mean_price`. `fares`
+    imitates low-cost fares: one of `BASE_FARES` plus a whole-number surcharge of mean `mean_price` / 2.
+    Default: lognormal.
+    :param mean_price: mean price of a flight. Default: 50.
+    :param price_spread: shape of the price distribution, see `price_distribution`. Default: 0.5.
+    :param currency: currency of all flights. Default: EUR.
+    :param start_date: date of the first day with flights. By default the current day.
+    :param seed: seed of the random generator. By default the data is not reproducible.
+    :return: data in the flight data format
+    """
+    if price_distribution not in PRICE_DISTRIBUTIONS:
+        raise ValueError('`price_distribution` must be one of: %s' % ', '.join(PRICE_DISTRIBUTIONS))
+    if not 1 <= origins < airports:
+        raise ValueError('`origins` must be at least 1 and smaller than `airports`')
+
+    random = np.random.default_rng(seed)
+
+    if start_date is None:
+        start_date = date.today()
+
+    airport_ids = [''.join(letters) for _, letters in zip(range(airports), product(ascii_uppercase, repeat=3))]
+    routes = [(origin, destination) for origin in airport_ids[:origins] for destination in airport_ids
+              if destination != origin]
+    # routes between origins are listed once per direction already
+    routes += [(destination, origin) for origin, destination in routes if destination not in airport_ids[:origins]]
+
+    counts = random.poisson(flights_per_route, size=(len(routes), days))
+    route, day = np.nonzero(counts)
+    route, day = np.repeat(route, counts[route, day]), np.repeat(day, counts[route, day])
+
+    prices = np.round(_prices(random, len(route), price_distribution, mean_price, price_spread), 2)
+    departure = random.integers(5 * 3600, 23 * 3600, size=len(route)) // 300 * 300
+    duration = random.integers(3600 // 300, 5 * 3600 // 300, size=len(route)) * 300
+    dates = [(start_date + timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range(days)]
+
+    flights = [{
+        'origin': routes[route_index][0],
+        'destination': routes[route_index][1],
+        'date': dates[day_index],
+        'price': price,
+        'currency': currency,
+        'time': '%02d:%02d:00' % (seconds // 3600, seconds % 3600 // 60),
+        'duration': flight_duration
+    } for route_index, day_index, price, seconds, flight_duration
+        in zip(route.tolist(), day.tolist(), prices.tolist(), departure.tolist(), duration.tolist())]
+
+    return {
+        'airports': [{'id': airport_id, 'name': 'Airport %s' % airport_id, 'iata': airport_id}
+                     for airport_id in airport_ids],
+        'flights': flights
+    }
+
+
+def _prices(random, size, price_distribution, mean_price, price_spread):
+    if price_distribution == 'lognormal':
+        # mean of a lognormal distribution is exp(mu + sigma^2 / 2)
+        return random.lognormal(np.log(mean_price) - price_spread ** 2 / 2, price_spread, size=size)
+
+    if price_distribution == 'uniform':
+        return random.uniform(mean_price * (1 - price_spread), mean_price * (1 + price_spread), size=size)
+
+    return random.choice(BASE_FARES, size=size) + random.poisson(mean_price / 2, size=size)
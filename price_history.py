@@ -0,0 +1,67 @@
+from flycatcher.storage import load_flight_data, save_flight_data
+from flycatcher.history import PriceHistory
+from datetime import datetime
+import argparse
+import logging
+import os
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Record snapshots of flight data in a price history and query it.')
+    parser.add_argument('--debug', action='store_true', help='show debug messages')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    append_parser = commands.add_parser('append', help='record the prices of flight data which changed since '
+                                                       'the last snapshot')
+    append_parser.add_argument('history', type=str, help='path to the price history')
+    append_parser.add_argument('data', type=str, help='path to flight data')
+
+    snapshots_parser = commands.add_parser('snapshots', help='list the snapshots of the price history')
+    snapshots_parser.add_argument('history', type=str, help='path to the price history')
+
+    route_parser = commands.add_parser('route', help='print the price history of a route')
+    route_parser.add_argument('history', type=str, help='path to the price history')
+    route_parser.add_argument('origin', type=str, help='IATA of the departure airport')
+    route_parser.add_argument('destination', type=str, help='IATA of the arrival airport')
+    route_parser.add_argument('-date', type=str, help='date of the flights. By default all dates')
+
+    drops_parser = commands.add_parser('drops', help='print the biggest price drops of a snapshot')
+    drops_parser.add_argument('history', type=str, help='path to the price history')
+    drops_parser.add_argument('-snapshot', type=int, default=-1, help='number of the snapshot, negative numbers '
+                                                                      'count from the last. Default: -1')
+    drops_parser.add_argument('-n', type=int, default=20, help='number of printed drops. Default: 20')
+
+    restore_parser = commands.add_parser('restore', help='store the flight data as of a snapshot')
+    restore_parser.add_argument('history', type=str, help='path to the price history')
+    restore_parser.add_argument('out', type=str, help='path where the flight data should be stored')
+    restore_parser.add_argument('-snapshot', type=int, default=-1, help='number of the snapshot, negative numbers '
+                                                                        'count from the last. Default: -1')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO,
+                        format='%(asctime)s %(levelname)-8s %(name)-10.10s %(message)s')
+
+    if args.command != 'append' and not os.path.isfile(args.history):
+        parser.error('price history not found: %s' % args.history)
+
+    history = PriceHistory(args.history)
+
+    if args.command == 'append':
+        changes = history.append(load_flight_data(args.data))
+        logging.info('Recorded %d changed prices in snapshot %d.' % (changes, len(history) - 1))
+    elif args.command == 'snapshots':
+        counts = history.change_counts()
+        for snapshot, time in enumerate(history.times):
+            print('%5d  %s  %8d changes' % (snapshot, time.strftime('%Y-%m-%d %H:%M:%S'), counts[snapshot]))
+    elif args.command == 'route':
+        day = None if args.date is None else datetime.strptime(args.date, '%Y-%m-%d').date()
+        for flight_day, time, price, currency in history.history(args.origin.upper(), args.destination.upper(), day):
+            print('%s  %s  %s' % (flight_day, time.strftime('%Y-%m-%d %H:%M:%S'),
+                                  'removed' if price is None else '%.2f %s' % (price, currency)))
+    elif args.command == 'drops':
+        for origin, destination, flight_day, previous_price, price, currency in history.drops(args.snapshot, args.n):
+            print('%s -> %s  %s  %10.2f -> %10.2f %s  (%.2f)'
+                  % (origin, destination, flight_day, previous_price, price, currency, price - previous_price))
+    elif args.command == 'restore':
+        save_flight_data(history.as_of(args.snapshot), args.out)
+        logging.info('Stored flight data as of snapshot %d in %s.' % (range(len(history))[args.snapshot], args.out))
@@ -1,11 +1,16 @@
 from flycatcher.downloader import Downloader
-from datetime import datetime
+from flycatcher.cache import ResponseCache
+from flycatcher.storage import load_flight_data, save_flight_data
+from flycatcher.journal import Journal
+from flycatcher.summary import summarize_flight_data
+from flycatcher.planner import plan_requests
+from flycatcher.history import PriceHistory
+from datetime import datetime, timedelta
 from setup import ROOT_DIR
 import argparse
 import calendar
 import logging
 import os
-import pickle
 
 
 class RyanairDownloader(Downloader):
@@ -16,9 +21,20 @@ class RyanairDownloader(Downloader):
         'Accept-Language': 'en-US,en;q=0.5',
         'Cache-Control': 'max-age=0',
         'Connection': 'keep-alive',
-        'Host': 'api.ryanair.com',
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:62.0) Gecko/20100101 Firefox/62.0'
     }
+    # number of seconds cached round trip fares stay fresh
+    ROUND_TRIP_FARES_TTL = 3 * 3600
+    # (maximal number of months ahead, ttl) pairs, fares of distant months change rarely
+    CHEAPEST_PER_DAY_TTL = ((0, 3600), (2, 6 * 3600), (5, 24 * 3600), (None, 72 * 3600))
+
+    def __init__(self, api_endpoint: str = API_ENDPOINT, **kwargs):
+        """
+        :param api_endpoint: url of the round trip fares endpoint, e.g. of a `MockFareApi`. By default the Ryanair API.
+        :param kwargs: arguments of `Downloader`
+        """
+        super().__init__(**kwargs)
+        self.api_endpoint = api_endpoint
 
     def get_round_trip_fares(self,
                              origin: str,           # airport iata
@@ -26,7 +42,8 @@ class RyanairDownloader(Downloader):
                              date_to: datetime,
                              language: str = 'en',
                              market: str = 'en-US',
-                             headers=HEADERS):
+                             headers=HEADERS,
+                             ttl: float = None):
         params = dict(
             departureAirportIataCode=origin,
             inboundDepartureDateFrom=date_from.strftime('%Y-%m-%d'),
@@ -37,7 +54,10 @@ class RyanairDownloader(Downloader):
             market=market
         )
 
-        return self._get(self.API_ENDPOINT, params=params, headers=headers)
+        if ttl is None:
+            ttl = self.ROUND_TRIP_FARES_TTL
+
+        return self._get(self.api_endpoint, params=params, headers=headers, ttl=ttl)
 
     def get_cheapest_per_day(self,
                              origin: str,       # airport iata
@@ -45,22 +65,51 @@ class RyanairDownloader(Downloader):
                              month: int,
                              year: int,
                              market: str = 'en-US',
-                             headers=HEADERS):
-        url = self.API_ENDPOINT + '/%s/%s/cheapestPerDay' % (origin, destination)
+                             headers=HEADERS,
+                             ttl: float = None):
+        url = self.api_endpoint + '/%s/%s/cheapestPerDay' % (origin, destination)
 
         params = dict(
             outboundMonthOfDate='%04d-%02d-01' % (year, month),
             market=market
         )
 
-        return self._get(url, params=params, headers=headers)
+        if ttl is None:
+            ttl = self.cheapest_per_day_ttl(month, year)
+
+        return self._get(url, params=params, headers=headers, ttl=ttl)
+
+    def cheapest_per_day_ttl(self, month: int, year: int):
+        """
+        :param month: month of the flights
+        :param year: year of the flights
+        :return: number of seconds cached flights of the month stay fresh
+        """
+        now = datetime.now()
+        months_ahead = (year - now.year) * 12 + month - now.month
+
+        for max_months_ahead, ttl in self.CHEAPEST_PER_DAY_TTL:
+            if max_months_ahead is None or months_ahead <= max_months_ahead:
+                return ttl
 
 
 def get_ryanair_flight_data(origin: str,                # airport iata
                             date_from: datetime = None,
                             date_to: datetime = None,
                             language: str = None,
-                            market: str = None):
+                            market: str = None,
+                            max_workers: int = None,
+                            requests_per_second: float = None,
+                            cache: ResponseCache = None,
+                            previous_data: dict = None,
+                            max_slice_age: timedelta = None,
+                            journal: Journal = None,
+                            downloader: RyanairDownloader = None,
+                            max_price: float = None,
+                            max_requests: int = None,
+                            destination_priority: list = None,
+                            month_priority: list = None,
+                            dry_run: bool = False):
     """
     Downloads and parsed flight data from Ryanair API
     :param origin: IATA of the starting airport
@@ -68,6 +117,26 @@ def get_ryanair_flight_data(origin: str,                # airport iata
     :param date_to: latest date of return. By default equal to the last day of the month after `date_from`.
     :param language: data language
     :param market: language code. Flights prices depend on the market.
+    :param max_workers: number of concurrent requests. Default: 4.
+    :param requests_per_second: rate limit shared by all requests. Default: 1.5.
+    :param cache: response cache. By default responses are not cached.
+    :param previous_data: previously downloaded flight data. If set, only slices (flights on a route in a month)
+    which are missing or older than `max_slice_age` are downloaded and merged with the fresh slices of this data.
+    Slices which fail to download are taken from this data as well.
+    :param max_slice_age: age after which a slice of `previous_data` is downloaded again. Default: 1 day.
+    :param journal: journal every downloaded slice is written to as soon as it is complete. Slices already in
+    the journal and younger than `max_slice_age` are not downloaded again, which allows resuming an interrupted
+    download. By default slices are kept in memory only.
+    :param downloader: downloader sending all requests, e.g. to download from another endpoint or to read its stats
+    afterwards. `max_workers`, `requests_per_second` and `cache` are ignored if set.
+    :param max_price: maximal full price of round-trips of interest. Flights to destinations whose cheapest
+    round trip fare exceeds it are not downloaded. By default flights to all destinations are downloaded.
+    :param max_requests: maximal number of requests of flights on a route in a month. Slices beyond the budget are
+    taken from `previous_data` or the journal if possible. By default all slices are downloaded.
+    :param destination_priority: IATA of destinations to download first. The other destinations are downloaded
+    from the one with the cheapest round trip fare.
+    :param month_priority: months (%Y-%m) to download first, the other months follow in chronological order
+    :param dry_run: return the request plan without downloading flights, see `plan_requests`. Default: False.
     :return:
     """
     if date_to is not None and date_to < datetime.now():
@@ -92,11 +161,25 @@ def get_ryanair_flight_data(origin: str,                # airport iata
     if market is None:
         market = 'en-US'
 
+    if max_workers is None:
+        max_workers = 4
+
+    if requests_per_second is None:
+        requests_per_second = 1.5
+
+    if max_slice_age is None:
+        max_slice_age = timedelta(days=1)
+
     logging.debug('date_from: %s' % date_from.strftime('%Y-%m-%d'))
     logging.debug('date_to: %s' % date_to.strftime('%Y-%m-%d'))
 
-    # initialize downloader, wait up to 500-1000 ms between two requests
-    downloader = RyanairDownloader(wait_between_requests=(500, 1000))
+    # initialize downloader, send up to `max_workers` requests at once within the rate limit
+    # slow down when the API throttles and retry failed requests
+    if downloader is None:
+        downloader = RyanairDownloader(requests_per_second=requests_per_second,
+                                       max_workers=max_workers,
+                                       adaptive_rate=True,
+                                       cache=cache)
 
     # download cheapest fares in the given time period
     # use this information to determine possible destination airports
@@ -112,6 +195,7 @@ def get_ryanair_flight_data(origin: str,                # airport iata
 
     # get origin airport data
     origin_airport = round_trip_fares['fares'][0]['outbound']['departureAirport']
+    origin_city = origin_airport.get('city', {}).get('code')
 
     origin_airport = {
         'id': origin_airport['iataCode'],
@@ -119,9 +203,13 @@ def get_ryanair_flight_data(origin: str,                # airport iata
         'iata': origin_airport['iataCode']
     }
 
+    if origin_city:
+        origin_airport['group'] = origin_city
+
     data = {
         'airports': [],
-        'flights': []
+        'flights': [],
+        'slices': []
     }
 
     # get data of all destination airports
@@ -133,6 +221,10 @@ def get_ryanair_flight_data(origin: str,                # airport iata
             'iata': destination_airport['iataCode'],
         }
 
+        # airports of the same city form a group for open-jaw searches
+        if destination_airport.get('city', {}).get('code'):
+            airport['group'] = destination_airport['city']['code']
+
         data['airports'].append(airport)
 
     logging.debug('destination airports (%d): %s'
@@ -142,6 +234,9 @@ def get_ryanair_flight_data(origin: str,                # airport iata
     # calculate how many months of flight data need to be downloaded
     month_difference = (date_to.year - date_from.year) * 12 + date_to.month - date_from.month
 
+    # list slices of flight data to download: both directions of every route by month
+    flight_slices = []
+
     for destination in data['airports']:
         for current_month_difference in range(month_difference + 1):
             month = (date_from.month - 1 + current_month_difference) % 12 + 1
@@ -149,44 +244,209 @@ def get_ryanair_flight_data(origin: str,                # airport iata
 
             # for each destination download two-way flight data by month
             for from_airport, to_airport in _two_way_generator([(origin, destination['iata'])]):
-                logging.info('Downloading flights from %s to %s on %04d-%02d.'
-                             % (from_airport, to_airport, year, month))
-
-                # get flight data on a route in given month
-                cheapest_per_day = downloader.get_cheapest_per_day(from_airport,
-                                                                   to_airport,
-                                                                   month=month,
-                                                                   year=year,
-                                                                   market=market)
-
-                if cheapest_per_day is None:
-                    logging.warning('Failed to download flights.')
-                else:
-                    for flight in cheapest_per_day['outbound']['fares']:
-
-                        flight_day = datetime.strptime(flight['day'], '%Y-%m-%d')
-
-                        # make sure flight is available and meets the requirements
-                        if flight['price'] \
-                                and not flight['unavailable'] \
-                                and not flight['soldOut'] \
-                                and date_from <= flight_day <= date_to:
-
-                            flight = {
-                                'origin': from_airport,
-                                'destination': to_airport,
-                                'date': flight['day'],
-                                'price': flight['price']['value'],
-                                'currency': flight['price']['currencyCode']
-                            }
-
-                            data['flights'].append(flight)
+                flight_slices.append((from_airport, to_airport, year, month))
+
+    # find slices of the previous data and the journal which do not need to be downloaded again
+    now = datetime.now()
+    previous_slices = {}
+    previous_flights = {}
+    journal_slices = journal.slices() if journal is not None else {}
+
+    if previous_data is not None:
+        for previous_slice in previous_data.get('slices', []):
+            previous_slices[_slice_key(previous_slice)] = previous_slice
+
+        for flight in previous_data['flights']:
+            key = flight['origin'], flight['destination'], flight['date'][:7]
+            previous_flights.setdefault(key, []).append(flight)
+
+    def is_fresh(flight_slice):
+        key = _slice_key(flight_slice)
+        previous_slice = journal_slices.get(key, previous_slices.get(key))
+
+        # slices without a date range are stale, their days are unknown
+        if previous_slice is None or 'date_from' not in previous_slice:
+            return False
+
+        # a slice downloaded for a narrower date range misses days
+        first_date, last_date = _slice_dates(flight_slice, date_from, date_to)
+        return now - datetime.strptime(previous_slice['updated'], '%Y-%m-%dT%H:%M:%S') <= max_slice_age \
+            and previous_slice['date_from'] <= first_date and previous_slice['date_to'] >= last_date
+
+    stale_slices = [flight_slice for flight_slice in flight_slices if not is_fresh(flight_slice)]
+
+    # download the most promising stale slices within the budget, round trip fares bound the price of every route
+    plan = plan_requests(stale_slices,
+                         origin=origin,
+                         cheapest_fares=_cheapest_fares(round_trip_fares),
+                         max_price=max_price,
+                         max_requests=max_requests,
+                         destination_priority=destination_priority,
+                         month_priority=month_priority,
+                         fresh=len(flight_slices) - len(stale_slices))
+
+    if dry_run:
+        return plan
+
+    if journal is not None:
+        journal.append({'type': 'airports', 'airports': data['airports'] + [origin_airport]})
+
+    logging.info('Downloading %d of %d slices, %d skipped over price, %d skipped over budget.'
+                 % (len(plan), len(flight_slices), len(plan.skipped_price), len(plan.skipped_budget)))
+
+    def download_flight_slice(flight_slice):
+        from_airport, to_airport, year, month = flight_slice
+
+        logging.info('Downloading flights from %s to %s on %04d-%02d.'
+                     % (from_airport, to_airport, year, month))
+
+        # get flight data on a route in given month
+        cheapest_per_day = downloader.get_cheapest_per_day(from_airport,
+                                                           to_airport,
+                                                           month=month,
+                                                           year=year,
+                                                           market=market)
+
+        if cheapest_per_day is None:
+            logging.warning('Failed to download flights.')
+            return
+
+        first_date, last_date = _slice_dates(flight_slice, date_from, date_to)
+        record = {
+            'origin': from_airport,
+            'destination': to_airport,
+            'month': '%04d-%02d' % (year, month),
+            'updated': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+            'date_from': first_date,
+            'date_to': last_date
+        }
+        flights = _parse_cheapest_per_day(cheapest_per_day,
+                                          from_airport,
+                                          to_airport,
+                                          date_from=date_from,
+                                          date_to=date_to)
+
+        if journal is not None:
+            journal.append(dict(record, type='slice', flights=flights))
+
+        return record, flights
+
+    # download slices concurrently in the planned order, results are processed in the order of slices
+    downloaded_slices = dict(zip(plan.requests, downloader.map(download_flight_slice, plan.requests)))
+
+    for flight_slice in flight_slices:
+        key = _slice_key(flight_slice)
+
+        if downloaded_slices.get(flight_slice) is not None:
+            record, flights = downloaded_slices[flight_slice]
+        elif key in journal_slices or key in previous_slices:
+            # keep journaled or previous flights, dropping the days outside of the requested date range
+            if key in journal_slices:
+                record = {field: value for field, value in journal_slices[key].items()
+                          if field not in ('type', 'flights')}
+                flights = journal_slices[key]['flights']
+            else:
+                record = dict(previous_slices[key])
+                flights = previous_flights.get(key, [])
+
+            flights = [flight for flight in flights
+                       if date_from <= datetime.strptime(flight['date'], '%Y-%m-%d') <= date_to]
+
+            # the slice covers at most the requested date range now
+            if 'date_from' in record:
+                first_date, last_date = _slice_dates(flight_slice, date_from, date_to)
+                record['date_from'] = max(record['date_from'], first_date)
+                record['date_to'] = min(record['date_to'], last_date)
+        else:
+            continue
+
+        data['flights'].extend(flights)
+        data['slices'].append(record)
 
     data['airports'].append(origin_airport)
 
+    logging.info('Downloaded flight data: %s.' % downloader.stats)
+
     return data
 
 
+def _cheapest_fares(round_trip_fares):
+    """
+    :param round_trip_fares: response of `RyanairDownloader.get_round_trip_fares`
+    :return: dictionary destination IATA -> price of the cheapest round-trip
+    """
+    cheapest_fares = {}
+
+    for fare in round_trip_fares['fares']:
+        destination = fare['outbound']['arrivalAirport']['iataCode']
+
+        if fare.get('summary', {}).get('price') is not None:
+            price = fare['summary']['price']['value']
+        else:
+            price = fare['outbound']['price']['value'] + fare['inbound']['price']['value']
+
+        cheapest_fares[destination] = min(price, cheapest_fares.get(destination, price))
+
+    return cheapest_fares
+
+
+def _parse_cheapest_per_day(cheapest_per_day, from_airport, to_airport, date_from, date_to):
+    """
+    :param cheapest_per_day: response of `RyanairDownloader.get_cheapest_per_day`
+    :param from_airport: IATA of the departure airport
+    :param to_airport: IATA of the arrival airport
+    :param date_from: earliest date of departure
+    :param date_to: latest date of return
+    :return: available flights in the flight data format
+    """
+    flights = []
+
+    for flight in cheapest_per_day['outbound']['fares']:
+
+        flight_day = datetime.strptime(flight['day'], '%Y-%m-%d')
+
+        # make sure flight is available and meets the requirements
+        if flight['price'] \
+                and not flight['unavailable'] \
+                and not flight['soldOut'] \
+                and date_from <= flight_day <= date_to:
+
+            flights.append({
+                'origin': from_airport,
+                'destination': to_airport,
+                'date': flight['day'],
+                'price': flight['price']['value'],
+                'currency': flight['price']['currencyCode']
+            })
+
+    return flights
+
+
+def _slice_key(flight_slice):
+    """
+    :param flight_slice: slice record of the flight data or (from_airport, to_airport, year, month) tuple
+    :return: (from_airport, to_airport, %Y-%m) tuple
+    """
+    if isinstance(flight_slice, dict):
+        return flight_slice['origin'], flight_slice['destination'], flight_slice['month']
+
+    from_airport, to_airport, year, month = flight_slice
+    return from_airport, to_airport, '%04d-%02d' % (year, month)
+
+
+def _slice_dates(flight_slice, date_from, date_to):
+    """
+    :param flight_slice: (from_airport, to_airport, year, month) tuple
+    :param date_from: earliest date of departure
+    :param date_to: latest date of return
+    :return: tuple of the first and the last date (%Y-%m-%d) of the month of the slice within the date range
+    """
+    _, _, year, month = flight_slice
+    first_date = max(datetime(year, month, 1), date_from)
+    last_date = min(datetime(year, month, calendar.monthrange(year, month)[1]), date_to)
+    return first_date.strftime('%Y-%m-%d'), last_date.strftime('%Y-%m-%d')
+
+
 def _two_way_generator(routes):
     for route in iter(routes):
         yield route
@@ -205,6 +465,37 @@ if __name__ == '__main__':
     parser.add_argument('-language', type=str, help='data language. Default: en')
     parser.add_argument('-market', type=str, help='language code. Flights prices depend on the market.'
                                                   ' Default: en-US')
+    parser.add_argument('-workers', type=int, help='number of concurrent requests. Default: 4')
+    parser.add_argument('-requests_per_second', type=float, help='rate limit shared by all requests. Default: 1.5')
+    parser.add_argument('-cache', type=str, help='path to the response cache. Cached responses are reused until '
+                                                 'they expire. By default responses are not cached')
+    parser.add_argument('-cache_size', type=int, default=100, help='maximal size of the response cache in MB. '
+                                                                   'Default: 100')
+    parser.add_argument('-max_slice_age', type=float, default=24,
+                        help='with --incremental, number of hours after which flights on a route in a month are'
+                             ' downloaded again. Default: 24')
+    parser.add_argument('--incremental', action='store_true', help='download only missing or outdated flights and '
+                                                                   'merge them into the existing data file')
+    parser.add_argument('-journal', type=str, help='path to the journal of downloaded flights. '
+                                                   'By default `<out>.journal`')
+    parser.add_argument('--resume', action='store_true', help='resume an interrupted download, '
+                                                              'flights found in the journal are not downloaded again')
+    parser.add_argument('--compact', action='store_true', help='merge flights found in the journal into the data '
+                                                               'file without downloading anything')
+    parser.add_argument('-max_price', type=float, help='skip destinations whose cheapest round-trip is more expensive. '
+                                                       'By default flights to all destinations are downloaded')
+    parser.add_argument('-max_requests', type=int, help='maximal number of requests of flights on a route in a month. '
+                                                        'By default all flights are downloaded')
+    parser.add_argument('-priority', type=str, help='comma-separated list of IATA of destinations to download first. '
+                                                    'By default the cheapest destinations are downloaded first')
+    parser.add_argument('-months', type=str, help='comma-separated list of months (yyyy-mm) to download first. '
+                                                  'By default months are downloaded in chronological order')
+    parser.add_argument('--dry_run', action='store_true', help='print the planned requests without downloading '
+                                                               'flights')
+    parser.add_argument('-history', type=str, help='path to a price history, prices which changed since the last '
+                                                   'download are recorded in it, see `price_history.py`')
+    parser.add_argument('--summarize', action='store_true', help='compile summaries of the stored flight data, '
+                                                                 'see `summarize_flight_data.py`')
     parser.add_argument('--debug', action='store_true', help='show debug messages')
     args = parser.parse_args()
 
@@ -215,12 +506,68 @@ if __name__ == '__main__':
     date_from = None if args.date_from is None else datetime.strptime(args.date_from, '%Y-%m-%d')
     date_to = None if args.date_to is None else datetime.strptime(args.date_to, '%Y-%m-%d')
 
-    with open(path, 'wb') as fh:
+    cache = None if args.cache is None else ResponseCache(args.cache, max_size=args.cache_size * 1024 * 1024)
+
+    journal_path = args.journal if args.journal is not None else path + '.journal'
+
+    if args.compact:
+        if os.path.isfile(journal_path):
+            journal = Journal(journal_path)
+            # the journal of an interrupted incremental download holds only the slices downloaded again
+            data = journal.to_flight_data(load_flight_data(path) if os.path.isfile(path) else None)
+            save_flight_data(data, path)
+            journal.remove()
+
+            if args.history is not None:
+                PriceHistory(args.history).append(data)
+
+            if args.summarize:
+                summarize_flight_data(path)
+        else:
+            logging.error('Journal not found: %s' % journal_path)
+    else:
+        previous_data = None
+        if args.incremental and os.path.isfile(path):
+            previous_data = load_flight_data(path)
+
+        # a dry run must not truncate the journal, a resumed journal tells which flights need no download
+        if args.dry_run:
+            journal = Journal(journal_path) if args.resume and os.path.isfile(journal_path) else None
+        else:
+            journal = Journal(journal_path, resume=args.resume)
+
         data = get_ryanair_flight_data(args.origin.upper(),
                                        date_from=date_from,
                                        date_to=date_to,
                                        language=args.language,
-                                       market=args.market)
-
-        if data:
-            pickle.dump(data, fh)
+                                       market=args.market,
+                                       max_workers=args.workers,
+                                       requests_per_second=args.requests_per_second,
+                                       cache=cache,
+                                       previous_data=previous_data,
+                                       max_slice_age=timedelta(hours=args.max_slice_age),
+                                       journal=journal,
+                                       max_price=args.max_price,
+                                       max_requests=args.max_requests,
+                                       destination_priority=None if args.priority is None
+                                       else args.priority.upper().split(','),
+                                       month_priority=None if args.months is None else args.months.split(','),
+                                       dry_run=args.dry_run)
+
+        if args.dry_run:
+            if data is not None:
+                print(data)
+            if journal is not None:
+                journal.close()
+        # replace the data file only once the download finished, the journal is not needed afterwards
+        elif data:
+            save_flight_data(data, path)
+            journal.remove()
+
+            if args.history is not None:
+                PriceHistory(args.history).append(data)
+
+            if args.summarize:
+                summarize_flight_data(path)
+        else:
+            journal.close()
@@ -0,0 +1,24 @@
+from flycatcher.summary import summarize_flight_data, summary_path
+import argparse
+import logging
+import os
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compile summaries of flight data which answer common queries '
+                                                 'without searching the flights. The summary is stored next to '
+                                                 'the flight data as `<data>.summary`.')
+    parser.add_argument('data', type=str, help='path to flight data')
+    parser.add_argument('--full', action='store_true', help='summarize all routes instead of only the routes '
+                                                            'that changed since the last summary')
+    parser.add_argument('--debug', action='store_true', help='show debug messages')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO,
+                        format='%(asctime)s %(levelname)-8s %(name)-10.10s %(message)s')
+
+    if os.path.isfile(args.data):
+        summarize_flight_data(args.data, incremental=not args.full)
+        logging.info('Stored summary in %s.' % summary_path(args.data))
+    else:
+        logging.error('Flight data not found: %s' % args.data)
@@ -0,0 +1,126 @@
+from flycatcher.synthetic import generate_flight_data
+from cheapest_flights import find_cheapest_flights, find_cheapest_flights_incremental
+from datetime import date, datetime, timedelta
+import unittest
+import random
+
+START_DATE = date(2024, 1, 1)
+
+
+class IncrementalRoundTripsTest(unittest.TestCase):
+    """
+    Compares incremental round-trips after updates with a full `top_k` search of the updated flight data.
+    """
+
+    def setUp(self):
+        self.random = random.Random(0)
+        self.data = generate_flight_data(airports=8, days=40, flights_per_route=1.5, start_date=START_DATE, seed=0)
+        self.origin = self.data['airports'][0]['id']
+        # flight id -> flight, ids order flights like the incremental search does
+        self.flights = dict(enumerate(self.data['flights']))
+        self.next_id = len(self.flights)
+
+    def test_updates(self):
+        query = dict(origin=self.origin, n=30, min_days=2, max_days=10, max_flights_per_airport=5,
+                     min_date=datetime(2024, 1, 1), max_date=datetime(2024, 3, 31))
+        round_trips = find_cheapest_flights_incremental(self.data, block_days=14, **query)
+        self._assert_equal(round_trips, query)
+
+        for _ in range(30):
+            # updates reach up to 40 days beyond the initial flight data
+            self._update(round_trips, first_date=datetime(2024, 1, 1) + timedelta(days=self.random.randint(0, 75)))
+            self._assert_equal(round_trips, query)
+
+    def test_updates_outside_initial_range(self):
+        query = dict(origin=self.origin, min_days=1, max_days=7,
+                     min_date=datetime(2024, 1, 1), max_date=datetime(2024, 3, 31))
+        round_trips = find_cheapest_flights_incremental(self.data, **query)
+
+        # flights to and from a single destination after the last day of the initial flight data
+        for _ in range(20):
+            self._update(round_trips, first_date=datetime(2024, 2, 15) + timedelta(days=self.random.randint(0, 30)),
+                         destination=self.data['airports'][1]['id'])
+
+        self.assertTrue(any(to_flight['date'] >= '2024-02-15' for to_flight, _ in round_trips))
+        self._assert_equal(round_trips, query)
+
+    def test_empty_flight_data(self):
+        data = {'airports': self.data['airports'], 'flights': []}
+
+        with self.assertRaises(ValueError):
+            find_cheapest_flights_incremental(data, self.origin)
+
+        query = dict(origin=self.origin, min_days=1, max_days=7,
+                     min_date=datetime(2024, 1, 1), max_date=datetime(2024, 2, 29))
+        round_trips = find_cheapest_flights_incremental(data, **query)
+        self.assertEqual(len(round_trips), 0)
+
+        # flights on the routes to and from a single destination
+        self.flights, self.next_id = {}, 0
+        for _ in range(20):
+            self._update(round_trips, first_date=datetime(2024, 1, 1) + timedelta(days=self.random.randint(0, 50)),
+                         destination=self.data['airports'][1]['id'])
+
+        self.assertGreater(len(round_trips), 0)
+        self._assert_equal(round_trips, query)
+
+    def _update(self, round_trips, first_date, destination=None):
+        """
+        Replaces the flights of a random route of the origin, or of a route to or from `destination`, in a random
+        date range in both the incremental round-trips and the flights: some are removed or get new prices,
+        some are added.
+        """
+        if destination is None:
+            destination = self.random.choice([airport['id'] for airport in self.data['airports'][1:]])
+        from_airport, to_airport = (self.origin, destination) if self.random.random() < 0.5 \
+            else (destination, self.origin)
+        last_date = first_date + timedelta(days=self.random.randint(0, 10))
+        first, last = first_date.strftime('%Y-%m-%d'), last_date.strftime('%Y-%m-%d')
+
+        replaced = {flight_id: flight for flight_id, flight in self.flights.items()
+                    if flight['origin'] == from_airport and flight['destination'] == to_airport
+                    and first <= flight['date'] <= last}
+        flights = []
+
+        for flight in replaced.values():
+            if self.random.random() < 0.2:
+                continue
+            if self.random.random() < 0.5:
+                flight = dict(flight, price=round(flight['price'] * self.random.uniform(0.3, 1.3), 2))
+            flights.append(flight)
+
+        for _ in range(self.random.randint(1, 3)):
+            day = first_date + timedelta(days=self.random.randint(0, (last_date - first_date).days))
+            flights.append({'origin': from_airport, 'destination': to_airport, 'date': day.strftime('%Y-%m-%d'),
+                            'price': round(self.random.uniform(10, 100), 2), 'currency': 'EUR'})
+
+        # equal flights keep their ids, other flights are added
+        ids = {}
+        for flight_id, flight in replaced.items():
+            ids.setdefault(_flight_key(flight), []).append(flight_id)
+            del self.flights[flight_id]
+
+        for flight in flights:
+            flight_ids = ids.get(_flight_key(flight))
+            if flight_ids:
+                self.flights[flight_ids.pop(0)] = flight
+            else:
+                self.flights[self.next_id] = flight
+                self.next_id += 1
+
+        round_trips.update(from_airport, to_airport, first_date, last_date, flights)
+
+    def _assert_equal(self, round_trips, query):
+        data = {'airports': self.data['airports'], 'flights': [self.flights[key] for key in sorted(self.flights)]}
+        expected = find_cheapest_flights(data, algorithm='top_k', **query) if data['flights'] else []
+
+        self.assertEqual([(_flight_key(to_flight), _flight_key(from_flight)) for to_flight, from_flight in round_trips],
+                         [(_flight_key(to_flight), _flight_key(from_flight)) for to_flight, from_flight in expected])
+
+
+def _flight_key(flight):
+    return tuple(sorted(flight.items()))
+
+
+if __name__ == '__main__':
+    unittest.main()